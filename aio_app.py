@@ -0,0 +1,296 @@
+"""
+aiohttp serving mode for the Teams Productivity Bot
+
+Runs every turn on the worker's single long-lived event loop instead of
+creating a new loop per request, so many turns can be in flight at once.
+The `/`, `/api/health` and `/api/messages` contracts match app.py.
+"""
+
+import os
+import logging
+import time
+import traceback
+from aiohttp import web
+from logging_setup import configure_logging, new_correlation_id
+from metrics import LoopLagMonitor
+from fast_ingest import BodyTooLargeError, IngestError, check_content_length, parse_activity, read_limited
+from turn_queue import TurnQueue, QueueFullError
+from batch_ingest import (
+    BatchError,
+    BatchProcessor,
+    BatchTooLargeError,
+    batch_summary,
+    is_batch_content_type,
+    parse_batch,
+)
+from bot_runtime import (
+    ACK_MODE,
+    BATCH_MAX_ACTIVITIES,
+    BATCH_MAX_BYTES,
+    BATCH_PARALLELISM,
+    MAX_BODY_BYTES,
+    QUEUE_MAXSIZE,
+    QUEUE_WORKERS,
+    QUEUE_FULL_STATUS,
+    QUEUE_RETRY_AFTER,
+    PROFILER,
+    QUEUE_MAX_PER_CONVERSATION,
+    create_adapter_and_bot,
+    create_activity_deduplicator,
+    create_turn_rate_limiter,
+    close_weather_client,
+    close_connector_sender,
+    qr_image,
+    turn_logic,
+    run_turn,
+    health_payload,
+    detailed_health_payload,
+    metrics_payload,
+    observe_request,
+)
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_KEY = web.AppKey("adapter", object)
+BOT_KEY = web.AppKey("bot", object)
+TURN_QUEUE_KEY = web.AppKey("turn_queue", object)
+DEDUP_KEY = web.AppKey("deduplicator", object)
+RATE_LIMIT_KEY = web.AppKey("rate_limiter", object)
+ACTIVITY_KEY = web.RequestKey("activity", object)
+
+
+async def read_activity(request: web.Request):
+    """Parse the /api/messages body once per request, refusing an oversized body before reading it"""
+    if ACTIVITY_KEY not in request:
+        try:
+            check_content_length(request.content_length, MAX_BODY_BYTES)
+            request[ACTIVITY_KEY] = parse_activity(await read_limited(request.content, MAX_BODY_BYTES), MAX_BODY_BYTES)
+        except IngestError as e:
+            request[ACTIVITY_KEY] = e
+    if isinstance(request[ACTIVITY_KEY], IngestError):
+        raise request[ACTIVITY_KEY]
+    return request[ACTIVITY_KEY]
+
+
+@web.middleware
+async def instrument(request: web.Request, handler):
+    """Count and time every request by route, and profile the ones PROFILER picks"""
+    started = time.perf_counter()
+    status = 500
+    session = None
+    if PROFILER.enabled and request.path == "/api/messages":
+        try:
+            text = (await read_activity(request)).text
+        except IngestError:
+            text = None
+        session = PROFILER.start(request.headers.get(PROFILER.header), text)
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        observe_request(route, request.method, status, time.perf_counter() - started)
+        if session is not None:
+            session.finish()
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Prometheus scrape endpoint, aggregated over every worker on the host"""
+    response = web.Response(text=metrics_payload(), content_type="text/plain", charset="utf-8")
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """Health check endpoint"""
+    return web.json_response(health_payload(), status=200)
+
+
+async def detailed_health(request: web.Request) -> web.Response:
+    """Detailed health check with bot status"""
+    try:
+        return web.json_response(detailed_health_payload(), status=200)
+    except Exception as e:
+        logger.error("Health check error: %s", e)
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+
+async def messages(request: web.Request) -> web.Response:
+    """Main bot endpoint for processing messages"""
+    new_correlation_id(request.headers.get("X-Correlation-ID"))
+    try:
+        if "application/json" not in request.headers.get("Content-Type", ""):
+            logger.error("Invalid content type")
+            return web.Response(status=415)
+
+        try:
+            activity = await read_activity(request)
+        except BodyTooLargeError as e:
+            logger.error("Rejected request body: %s", e)
+            return web.Response(text=str(e), status=413)
+        except IngestError as e:
+            logger.error("Invalid request body: %s", e)
+            return web.Response(text=str(e), status=400)
+
+        auth_header = request.headers.get("Authorization", "")
+
+        # Redeliveries are dropped after authentication, by the queue or run_turn
+        turn_queue = request.app.get(TURN_QUEUE_KEY)
+        if turn_queue is not None:
+            try:
+                await turn_queue.submit(activity, auth_header)
+            except PermissionError:
+                logger.warning("Rejected unauthorized activity")
+                return web.Response(status=401)
+            except QueueFullError:
+                logger.warning("Turn queue full, shedding request")
+                return web.Response(
+                    status=QUEUE_FULL_STATUS, headers={"Retry-After": QUEUE_RETRY_AFTER}
+                )
+            return web.Response(status=202)
+
+        await run_turn(
+            request.app[ADAPTER_KEY],
+            request.app[BOT_KEY],
+            activity,
+            auth_header,
+            request.app[RATE_LIMIT_KEY],
+            request.app.get(DEDUP_KEY),
+        )
+        return web.Response(status=202)
+
+    except Exception as e:
+        error_msg = f"Error processing message: {str(e)}"
+        traceback_msg = traceback.format_exc()
+        logger.error(error_msg, exc_info=True)
+
+        # Return the error in the response for debugging, same as the Flask app
+        return web.Response(
+            text=f"DEBUG ERROR: {error_msg}\n\nTRACEBACK:\n{traceback_msg}",
+            status=500,
+            content_type="text/plain"
+        )
+
+
+async def messages_batch(request: web.Request) -> web.Response:
+    """Process a JSON array or NDJSON stream of activities and report per-activity status"""
+    new_correlation_id(request.headers.get("X-Correlation-ID"))
+    content_type = request.headers.get("Content-Type", "")
+    if not is_batch_content_type(content_type):
+        logger.error("Invalid content type")
+        return web.Response(status=415)
+
+    try:
+        # Refuse an oversized body before buffering it, as read_activity() does
+        check_content_length(request.content_length, BATCH_MAX_BYTES)
+        body = await read_limited(request.content, BATCH_MAX_BYTES)
+        items = parse_batch(body, content_type, BATCH_MAX_ACTIVITIES, BATCH_MAX_BYTES)
+    except (BatchTooLargeError, BodyTooLargeError) as e:
+        return web.json_response({"error": str(e)}, status=413)
+    except BatchError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    processor = BatchProcessor(
+        request.app[ADAPTER_KEY],
+        turn_logic(request.app[BOT_KEY]),
+        parallelism=BATCH_PARALLELISM,
+        deduplicator=request.app.get(DEDUP_KEY),
+        rate_limiter=request.app.get(RATE_LIMIT_KEY),
+    )
+    try:
+        results = await processor.process(items, request.headers.get("Authorization", ""))
+    except Exception as e:
+        logger.error("Error processing batch: %s", e, exc_info=True)
+        return web.json_response({"error": f"Error processing batch: {str(e)}"}, status=500)
+
+    logger.debug("Batch of %d activities processed", len(results))
+    return web.json_response(batch_summary(results), status=200)
+
+
+async def qr_png(request: web.Request) -> web.Response:
+    """Rendered QR code referenced from the qr command's card"""
+    key = request.match_info["key"]
+    data = qr_image(key)
+    if data is None:
+        return web.Response(status=404)
+    # Content-addressed, so the image for a key never changes
+    return web.Response(
+        body=data,
+        content_type="image/png",
+        headers={"Cache-Control": "public, max-age=86400, immutable", "ETag": f'"{key}"'}
+    )
+
+
+def create_app(adapter=None, bot=None, ack_mode=ACK_MODE, deduplicator=None, rate_limiter=None) -> web.Application:
+    """Build the aiohttp application; adapter, bot and deduplicator default to the shared runtime
+
+    The runtime's rate limiter applies when the shared adapter is used; pass
+    `rate_limiter` to limit an app built around another adapter.
+    """
+    if adapter is None:
+        adapter, default_bot = create_adapter_and_bot()
+        bot = bot if bot is not None else default_bot
+        if rate_limiter is None:
+            rate_limiter = create_turn_rate_limiter()
+
+    app = web.Application(middlewares=[instrument])
+    app[ADAPTER_KEY] = adapter
+    app[BOT_KEY] = bot
+    app[DEDUP_KEY] = deduplicator if deduplicator is not None else create_activity_deduplicator()
+    app[RATE_LIMIT_KEY] = rate_limiter
+
+    if ack_mode == "queue":
+        turn_queue = TurnQueue(
+            adapter,
+            turn_logic(bot),
+            maxsize=QUEUE_MAXSIZE,
+            workers=QUEUE_WORKERS,
+            max_per_conversation=QUEUE_MAX_PER_CONVERSATION,
+            rate_limiter=rate_limiter,
+            deduplicator=app[DEDUP_KEY],
+        )
+        app[TURN_QUEUE_KEY] = turn_queue
+
+        async def start_queue(app):
+            await turn_queue.start()
+
+        async def stop_queue(app):
+            await turn_queue.stop()
+
+        app.on_startup.append(start_queue)
+        app.on_cleanup.append(stop_queue)
+
+    lag_monitor = LoopLagMonitor("aiohttp")
+
+    async def start_lag_monitor(app):
+        lag_monitor.start()
+
+    async def stop_lag_monitor(app):
+        await lag_monitor.stop()
+
+    app.on_startup.append(start_lag_monitor)
+    app.on_cleanup.append(stop_lag_monitor)
+
+    async def close_clients(app):
+        await close_weather_client()
+        await close_connector_sender()
+
+    app.on_cleanup.append(close_clients)
+
+    app.router.add_get("/", health_check)
+    app.router.add_get("/api/health", detailed_health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/api/messages", messages)
+    app.router.add_post("/api/messages/batch", messages_batch)
+    app.router.add_get("/qr/{key}.png", qr_png)
+    return app
+
+
+if __name__ == "__main__":
+    configure_logging()
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
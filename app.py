@@ -1,152 +1,161 @@
-from flask import Flask, request, Response
-from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
-from botbuilder.schema import Activity
+from flask import Flask, request, Response, g
 import asyncio
 import os
 import logging
+import time
 import traceback
-from datetime import datetime
-from dotenv import load_dotenv
-from my_bot import ProductivityBot
-
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('/tmp/bot.log', mode='a')
-    ]
+from logging_setup import configure_logging, new_correlation_id
+from fast_ingest import BodyTooLargeError, IngestError, check_content_length, parse_activity
+from turn_queue import BackgroundTurnQueue, QueueFullError
+from batch_ingest import (
+    BatchError,
+    BatchProcessor,
+    BatchTooLargeError,
+    batch_summary,
+    is_batch_content_type,
+    parse_batch,
+)
+from bot_runtime import (
+    ACK_MODE,
+    BATCH_MAX_ACTIVITIES,
+    BATCH_MAX_BYTES,
+    BATCH_PARALLELISM,
+    MAX_BODY_BYTES,
+    QUEUE_MAXSIZE,
+    QUEUE_WORKERS,
+    QUEUE_FULL_STATUS,
+    QUEUE_RETRY_AFTER,
+    QUEUE_MAX_PER_CONVERSATION,
+    PROFILER,
+    create_adapter_and_bot,
+    create_activity_deduplicator,
+    create_turn_rate_limiter,
+    qr_image,
+    turn_logic,
+    run_turn,
+    health_payload,
+    detailed_health_payload,
+    metrics_payload,
+    observe_request,
 )
-logger = logging.getLogger(__name__)
-
-# Bot configuration
-APP_ID = os.environ.get("MicrosoftAppId", "")
-APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "")
 
-# Validate required environment variables
-if not APP_ID and not APP_PASSWORD:
-    logger.warning("Bot credentials not configured - running in development mode")
+# Configure logging (queue-based, JSON, size-rotated; see logging_setup.py)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 # Initialize bot components with error handling
-try:
-    adapter_settings = BotFrameworkAdapterSettings(APP_ID, APP_PASSWORD)
-    adapter = BotFrameworkAdapter(adapter_settings)
-    bot = ProductivityBot()
-    logger.info("Bot initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize bot: {e}")
-    # Create minimal adapter for testing
-    adapter_settings = BotFrameworkAdapterSettings("", "")
-    adapter = BotFrameworkAdapter(adapter_settings)
-    bot = None
+adapter, bot = create_adapter_and_bot()
+deduplicator = create_activity_deduplicator()
+rate_limiter = create_turn_rate_limiter()
+
+# Acknowledge-then-process mode hands turns to a background worker pool
+turn_queue = None
+if ACK_MODE == "queue":
+    turn_queue = BackgroundTurnQueue(
+        adapter,
+        turn_logic(bot),
+        maxsize=QUEUE_MAXSIZE,
+        workers=QUEUE_WORKERS,
+        max_per_conversation=QUEUE_MAX_PER_CONVERSATION,
+        rate_limiter=rate_limiter,
+        deduplicator=deduplicator,
+    )
+
+def read_activity():
+    """Parse the /api/messages body once per request, refusing an oversized body before reading it"""
+    if "activity" not in g:
+        try:
+            check_content_length(request.content_length, MAX_BODY_BYTES)
+            g.activity = parse_activity(request.stream.read(MAX_BODY_BYTES + 1), MAX_BODY_BYTES)
+        except IngestError as e:
+            g.activity = e
+    if isinstance(g.activity, IngestError):
+        raise g.activity
+    return g.activity
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    if PROFILER.enabled and request.path == "/api/messages":
+        try:
+            text = read_activity().text
+        except IngestError:
+            text = None
+        g.profile = PROFILER.start(request.headers.get(PROFILER.header), text)
+
+@app.after_request
+def record_request(response):
+    """Count and time every request by route"""
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    observe_request(route, request.method, response.status_code, time.perf_counter() - g.get("started", time.perf_counter()))
+    return response
+
+@app.teardown_request
+def finish_profile(error=None):
+    session = g.pop("profile", None)
+    if session is not None:
+        session.finish()
 
 @app.route("/", methods=["GET"])
 def health_check():
     """Health check endpoint"""
-    return {
-        "status": "healthy", 
-        "service": "teams-productivity-bot",
-        "version": "2.0.0",
-        "features": [
-            "Advanced Calculator",
-            "Weather Information", 
-            "Task Management",
-            "Fun & Games",
-            "Productivity Tools",
-            "Team Utilities"
-        ]
-    }, 200
+    return health_payload(), 200
 
 @app.route("/api/messages", methods=["POST"])
 def messages():
     """Main bot endpoint for processing messages"""
+    new_correlation_id(request.headers.get("X-Correlation-ID"))
     try:
-        logger.info("=== MESSAGE ENDPOINT START ===")
-        logger.info(f"Received request: {request.method} {request.url}")
-        logger.info(f"Content-Type: {request.headers.get('Content-Type', 'Not set')}")
-        logger.info(f"Authorization: {request.headers.get('Authorization', 'Not set')[:50]}...")
-        
+        logger.debug("Received request: %s %s", request.method, request.path)
+
         if "application/json" not in request.headers.get("Content-Type", ""):
             logger.error("Invalid content type")
             return Response(status=415)
 
-        body = request.json
-        if not body:
-            logger.error("Empty request body")
-            return Response(status=400)
-
-        logger.info(f"Request body type: {type(body)}")
-        logger.info(f"Request body keys: {list(body.keys()) if isinstance(body, dict) else 'Not a dict'}")
-        
-        # Test imports first
-        logger.info("Testing botbuilder imports...")
         try:
-            from botbuilder.schema import Activity
-            logger.info("Activity import OK")
-        except Exception as e:
-            logger.error(f"Activity import failed: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            return Response(f"Activity import error: {str(e)}", status=500)
-        
-        # Test Activity creation
-        logger.info("Creating Activity object...")
-        try:
-            activity = Activity().deserialize(body)
-            logger.info(f"Activity created: type={activity.type}")
-        except Exception as e:
-            logger.error(f"Activity creation failed: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            return Response(f"Activity creation error: {str(e)}", status=500)
-        
+            activity = read_activity()
+        except BodyTooLargeError as e:
+            logger.error("Rejected request body: %s", e)
+            return Response(str(e), status=413)
+        except IngestError as e:
+            logger.error("Invalid request body: %s", e)
+            return Response(str(e), status=400)
+
         auth_header = request.headers.get("Authorization", "")
-        
-        logger.info(f"Processing activity: {activity.type}")
 
-        async def aux_func(turn_context):
+        logger.debug("Processing activity: type=%s id=%s", activity.type, activity.id)
+
+        # Redeliveries are dropped after authentication, by the queue or run_turn
+        if turn_queue is not None:
             try:
-                if bot is None:
-                    logger.error("Bot not initialized")
-                    await turn_context.send_activity("Bot is not properly configured")
-                    return
-                
-                # Use the ActivityHandler's on_turn method which will route to the appropriate handler
-                await bot.on_turn(turn_context)
-            except Exception as inner_e:
-                logger.error(f"Error in bot.on_turn: {str(inner_e)}", exc_info=True)
-                raise
+                turn_queue.submit(activity, auth_header)
+            except PermissionError:
+                logger.warning("Rejected unauthorized activity")
+                return Response(status=401)
+            except QueueFullError:
+                logger.warning("Turn queue full, shedding request")
+                return Response(status=QUEUE_FULL_STATUS, headers={"Retry-After": QUEUE_RETRY_AFTER})
+            logger.debug("Activity queued")
+            return Response(status=202)
 
         # Create new event loop for this request
-        logger.info("Creating event loop...")
-        import asyncio
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            logger.info("Processing activity with adapter...")
-            task = adapter.process_activity(activity, auth_header, aux_func)
+            task = run_turn(adapter, bot, activity, auth_header, rate_limiter, deduplicator)
             loop.run_until_complete(task)
-            logger.info("Activity processed successfully")
-        except Exception as e:
-            logger.error(f"Error in adapter.process_activity: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            raise
         finally:
             loop.close()
-        
-        logger.info("Message processed successfully")
-        logger.info("=== MESSAGE ENDPOINT END ===")
+
+        logger.debug("Activity %s processed", activity.id)
         return Response(status=202)
-        
+
     except Exception as e:
         error_msg = f"Error processing message: {str(e)}"
         traceback_msg = traceback.format_exc()
-        logger.error(error_msg, exc_info=True)
-        logger.error(f"Full traceback: {traceback_msg}")
+        logger.error("Error processing message: %s", e, exc_info=True)
         
         # Return the error in the response for debugging
         return Response(
@@ -155,38 +164,71 @@ def messages():
             content_type='text/plain'
         )
 
+@app.route("/api/messages/batch", methods=["POST"])
+def messages_batch():
+    """Process a JSON array or NDJSON stream of activities and report per-activity status"""
+    new_correlation_id(request.headers.get("X-Correlation-ID"))
+    if not is_batch_content_type(request.headers.get("Content-Type", "")):
+        logger.error("Invalid content type")
+        return Response(status=415)
+
+    try:
+        # Refuse an oversized body before buffering it, as read_activity() does
+        check_content_length(request.content_length, BATCH_MAX_BYTES)
+        body = request.stream.read(BATCH_MAX_BYTES + 1)
+        items = parse_batch(body, request.headers.get("Content-Type", ""), BATCH_MAX_ACTIVITIES, BATCH_MAX_BYTES)
+    except (BatchTooLargeError, BodyTooLargeError) as e:
+        return {"error": str(e)}, 413
+    except BatchError as e:
+        return {"error": str(e)}, 400
+
+    processor = BatchProcessor(
+        adapter, turn_logic(bot), parallelism=BATCH_PARALLELISM, deduplicator=deduplicator,
+        rate_limiter=rate_limiter,
+    )
+    # One event loop for the whole batch rather than one per activity
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(
+            processor.process(items, request.headers.get("Authorization", ""))
+        )
+    except Exception as e:
+        logger.error("Error processing batch: %s", e, exc_info=True)
+        return {"error": f"Error processing batch: {str(e)}"}, 500
+    finally:
+        loop.close()
+
+    logger.debug("Batch of %d activities processed", len(results))
+    return batch_summary(results), 200
+
 @app.route("/api/health", methods=["GET"])
 def detailed_health():
     """Detailed health check with bot status"""
     try:
-        # Test if imports work
-        import_status = {
-            "botbuilder": True,
-            "my_bot": True,
-            "flask": True
-        }
-        
-        try:
-            from botbuilder.core import ActivityHandler
-        except ImportError:
-            import_status["botbuilder"] = False
-            
-        try:
-            from my_bot import ProductivityBot
-        except ImportError:
-            import_status["my_bot"] = False
-
-        return {
-            "status": "healthy",
-            "timestamp": str(datetime.now().isoformat()) if datetime else "N/A",
-            "bot_configured": bool(APP_ID and APP_PASSWORD),
-            "environment": os.environ.get("FLASK_ENV", "production"),
-            "imports": import_status
-        }, 200
+        return detailed_health_payload(), 200
     except Exception as e:
-        logger.error(f"Health check error: {e}")
+        logger.error("Health check error: %s", e)
         return {"status": "error", "message": str(e)}, 500
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint, aggregated over every worker on the host"""
+    return Response(metrics_payload(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/qr/<key>.png", methods=["GET"])
+def qr_png(key):
+    """Rendered QR code referenced from the qr command's card"""
+    data = qr_image(key)
+    if data is None:
+        return Response(status=404)
+    # Content-addressed, so the image for a key never changes
+    return Response(
+        data,
+        mimetype="image/png",
+        headers={"Cache-Control": "public, max-age=86400, immutable", "ETag": f'"{key}"'}
+    )
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_ENV") == "development"
@@ -0,0 +1,325 @@
+"""
+Cached inbound Bot Framework authentication
+
+Two caches sit in front of the SDK's token validation:
+
+  * A signing-key cache replacing the SDK's per-process OpenID metadata. Keys
+    are fetched without blocking the event loop, parsed once, and persisted
+    to a private directory shared by every worker on the host, so a freshly
+    forked or recycled gunicorn worker starts warm. The directory and every
+    file read back must belong to this user and be writable by no one else,
+    since a planted key set would let its author forge tokens. Keys older than `refresh_after` are
+    still served while one background refresh fetches new ones
+    (refresh-ahead); an unknown key id triggers a rate-limited refresh.
+
+  * A bounded cache of verified tokens. CachingBotFrameworkAdapter keys it on
+    a digest of the Authorization header plus the channel id and service URL
+    the SDK validates against, and keeps each entry until the token's `exp`,
+    so a repeated token skips signature verification entirely.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import aiohttp
+from botbuilder.core import BotFrameworkAdapter
+from botframework.connector.auth import JwtTokenExtractor
+from jwt.algorithms import RSAAlgorithm
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_LOOKUPS = REGISTRY.counter("bot_auth_token_cache_total", "Verified-token cache lookups by result")
+SIGNING_KEY_REFRESHES = REGISTRY.counter("bot_auth_key_refreshes_total", "OpenID signing key refreshes by outcome")
+
+
+class VerifiedTokenCache:
+    """LRU of verified identities keyed by token digest, each kept until the token expires"""
+
+    def __init__(self, max_entries=1024, max_ttl=3600, clock=time.time):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(auth_header, channel_id, service_url):
+        material = "\n".join((auth_header, channel_id or "", service_url or ""))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, identity = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return identity
+
+    def put(self, key, identity):
+        """Remember a verified identity; identities without a numeric `exp` claim are not cached"""
+        exp = identity.claims.get("exp") if identity.claims else None
+        if not isinstance(exp, (int, float)):
+            return
+        expires_at = min(exp, self.clock() + self.max_ttl)
+        if expires_at <= self.clock():
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, identity)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachingBotFrameworkAdapter(BotFrameworkAdapter):
+    """BotFrameworkAdapter that skips re-validating tokens it has already verified"""
+
+    def __init__(self, settings, token_cache=None):
+        super().__init__(settings)
+        self.token_cache = token_cache if token_cache is not None else VerifiedTokenCache()
+
+    async def _authenticate_request(self, request, auth_header):
+        if not auth_header:
+            return await super()._authenticate_request(request, auth_header)
+
+        key = self.token_cache.key_for(auth_header, request.channel_id, request.service_url)
+        identity = self.token_cache.get(key)
+        if identity is not None:
+            TOKEN_CACHE_LOOKUPS.inc(result="hit")
+            return identity
+
+        TOKEN_CACHE_LOOKUPS.inc(result="miss")
+        identity = await super()._authenticate_request(request, auth_header)
+        self.token_cache.put(key, identity)
+        return identity
+
+
+class SigningKey:
+    """Parsed public key and endorsements, the shape JwtTokenExtractor expects"""
+
+    __slots__ = ("public_key", "endorsements")
+
+    def __init__(self, public_key, endorsements):
+        self.public_key = public_key
+        self.endorsements = endorsements
+
+
+class CachedOpenIdMetadata:
+    """Signing keys for one OpenID metadata URL, shared on disk and refreshed ahead of expiry"""
+
+    def __init__(self, url, cache_dir=None, refresh_after=12 * 3600, max_age=48 * 3600,
+                 min_refresh_interval=300, timeout=10.0, clock=time.time):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.fetched_at = 0.0
+        self.last_attempt = 0.0
+        self._keys = {}
+        self._background = None
+        self._state_lock = threading.Lock()
+        self._path = None
+        if cache_dir:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            if _is_private(os.stat(cache_dir)):
+                self._path = os.path.join(cache_dir, hashlib.sha256(url.encode()).hexdigest()[:16] + ".json")
+            else:
+                logger.warning(
+                    "Not sharing signing keys through %s: it must be owned by this user and not "
+                    "writable by group or others", cache_dir,
+                )
+
+    @property
+    def age(self):
+        return self.clock() - self.fetched_at
+
+    async def get(self, key_id):
+        """Signing key for `key_id`; raises PermissionError if it is unknown"""
+        if self.age > self.max_age:
+            # Nothing usable: another worker may have refreshed the shared file already
+            if not self._load_from_disk():
+                await self._refresh()
+        elif self.age > self.refresh_after:
+            self._refresh_in_background()
+
+        key = self._keys.get(key_id)
+        if key is None and self.clock() - self.last_attempt > self.min_refresh_interval:
+            # Keys rotate; an unknown kid usually means ours are out of date
+            if not self._load_from_disk() or key_id not in self._keys:
+                await self._refresh()
+            key = self._keys.get(key_id)
+        if key is None:
+            raise PermissionError(f"Unknown token signing key: {key_id}")
+        return key
+
+    def _refresh_in_background(self):
+        # A thread with its own loop, because in the Flask sync mode the
+        # request's event loop is closed as soon as the turn finishes
+        with self._state_lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            if self.clock() - self.last_attempt < self.min_refresh_interval:
+                return
+            self.last_attempt = self.clock()
+            self._background = threading.Thread(
+                target=self._refresh_quietly, name="signing-key-refresh", daemon=True
+            )
+            self._background.start()
+
+    def _refresh_quietly(self):
+        try:
+            asyncio.run(self._refresh())
+        except Exception as e:
+            # Keep serving the current keys; the next request past refresh_after retries
+            logger.warning("Background refresh of %s failed: %s", self.url, e)
+
+    async def _refresh(self):
+        self.last_attempt = self.clock()
+        async with _FileLock(self._path + ".lock" if self._path else None, self.timeout):
+            # Another worker may have refreshed the shared file in the meantime
+            if self._load_from_disk() and self.age <= self.refresh_after:
+                return
+            try:
+                document = await self._fetch()
+            except Exception:
+                SIGNING_KEY_REFRESHES.inc(outcome="error")
+                if self._keys:
+                    logger.warning("Could not refresh signing keys from %s, keeping cached keys", self.url)
+                    return
+                raise
+            self._apply(document)
+            self._save_to_disk(document)
+        SIGNING_KEY_REFRESHES.inc(outcome="ok")
+
+    async def _fetch(self):
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self.url) as resp:
+                resp.raise_for_status()
+                jwks_uri = (await resp.json(content_type=None))["jwks_uri"]
+            async with session.get(jwks_uri) as resp:
+                resp.raise_for_status()
+                keys = (await resp.json(content_type=None))["keys"]
+        return {"url": self.url, "fetched_at": self.clock(), "keys": keys}
+
+    def _apply(self, document):
+        keys = {}
+        for jwk in document["keys"]:
+            try:
+                keys[jwk["kid"]] = SigningKey(
+                    RSAAlgorithm.from_jwk(json.dumps(jwk)), jwk.get("endorsements", [])
+                )
+            except (KeyError, ValueError) as e:
+                logger.warning("Skipping unusable signing key from %s: %s", self.url, e)
+        self._keys = keys
+        self.fetched_at = document["fetched_at"]
+
+    def _load_from_disk(self):
+        """Adopt the shared file if it is newer than what we hold; True if it was adopted"""
+        if self._path is None:
+            return False
+        try:
+            fd = os.open(self._path, os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd) as f:
+                if not _is_private(os.fstat(f.fileno())):
+                    logger.warning("Ignoring signing keys in %s: not private to this user", self._path)
+                    return False
+                document = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if document.get("url") != self.url or document.get("fetched_at", 0) <= self.fetched_at:
+            return False
+        if self.clock() - document["fetched_at"] > self.max_age:
+            return False
+        self._apply(document)
+        return True
+
+    def _save_to_disk(self, document):
+        if self._path is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            logger.warning("Could not persist signing keys for %s: %s", self.url, e)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def _is_private(stat):
+    """Whether a file or directory belongs to this user and is writable by no one else"""
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+class _FileLock:
+    """Advisory lock so one worker on the host refreshes at a time while the others wait for its result"""
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self._fd = None
+
+    async def __aenter__(self):
+        if self.path is None:
+            return
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    # The holder is stuck; refreshing without the lock is still safe
+                    return
+                # Poll rather than block so the event loop keeps serving turns
+                await asyncio.sleep(0.05)
+
+    async def __aexit__(self, *exc_info):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class _MetadataRegistry(dict):
+    """Stand-in for JwtTokenExtractor.metadataCache that creates CachedOpenIdMetadata on first use"""
+
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def get(self, url, default=None):
+        if url not in self:
+            self[url] = self.factory(url)
+        return self[url]
+
+
+def install_signing_key_cache(cache_dir=None, **options):
+    """Route the SDK's OpenID metadata lookups, for every metadata URL, through CachedOpenIdMetadata"""
+    registry = _MetadataRegistry(lambda url: CachedOpenIdMetadata(url, cache_dir=cache_dir, **options))
+    JwtTokenExtractor.metadataCache = registry
+    return registry
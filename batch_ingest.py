@@ -0,0 +1,206 @@
+"""
+Batch ingestion for /api/messages/batch
+
+Accepts many activities in one POST, either as a JSON array or as NDJSON
+(one activity per line), for backlog replay after an outage and for internal
+integrations that push notifications into channels.
+
+The bearer token is validated once per distinct channelId, serviceUrl and
+recipient role in the batch rather than once per activity, since those are
+the activity fields Bot Framework token validation depends on. Turns then run concurrently up to
+a parallelism limit, except that activities from the same conversation run
+one after another in the order they appear in the batch. Each authenticated
+activity passes the same token-bucket rate limiter as a single POST, so a
+batch is no way around admission control: an over-limit activity gets the
+canned notice or nothing, and is reported as rate_limited. The caller gets
+a status for every activity.
+"""
+
+import asyncio
+import json
+import logging
+from botbuilder.schema import Activity
+from metrics import REGISTRY
+from rate_limit import notice_logic
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = REGISTRY.histogram(
+    "bot_batch_size", "Activities per batch request", buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+BATCH_ACTIVITIES = REGISTRY.counter("bot_batch_activities_total", "Batched activities by outcome")
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# Per-activity outcomes
+PROCESSED = "processed"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+UNAUTHORIZED = "unauthorized"
+RATE_LIMITED = "rate_limited"
+FAILED = "failed"
+
+
+class BatchError(ValueError):
+    """Raised when a batch body cannot be read at all"""
+
+
+class BatchTooLargeError(BatchError):
+    """Raised when a batch holds more activities than allowed"""
+
+
+def is_ndjson(content_type):
+    return any(kind in (content_type or "") for kind in NDJSON_TYPES)
+
+
+def is_batch_content_type(content_type):
+    return is_ndjson(content_type) or "application/json" in (content_type or "")
+
+
+def parse_batch(body, content_type, max_activities=500, max_bytes=None):
+    """Split a request body into per-activity JSON values
+
+    Returns a list whose items are either a parsed dict or a BatchError for
+    an NDJSON line that could not be parsed, so one bad line does not reject
+    the whole batch. A JSON array body must parse as a whole. Callers read
+    at most `max_bytes + 1` bytes, so a longer body is refused here.
+    """
+    if max_bytes and len(body) > max_bytes:
+        raise BatchTooLargeError(f"Batch body is limited to {max_bytes} bytes")
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            raise BatchError("Body is not valid UTF-8") from None
+    if is_ndjson(content_type):
+        items = []
+        for line_number, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(BatchError(f"line {line_number}: {e}"))
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError as e:
+            raise BatchError(f"Invalid JSON: {e}") from None
+        if not isinstance(items, list):
+            raise BatchError("Expected a JSON array of activities")
+    if not items:
+        raise BatchError("Batch is empty")
+    if len(items) > max_activities:
+        raise BatchTooLargeError(f"Batch is limited to {max_activities} activities")
+    return items
+
+
+def _auth_key(activity):
+    # Token validation depends on these fields only, so one check covers every activity sharing them
+    role = activity.recipient.role if activity.recipient is not None else None
+    return activity.channel_id, activity.service_url, role
+
+
+class BatchProcessor:
+    """Authenticates and runs a batch of activities through the adapter"""
+
+    def __init__(self, adapter, logic, parallelism=8, deduplicator=None, rate_limiter=None):
+        self.adapter = adapter
+        self.logic = logic
+        self.parallelism = parallelism
+        self.deduplicator = deduplicator
+        self.rate_limiter = rate_limiter
+
+    async def process(self, items, auth_header):
+        """Run every item and return one result dict per item, in input order"""
+        BATCH_SIZE.observe(len(items))
+        results = [None] * len(items)
+        activities = []
+        for index, item in enumerate(items):
+            activity = self._deserialize(item)
+            if isinstance(activity, Exception):
+                results[index] = self._result(index, None, INVALID, str(activity))
+            else:
+                activities.append((index, activity))
+
+        identities = await self._authenticate(activities, auth_header or "")
+
+        # One chain per conversation keeps its turns in batch order
+        chains = {}
+        for index, activity in activities:
+            identity = identities[_auth_key(activity)]
+            if isinstance(identity, Exception):
+                results[index] = self._result(index, activity, UNAUTHORIZED, str(identity))
+                continue
+            if self.deduplicator is not None and await self.deduplicator.is_duplicate_async(activity):
+                results[index] = self._result(index, activity, DUPLICATE)
+                continue
+            logic = self.logic
+            if self.rate_limiter is not None:
+                decision = await self.rate_limiter.check_async(activity)
+                if not decision.allowed:
+                    error = f"Over the {decision.scope} rate limit"
+                    results[index] = self._result(index, activity, RATE_LIMITED, error)
+                    if not decision.notify:
+                        continue
+                    logic = notice_logic(decision)
+            conversation = activity.conversation.id if activity.conversation else None
+            chains.setdefault(conversation, []).append((index, activity, identity, logic))
+
+        limit = asyncio.Semaphore(self.parallelism)
+        await asyncio.gather(*(self._run_chain(chain, limit, results) for chain in chains.values()))
+        return results
+
+    @staticmethod
+    def _deserialize(item):
+        if isinstance(item, Exception):
+            return item
+        if not isinstance(item, dict) or not item:
+            return BatchError("Expected an activity object")
+        try:
+            return Activity().deserialize(item)
+        except Exception as e:
+            return BatchError(f"Activity creation error: {e}")
+
+    async def _authenticate(self, activities, auth_header):
+        identities = {}
+        for _, activity in activities:
+            key = _auth_key(activity)
+            if key in identities:
+                continue
+            try:
+                # _authenticate_request is the adapter's documented override point
+                identities[key] = await self.adapter._authenticate_request(activity, auth_header)
+            except PermissionError as e:
+                identities[key] = e
+        return identities
+
+    async def _run_chain(self, chain, limit, results):
+        for index, activity, identity, logic in chain:
+            async with limit:
+                try:
+                    await self.adapter.process_activity_with_identity(activity, identity, logic)
+                except Exception as e:
+                    logger.error("Batched activity %s failed: %s", activity.id, e, exc_info=True)
+                    if self.deduplicator is not None:
+                        await self.deduplicator.forget_async(activity)
+                    results[index] = self._result(index, activity, FAILED, str(e))
+                else:
+                    if results[index] is None:
+                        results[index] = self._result(index, activity, PROCESSED)
+
+    @staticmethod
+    def _result(index, activity, status, error=None):
+        BATCH_ACTIVITIES.inc(status=status)
+        result = {"index": index, "id": activity.id if activity is not None else None, "status": status}
+        if error:
+            result["error"] = error
+        return result
+
+
+def batch_summary(results):
+    """Response body for a processed batch"""
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {"count": len(results), "summary": counts, "results": results}
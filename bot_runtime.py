@@ -0,0 +1,586 @@
+"""
+Shared bot runtime used by both serving modes (Flask/WSGI and aiohttp)
+"""
+
+import atexit
+import gc
+import importlib
+import importlib.util
+import os
+import logging
+import sys
+import time
+from datetime import datetime
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from dotenv import load_dotenv
+from metrics import REGISTRY, MultiprocessDirectory, render_prometheus
+from dedup import create_deduplicator
+from task_store import create_task_store
+from task_views import task_list_activity
+from conversation_state import StateCache, StateMiddleware, create_state_storage
+from polls import CardUpdater, PollAggregator, PollEngine, SqlitePollStore
+from reminders import ProactiveSender, ReminderScheduler, SqliteReminderStore
+from content import Corpus, PasswordGenerator, Rotation, password_reply
+from weather_client import WeatherClient
+from qr_renderer import KEY_PATTERN, PngDirectory, QrRenderer
+from auth_cache import CachingBotFrameworkAdapter, VerifiedTokenCache, install_signing_key_cache
+from outbound import ConnectorSender, OutboundAdapter
+from rate_limit import create_rate_limiter, notice_logic, parse_limit
+from profiling import Profiler, span
+from fast_ingest import DEFAULT_MAX_BODY_BYTES, JSON_DECODER, materialize
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HTTP_REQUESTS = REGISTRY.counter("bot_http_requests_total", "HTTP requests by route, method and status")
+HTTP_LATENCY = REGISTRY.histogram("bot_http_request_seconds", "HTTP request latency by route")
+TURN_LATENCY = REGISTRY.histogram("bot_turn_seconds", "Time the bot spent on a turn, by activity type")
+TURN_ERRORS = REGISTRY.counter("bot_turn_errors_total", "Turns that raised, by error type")
+
+# Bot configuration
+APP_ID = os.environ.get("MicrosoftAppId", "")
+APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "")
+
+SERVICE_NAME = "teams-productivity-bot"
+SERVICE_VERSION = "2.0.0"
+FEATURES = [
+    "Advanced Calculator",
+    "Weather Information",
+    "Task Management",
+    "Fun & Games",
+    "Productivity Tools",
+    "Team Utilities"
+]
+
+# Acknowledge-then-process mode: "sync" runs the turn before answering,
+# "queue" answers 202 at once and runs the turn on a background worker pool
+ACK_MODE = os.environ.get("BOT_ACK_MODE", "sync").lower()
+QUEUE_MAXSIZE = int(os.environ.get("BOT_QUEUE_MAXSIZE", "1000"))
+QUEUE_WORKERS = int(os.environ.get("BOT_QUEUE_WORKERS", "16"))
+QUEUE_FULL_STATUS = int(os.environ.get("BOT_QUEUE_FULL_STATUS", "503"))
+QUEUE_RETRY_AFTER = os.environ.get("BOT_QUEUE_RETRY_AFTER", "1")
+QUEUE_MAX_PER_CONVERSATION = int(os.environ.get("BOT_QUEUE_MAX_PER_CONVERSATION", "100"))
+
+# Admission control: token buckets ("rate:burst", tokens per second) shared through a backend
+RATE_LIMIT_ENABLED = os.environ.get("BOT_RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.environ.get("BOT_RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_PATH = os.environ.get("BOT_RATE_LIMIT_PATH", "/tmp/bot_ratelimit.sqlite3")
+RATE_LIMIT_USER = os.environ.get("BOT_RATE_LIMIT_USER", "1:10")
+RATE_LIMIT_CONVERSATION = os.environ.get("BOT_RATE_LIMIT_CONVERSATION", "3:30")
+# Off unless configured: a whole organisation shares one tenant bucket
+RATE_LIMIT_TENANT = os.environ.get("BOT_RATE_LIMIT_TENANT", "")
+RATE_LIMIT_ACTION = os.environ.get("BOT_RATE_LIMIT_ACTION", "reply").lower()
+RATE_LIMIT_NOTICE_INTERVAL = float(os.environ.get("BOT_RATE_LIMIT_NOTICE_INTERVAL", "30"))
+
+# Inbound auth caches: verified tokens per worker, signing keys shared on disk
+AUTH_CACHE_ENABLED = os.environ.get("BOT_AUTH_CACHE", "true").lower() == "true"
+AUTH_CACHE_DIR = os.environ.get("BOT_AUTH_CACHE_DIR", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "teams-productivity-bot", "auth",
+))
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("BOT_AUTH_TOKEN_CACHE_SIZE", "1024"))
+AUTH_KEY_REFRESH_AFTER = int(os.environ.get("BOT_AUTH_KEY_REFRESH_AFTER", str(12 * 3600)))
+AUTH_KEY_MAX_AGE = int(os.environ.get("BOT_AUTH_KEY_MAX_AGE", str(48 * 3600)))
+
+# Outbound replies: pooled connector client per worker, text replies merged within a window
+OUTBOUND_ENABLED = os.environ.get("BOT_OUTBOUND", "true").lower() == "true"
+OUTBOUND_COALESCE_WINDOW = float(os.environ.get("BOT_OUTBOUND_COALESCE_WINDOW", "0.05"))
+OUTBOUND_MAX_CHARS = int(os.environ.get("BOT_OUTBOUND_MAX_CHARS", "12000"))
+OUTBOUND_POOL_SIZE = int(os.environ.get("BOT_OUTBOUND_POOL_SIZE", "50"))
+OUTBOUND_TIMEOUT = float(os.environ.get("BOT_OUTBOUND_TIMEOUT", "15"))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("BOT_OUTBOUND_MAX_RETRIES", "3"))
+
+# Largest /api/messages body accepted; larger ones get 413 before they are parsed
+MAX_BODY_BYTES = int(os.environ.get("BOT_MAX_BODY_BYTES", str(DEFAULT_MAX_BODY_BYTES)))
+
+# Batch ingestion (/api/messages/batch)
+BATCH_PARALLELISM = int(os.environ.get("BOT_BATCH_PARALLELISM", "8"))
+BATCH_MAX_ACTIVITIES = int(os.environ.get("BOT_BATCH_MAX_ACTIVITIES", "500"))
+BATCH_MAX_BYTES = int(os.environ.get("BOT_BATCH_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# Redelivery de-duplication keyed on (conversation.id, activity.id)
+DEDUP_ENABLED = os.environ.get("BOT_DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_BACKEND = os.environ.get("BOT_DEDUP_BACKEND", "memory").lower()
+DEDUP_TTL = int(os.environ.get("BOT_DEDUP_TTL", "300"))
+DEDUP_MAX_ENTRIES = int(os.environ.get("BOT_DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_PATH = os.environ.get("BOT_DEDUP_PATH", "/tmp/bot_dedup.sqlite3")
+
+# Task storage shared by all workers: memory:// or sqlite:///path/to/file
+TASK_STORE_URL = os.environ.get("BOT_TASK_STORE", "sqlite:///tmp/bot_tasks.sqlite3")
+TASK_PAGE_SIZE = int(os.environ.get("BOT_TASK_PAGE_SIZE", "10"))
+
+# Per-conversation and per-user state: memory://, sqlite:///path or file:///path/to/dir
+STATE_STORE_URL = os.environ.get("BOT_STATE_STORE", "sqlite:///tmp/bot_state.sqlite3")
+STATE_FLUSH_INTERVAL = float(os.environ.get("BOT_STATE_FLUSH_INTERVAL", "0.05"))
+STATE_CACHE_RECORDS = int(os.environ.get("BOT_STATE_CACHE_RECORDS", "1024"))
+
+# Polls: SQLite file shared by all workers, counter shards per option, batching and card update intervals
+POLL_STORE_PATH = os.environ.get("BOT_POLL_STORE", "/tmp/bot_polls.sqlite3")
+POLL_SHARDS = int(os.environ.get("BOT_POLL_SHARDS", "16"))
+POLL_FLUSH_INTERVAL = float(os.environ.get("BOT_POLL_FLUSH_INTERVAL", "0.2"))
+POLL_BATCH_SIZE = int(os.environ.get("BOT_POLL_BATCH_SIZE", "500"))
+POLL_AGGREGATE_INTERVAL = float(os.environ.get("BOT_POLL_AGGREGATE_INTERVAL", "2"))
+POLL_DURATION = int(os.environ.get("BOT_POLL_DURATION", str(24 * 3600)))
+
+# Reminders: SQLite file shared by all workers; one worker at a time holds the scheduler lease
+REMINDER_STORE_PATH = os.environ.get("BOT_REMINDER_STORE", "/tmp/bot_reminders.sqlite3")
+REMINDER_LEASE = float(os.environ.get("BOT_REMINDER_LEASE", "30"))
+REMINDER_HORIZON = float(os.environ.get("BOT_REMINDER_HORIZON", "300"))
+REMINDER_REFRESH = float(os.environ.get("BOT_REMINDER_REFRESH", "5"))
+REMINDER_BATCH_SIZE = int(os.environ.get("BOT_REMINDER_BATCH_SIZE", "100"))
+REMINDER_CONCURRENCY = int(os.environ.get("BOT_REMINDER_CONCURRENCY", "8"))
+
+# Joke and quote corpora (one entry per line) and the password generator's urandom buffer
+CONTENT_DIR = os.environ.get("BOT_CONTENT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+CONTENT_CORPORA = ("jokes", "quotes")
+PASSWORD_BUFFER_BYTES = int(os.environ.get("BOT_PASSWORD_BUFFER_BYTES", "4096"))
+
+# Weather provider (OpenWeatherMap-compatible) and per-worker cache settings
+WEATHER_API_URL = os.environ.get("WEATHER_API_URL", "https://api.openweathermap.org/data/2.5")
+WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "")
+WEATHER_CURRENT_TTL = int(os.environ.get("WEATHER_CURRENT_TTL", "600"))
+WEATHER_FORECAST_TTL = int(os.environ.get("WEATHER_FORECAST_TTL", "1800"))
+WEATHER_TIMEOUT = float(os.environ.get("WEATHER_TIMEOUT", "5"))
+
+# Directory where gunicorn workers publish their metrics for /metrics (empty: this process only)
+METRICS_DIR = os.environ.get("BOT_METRICS_DIR", "/tmp/bot_metrics")
+METRICS_PUBLISH_INTERVAL = float(os.environ.get("BOT_METRICS_PUBLISH_INTERVAL", "5"))
+
+# Opt-in profiling of /api/messages: 1 in N requests, a header, or listed commands
+PROFILE_ENABLED = os.environ.get("BOT_PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_EVERY = int(os.environ.get("BOT_PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_HEADER = os.environ.get("BOT_PROFILE_HEADER", "X-Bot-Profile")
+# The header must carry this value; without one the header never triggers a profile
+PROFILE_SECRET = os.environ.get("BOT_PROFILE_SECRET", "")
+PROFILE_COMMANDS = [c for c in os.environ.get("BOT_PROFILE_COMMANDS", "").replace(",", " ").split() if c]
+PROFILE_DIR = os.environ.get("BOT_PROFILE_DIR", "/tmp/bot_profiles")
+PROFILE_INTERVAL = float(os.environ.get("BOT_PROFILE_INTERVAL", "0.005"))
+PROFILE_MODE = os.environ.get("BOT_PROFILE_MODE", "sampler").lower()
+
+PROFILER = Profiler(
+    enabled=PROFILE_ENABLED,
+    sample_every=PROFILE_SAMPLE_EVERY,
+    header=PROFILE_HEADER,
+    secret=PROFILE_SECRET,
+    commands=PROFILE_COMMANDS,
+    directory=PROFILE_DIR,
+    interval=PROFILE_INTERVAL,
+    mode=PROFILE_MODE,
+)
+
+# Modules the detailed health check reports on: the serving stack, feature
+# dependencies (qrcode/Pillow) that are only imported when a command needs them,
+# and orjson, which /api/messages uses when it is installed
+CHECKED_IMPORTS = ("botbuilder", "flask", "aiohttp", "my_bot", "qrcode", "PIL", "orjson")
+# Extra modules to import in the gunicorn master before forking, e.g. "qrcode,PIL.Image"
+PRELOAD_MODULES = [m for m in os.environ.get("BOT_PRELOAD_MODULES", "").replace(",", " ").split() if m]
+
+# Public base URL of this app, used to build links such as /qr/<key>.png
+PUBLIC_URL = os.environ.get("BOT_PUBLIC_URL", "http://localhost:5000")
+
+# QR rendering: "thread" or "process" pool, in-memory and shared on-disk PNG caches
+QR_POOL = os.environ.get("QR_POOL", "thread").lower()
+QR_POOL_WORKERS = int(os.environ.get("QR_POOL_WORKERS", "2"))
+QR_CACHE_BYTES = int(os.environ.get("QR_CACHE_BYTES", str(16 * 1024 * 1024)))
+QR_CACHE_DIR = os.environ.get("QR_CACHE_DIR", "/tmp/bot_qr")
+QR_DISK_BYTES = int(os.environ.get("QR_DISK_BYTES", str(256 * 1024 * 1024)))
+
+_task_store = None
+_state_cache = None
+_poll_engine = None
+_poll_aggregator = None
+_reminder_scheduler = None
+_rotations = None
+_password_generator = None
+_weather_client = None
+_qr_renderer = None
+_connector_sender = None
+_metrics_directory = None
+_import_status = None
+_import_errors = {}
+
+
+def create_adapter(app_id, app_password):
+    """Bot Framework adapter with the inbound auth caches and outbound pipeline, unless disabled"""
+    settings = BotFrameworkAdapterSettings(app_id, app_password)
+    if AUTH_CACHE_ENABLED:
+        install_signing_key_cache(
+            AUTH_CACHE_DIR or None, refresh_after=AUTH_KEY_REFRESH_AFTER, max_age=AUTH_KEY_MAX_AGE
+        )
+    # A zero-sized token cache validates every request, as the SDK does
+    token_cache = VerifiedTokenCache(max_entries=AUTH_TOKEN_CACHE_SIZE if AUTH_CACHE_ENABLED else 0)
+    if OUTBOUND_ENABLED:
+        return OutboundAdapter(
+            settings,
+            get_connector_sender(),
+            window=OUTBOUND_COALESCE_WINDOW,
+            max_chars=OUTBOUND_MAX_CHARS,
+            token_cache=token_cache,
+        )
+    if not AUTH_CACHE_ENABLED:
+        return BotFrameworkAdapter(settings)
+    return CachingBotFrameworkAdapter(settings, token_cache)
+
+
+def get_connector_sender():
+    """Pooled connector client shared by every turn of this worker"""
+    global _connector_sender
+    if _connector_sender is None:
+        _connector_sender = ConnectorSender(
+            pool_size=OUTBOUND_POOL_SIZE, timeout=OUTBOUND_TIMEOUT, max_retries=OUTBOUND_MAX_RETRIES
+        )
+    return _connector_sender
+
+
+async def close_connector_sender():
+    """Close the connector client's connection pool and loop thread if they were started"""
+    if _connector_sender is not None:
+        await _connector_sender.close()
+
+
+def create_adapter_and_bot():
+    """Create the Bot Framework adapter and the ProductivityBot instance"""
+    if not APP_ID and not APP_PASSWORD:
+        logger.warning("Bot credentials not configured - running in development mode")
+
+    try:
+        try:
+            from my_bot import ProductivityBot
+        except ImportError as e:
+            _import_errors["my_bot"] = str(e)
+            raise
+
+        adapter = create_adapter(APP_ID, APP_PASSWORD)
+        # Saves the conversation and user state each turn touched (see get_state_cache)
+        adapter.use(StateMiddleware())
+        bot = ProductivityBot()
+        logger.info("Bot initialized successfully")
+    except Exception as e:
+        logger.error("Failed to initialize bot: %s", e)
+        # Create minimal adapter for testing
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        bot = None
+    return adapter, bot
+
+
+def create_activity_deduplicator():
+    """Create the redelivery de-duplicator, or None when it is disabled"""
+    if not DEDUP_ENABLED:
+        return None
+    return create_deduplicator(
+        DEDUP_BACKEND, ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES, path=DEDUP_PATH
+    )
+
+
+def create_turn_rate_limiter():
+    """Create the per-user, per-conversation and per-tenant rate limiter, or None when it is disabled"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    limits = {
+        "user": parse_limit(RATE_LIMIT_USER),
+        "conversation": parse_limit(RATE_LIMIT_CONVERSATION),
+        "tenant": parse_limit(RATE_LIMIT_TENANT),
+    }
+    return create_rate_limiter(
+        RATE_LIMIT_BACKEND,
+        limits,
+        action=RATE_LIMIT_ACTION,
+        notice_interval=RATE_LIMIT_NOTICE_INTERVAL,
+        path=RATE_LIMIT_PATH,
+    )
+
+
+def get_task_store():
+    """Task store shared by the bot's task commands, created on first use"""
+    global _task_store
+    if _task_store is None:
+        _task_store = create_task_store(TASK_STORE_URL)
+    return _task_store
+
+
+def task_list_reply(user_id, args="", value=None):
+    """Reply to `task list` (or its "Next page" button): one page of the user's tasks as a card"""
+    return task_list_activity(get_task_store(), user_id, args, value, page_size=TASK_PAGE_SIZE)
+
+
+def get_state_cache():
+    """Write-behind cache of per-conversation and per-user state, created on first use"""
+    global _state_cache
+    if _state_cache is None:
+        _state_cache = StateCache(
+            create_state_storage(STATE_STORE_URL),
+            flush_interval=STATE_FLUSH_INTERVAL,
+            max_records=STATE_CACHE_RECORDS,
+        )
+    return _state_cache
+
+
+def get_poll_engine(adapter=None):
+    """Poll engine of this worker, created on first use
+
+    Passing the adapter also starts this worker's aggregator, which updates
+    poll cards in place through it.
+    """
+    global _poll_engine, _poll_aggregator
+    if _poll_engine is None:
+        _poll_engine = PollEngine(
+            SqlitePollStore(POLL_STORE_PATH),
+            shards=POLL_SHARDS,
+            flush_interval=POLL_FLUSH_INTERVAL,
+            batch_size=POLL_BATCH_SIZE,
+            duration=POLL_DURATION,
+        )
+        atexit.register(_poll_engine.shutdown)
+    if adapter is not None:
+        if _poll_aggregator is None:
+            _poll_aggregator = PollAggregator(
+                _poll_engine, CardUpdater(adapter, APP_ID), interval=POLL_AGGREGATE_INTERVAL
+            )
+        _poll_aggregator.start()
+    return _poll_engine
+
+
+def get_reminder_scheduler(adapter):
+    """Reminder scheduler of this worker, started on first use; it sends through `adapter`"""
+    global _reminder_scheduler
+    if _reminder_scheduler is None:
+        _reminder_scheduler = ReminderScheduler(
+            SqliteReminderStore(REMINDER_STORE_PATH),
+            ProactiveSender(adapter, APP_ID, concurrency=REMINDER_CONCURRENCY),
+            lease=REMINDER_LEASE,
+            horizon=REMINDER_HORIZON,
+            refresh=REMINDER_REFRESH,
+            batch_size=REMINDER_BATCH_SIZE,
+        )
+        atexit.register(_reminder_scheduler.stop)
+    return _reminder_scheduler.start()
+
+
+def load_content():
+    """Memory-map the joke and quote corpora, once per process tree (see preload)"""
+    global _rotations
+    if _rotations is None:
+        _rotations = {
+            name: Rotation(Corpus(os.path.join(CONTENT_DIR, f"{name}.txt"))) for name in CONTENT_CORPORA
+        }
+    return _rotations
+
+
+def content_reply(name, turn_context):
+    """The user's next joke or quote; the position in their rotation is kept in their state"""
+    entry = load_content()[name].next(turn_context.activity.from_property.id, get_state_cache().user(turn_context))
+    if name == "jokes":
+        return f"😄 **Here's a joke for you**\n\n{entry}"
+    return f"💡 **Quote of the moment**\n\n{entry}"
+
+
+def get_password_generator():
+    """Password generator of this worker; it refills its urandom buffer after a fork"""
+    global _password_generator
+    if _password_generator is None:
+        _password_generator = PasswordGenerator(buffer_size=PASSWORD_BUFFER_BYTES)
+    return _password_generator
+
+
+def password_reply_text(args=""):
+    """Reply to `password [length] [policy]`"""
+    return password_reply(get_password_generator(), args)
+
+
+def get_weather_client():
+    """Weather client shared by the weather and forecast commands of this worker"""
+    global _weather_client
+    if _weather_client is None:
+        _weather_client = WeatherClient(
+            WEATHER_API_URL,
+            api_key=WEATHER_API_KEY,
+            current_ttl=WEATHER_CURRENT_TTL,
+            forecast_ttl=WEATHER_FORECAST_TTL,
+            timeout=WEATHER_TIMEOUT,
+        )
+    return _weather_client
+
+
+async def close_weather_client():
+    """Close the weather client's connection pool if one was opened"""
+    if _weather_client is not None:
+        await _weather_client.close()
+
+
+def get_qr_renderer():
+    """QR renderer of this worker; its images are served from /qr/<key>.png"""
+    global _qr_renderer
+    if _qr_renderer is None:
+        directory = PngDirectory(QR_CACHE_DIR, max_bytes=QR_DISK_BYTES) if QR_CACHE_DIR else None
+        _qr_renderer = QrRenderer(
+            cache_bytes=QR_CACHE_BYTES, directory=directory, pool=QR_POOL, max_workers=QR_POOL_WORKERS
+        )
+    return _qr_renderer
+
+
+def qr_image(key):
+    """PNG bytes for a /qr/<key>.png request, or None if the key is unknown"""
+    if not KEY_PATTERN.match(key):
+        return None
+    return get_qr_renderer().get(key)
+
+
+def turn_logic(bot):
+    """Build the adapter callback that hands a turn to the bot"""
+
+    async def aux_func(turn_context):
+        started = time.perf_counter()
+        try:
+            if bot is None:
+                logger.error("Bot not initialized")
+                await turn_context.send_activity("Bot is not properly configured")
+                return
+
+            # Use the ActivityHandler's on_turn method which will route to the appropriate handler
+            await bot.on_turn(turn_context)
+        except Exception as inner_e:
+            TURN_ERRORS.inc(error=type(inner_e).__name__)
+            logger.error("Error in bot.on_turn: %s", inner_e, exc_info=True)
+            raise
+        finally:
+            TURN_LATENCY.observe(time.perf_counter() - started, type=turn_context.activity.type or "unknown")
+
+    return aux_func
+
+
+async def run_turn(adapter, bot, activity, auth_header, rate_limiter=None, deduplicator=None):
+    """Run a single turn for a parsed activity through the adapter
+
+    The request is authenticated before the deduplicator and rate limiter are
+    consulted, so unauthenticated traffic can neither mark an activity as seen
+    nor spend anyone's tokens. A redelivered activity is skipped, and an
+    over-limit turn gets the canned reply or nothing instead of the bot.
+    """
+    # _authenticate_request is the adapter's documented override point
+    with span("auth"):
+        identity = await adapter._authenticate_request(activity, auth_header or "")
+    if deduplicator is not None and await deduplicator.is_duplicate_async(activity):
+        logger.info("Duplicate activity %s acknowledged without processing", activity.id)
+        return None
+    try:
+        return await _run_authenticated_turn(adapter, bot, activity, identity, rate_limiter)
+    except Exception:
+        if deduplicator is not None:
+            await deduplicator.forget_async(activity)
+        raise
+
+
+async def _run_authenticated_turn(adapter, bot, activity, identity, rate_limiter):
+    logic = turn_logic(bot)
+    if rate_limiter is not None:
+        with span("rate_limit"):
+            decision = await rate_limiter.check_async(activity)
+        if not decision.allowed:
+            if not decision.notify:
+                logger.info("Dropped activity %s over the %s rate limit", activity.id, decision.scope)
+                return None
+            logic = notice_logic(decision)
+    activity = materialize(activity)
+    with span("turn"):
+        return await adapter.process_activity_with_identity(activity, identity, logic)
+
+
+def get_metrics_directory():
+    """Shared metrics directory of this host, or None when BOT_METRICS_DIR is empty"""
+    global _metrics_directory
+    if _metrics_directory is None and METRICS_DIR:
+        _metrics_directory = MultiprocessDirectory(METRICS_DIR, interval=METRICS_PUBLISH_INTERVAL)
+    return _metrics_directory
+
+
+def clear_metrics_directory():
+    """Drop exports left by a previous run; called once in the gunicorn master"""
+    directory = get_metrics_directory()
+    if directory is not None:
+        directory.clear()
+
+
+def observe_request(route, method, status, seconds):
+    """Record one HTTP request, and make sure this worker publishes its metrics"""
+    HTTP_REQUESTS.inc(route=route, method=method, status=str(status))
+    HTTP_LATENCY.observe(seconds, route=route)
+    directory = get_metrics_directory()
+    if directory is not None and directory.start():
+        # First request in this worker: publish its counts one last time on the way out
+        atexit.register(directory.publish)
+
+
+def metrics_payload():
+    """Body of /metrics: every worker's metrics in the Prometheus text format"""
+    directory = get_metrics_directory()
+    exported = directory.collect() if directory is not None else REGISTRY.export()
+    return render_prometheus(exported)
+
+
+def health_payload():
+    """Body of the basic health check endpoint"""
+    return {
+        "status": "healthy",
+        "service": SERVICE_NAME,
+        "version": SERVICE_VERSION,
+        "features": FEATURES
+    }
+
+
+def _importable(name):
+    if name in _import_errors:
+        return False
+    if name in sys.modules:
+        return True
+    try:
+        # Locates the module without importing it, so a health check never loads Pillow or Flask
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def import_status():
+    """Whether each of CHECKED_IMPORTS can be imported, worked out once per process"""
+    global _import_status
+    if _import_status is None:
+        _import_status = {name: _importable(name) for name in CHECKED_IMPORTS}
+    return _import_status
+
+
+def preload():
+    """Warm the gunicorn master so workers fork with everything already imported
+
+    Imports BOT_PRELOAD_MODULES, maps the content corpora, settles the
+    import status the health check reports, and freezes the objects created
+    so far so the garbage collector does not touch, and thereby copy, the
+    pages workers share with the master.
+    """
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            _import_errors[name] = str(e)
+            logger.warning("Could not preload %s: %s", name, e)
+    try:
+        load_content()
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load the joke and quote corpora from %s: %s", CONTENT_DIR, e)
+    import_status()
+    gc.collect()
+    gc.freeze()
+
+
+def detailed_health_payload():
+    """Body of the detailed health check endpoint"""
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "bot_configured": bool(APP_ID and APP_PASSWORD),
+        "environment": os.environ.get("FLASK_ENV", "production"),
+        "imports": import_status(),
+        "ack_mode": ACK_MODE,
+        "json_decoder": JSON_DECODER,
+        "metrics": REGISTRY.snapshot()
+    }
@@ -0,0 +1,499 @@
+"""
+Expression engine for the `calc` command and plain-math auto-detection
+
+Expressions are normalized (`^` -> `**`, `×` -> `*`, spacing removed),
+parsed once with `ast`, checked against a whitelist of node types, names and
+functions, and compiled into a tree of Python closures. Compiled expressions
+are kept in a bounded LRU keyed on the normalized text, so a repeated
+expression skips parsing and compilation entirely.
+
+Evaluation is bounded: expression length (longer for list and statistics
+input) and node count are capped, nesting too deep for the parser is
+refused, powers
+are refused when the exponent or the size of the result is too large
+(`9^9^9` fails in microseconds), factorial arguments are capped, and each
+evaluation has a wall-clock budget checked at every power and function call.
+
+Lists (`[3, 5, 8]`) and inclusive ranges (`1..10000`, `range(0, 1, 0.1)`)
+evaluate to `array("d")` vectors. Operators and scalar functions apply to
+them element by element, and aggregates such as sum(), mean(), median(),
+stdev() and p95() reduce them to a number, which must be the final result.
+Every vector an evaluation creates is charged to its budget before it is
+allocated, so `sum(1..10^9)` is refused instead of exhausting the worker.
+evaluate_batch() runs several newline-separated expressions under one
+budget for a single reply.
+"""
+
+import ast
+import itertools
+import math
+import operator
+import re
+import time
+from array import array
+from functools import lru_cache, partial
+
+MAX_EXPRESSION_LENGTH = 500
+# Pasted data: a list literal or an aggregate such as mean() or p95()
+MAX_LIST_EXPRESSION_LENGTH = 10000
+MAX_NODES = 200
+MAX_LIST_LITERALS = 5000
+MAX_VECTOR_LENGTH = 100000
+MAX_ELEMENTS = 1000000
+MAX_BATCH_LINES = 20
+MAX_EXPONENT = 10000
+MAX_RESULT_DIGITS = 4300
+MAX_FACTORIAL = 1000
+TIME_LIMIT = 0.05
+CACHE_SIZE = 2048
+
+
+class CalculatorError(ValueError):
+    """Raised for expressions that are invalid, unsafe or too expensive"""
+
+
+def _log(x, base=10):
+    return math.log(x, base) if base != 10 else math.log10(x)
+
+
+def _factorial(n):
+    if n != int(n) or n < 0:
+        raise CalculatorError("factorial() needs a non-negative whole number")
+    if n > MAX_FACTORIAL:
+        raise CalculatorError(f"factorial() is limited to {MAX_FACTORIAL}")
+    return math.factorial(int(n))
+
+
+FUNCTIONS = {
+    "sqrt": math.sqrt,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "asin": math.asin,
+    "acos": math.acos,
+    "atan": math.atan,
+    "sinh": math.sinh,
+    "cosh": math.cosh,
+    "tanh": math.tanh,
+    "log": _log,
+    "log10": math.log10,
+    "log2": math.log2,
+    "ln": math.log,
+    "exp": math.exp,
+    "abs": abs,
+    "round": round,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "factorial": _factorial,
+    "degrees": math.degrees,
+    "radians": math.radians,
+}
+
+
+def _fill(values, budget):
+    """One vector holding every number and vector in `values`, in order"""
+    if len(values) == 1 and isinstance(values[0], array):
+        return values[0]
+    size = sum(len(value) if isinstance(value, array) else 1 for value in values)
+    budget.allocate(size)
+    vector = array("d")
+    for value in values:
+        if isinstance(value, array):
+            vector.extend(value)
+        else:
+            vector.append(value)
+    return vector
+
+
+def _nonempty(budget, values, minimum=1):
+    vector = _fill(values, budget)
+    if len(vector) < minimum:
+        raise CalculatorError(f"Needs at least {minimum} value{'s' if minimum > 1 else ''}")
+    return vector
+
+
+def _sum(budget, *values):
+    return math.fsum(_fill(values, budget))
+
+
+def _count(budget, *values):
+    return len(_fill(values, budget))
+
+
+def _mean(budget, *values):
+    vector = _nonempty(budget, values)
+    return math.fsum(vector) / len(vector)
+
+
+def _variance(budget, *values):
+    vector = _nonempty(budget, values, 2)
+    mean = math.fsum(vector) / len(vector)
+    return math.fsum((x - mean) ** 2 for x in vector) / (len(vector) - 1)
+
+
+def _stdev(budget, *values):
+    return math.sqrt(_variance(budget, *values))
+
+
+def _min(budget, *values):
+    return min(_nonempty(budget, values))
+
+
+def _max(budget, *values):
+    return max(_nonempty(budget, values))
+
+
+def _percentile(budget, *values, q=None):
+    """Linearly interpolated percentile; the last argument is `q` unless given"""
+    if q is None:
+        if not values or isinstance(values[-1], array):
+            raise CalculatorError("percentile() needs the values and a percentage, e.g. percentile([1, 2], 90)")
+        values, q = values[:-1], values[-1]
+    if not 0 <= q <= 100:
+        raise CalculatorError("Percentiles are between 0 and 100")
+    vector = _nonempty(budget, values)
+    budget.allocate(len(vector))
+    ordered = sorted(vector)
+    position = (len(ordered) - 1) * q / 100
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _range(budget, start, stop, step=1):
+    """Inclusive range from `start` to `stop`, as `start..stop` is"""
+    if any(isinstance(value, array) for value in (start, stop, step)):
+        raise CalculatorError("range() takes numbers, not lists")
+    if step == 0:
+        raise CalculatorError("range() step cannot be zero")
+    size = max(0, math.floor((stop - start) / step + 1e-9) + 1)
+    budget.allocate(size)
+    if all(isinstance(value, int) for value in (start, stop, step)):
+        return array("d", range(start, stop + (1 if step > 0 else -1), step))
+    return array("d", (start + i * step for i in range(size)))
+
+
+# Functions that take the evaluation budget and any mix of numbers and vectors
+AGGREGATES = {
+    "sum": _sum,
+    "count": _count,
+    "mean": _mean,
+    "avg": _mean,
+    "median": partial(_percentile, q=50),
+    "stdev": _stdev,
+    "var": _variance,
+    "min": _min,
+    "max": _max,
+    "percentile": _percentile,
+    "p50": partial(_percentile, q=50),
+    "p90": partial(_percentile, q=90),
+    "p95": partial(_percentile, q=95),
+    "p99": partial(_percentile, q=99),
+    "range": _range,
+}
+
+CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+    "tau": math.tau,
+}
+
+_BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+_SUBSTITUTIONS = str.maketrans({"^": "**", "×": "*", "÷": "/", "−": "-"})
+_WHITESPACE = re.compile(r"\s+")
+_OPERATOR_SPACING = re.compile(r"\s*([-+*/%(),|\[\]])\s*")
+_MATH_CHARS = re.compile(r"^[\d\s.+\-*/^%()a-z0-9_,×÷−]+$")
+_WORDS = re.compile(r"[a-z_][a-z0-9_]*")
+_HAS_OPERATOR = re.compile(r"[+\-*/^%×÷−]|[a-z_][a-z0-9_]*\s*\(")
+
+
+def normalize_expression(text):
+    """Canonical form of an expression, used as the compile cache key"""
+    text = _WHITESPACE.sub(" ", text.strip().lower().translate(_SUBSTITUTIONS))
+    # `a..b` becomes `a|b`: `|` binds more loosely than arithmetic, so `1..10^6` is range(1, 10^6)
+    text = text.replace("..", "|")
+    return _OPERATOR_SPACING.sub(r"\1", text)
+
+
+def _length_limit(expression):
+    """Characters allowed for an expression: more when it carries a list of numbers"""
+    if "[" in expression or any(word in AGGREGATES for word in _WORDS.findall(expression)):
+        return MAX_LIST_EXPRESSION_LENGTH
+    return MAX_EXPRESSION_LENGTH
+
+
+def is_math_expression(text):
+    """True if a plain message looks like arithmetic, e.g. `2 + 3 * 4` or `sqrt(16)`"""
+    text = text.strip().lower()
+    if not text or len(text) > _length_limit(text) or not _MATH_CHARS.match(text):
+        return False
+    if not any(ch.isdigit() for ch in text) and not any(name in text for name in CONSTANTS):
+        return False
+    if any(word not in FUNCTIONS and word not in AGGREGATES and word not in CONSTANTS
+           for word in _WORDS.findall(text)):
+        return False
+    return bool(_HAS_OPERATOR.search(text.lstrip("+-−")))
+
+
+class _Budget:
+    __slots__ = ("deadline", "elements")
+
+    def __init__(self, time_limit, max_elements=MAX_ELEMENTS):
+        self.deadline = time.perf_counter() + time_limit
+        self.elements = max_elements
+
+    def check(self):
+        if time.perf_counter() > self.deadline:
+            raise CalculatorError("Expression took too long to evaluate")
+
+    def allocate(self, size):
+        """Charge a vector of `size` numbers before it is built"""
+        if size > MAX_VECTOR_LENGTH:
+            raise CalculatorError(f"Lists are limited to {MAX_VECTOR_LENGTH} numbers")
+        self.elements -= size
+        if self.elements < 0:
+            raise CalculatorError("Expression needs too much memory")
+        self.check()
+
+
+def _broadcast(func, args, budget):
+    """`func` applied element by element when any argument is a vector"""
+    sizes = {len(arg) for arg in args if isinstance(arg, array)}
+    if not sizes:
+        return func(*args)
+    if len(sizes) > 1:
+        raise CalculatorError("Lists must have the same length")
+    size = sizes.pop()
+    budget.allocate(size)
+    columns = [arg if isinstance(arg, array) else itertools.repeat(arg, size) for arg in args]
+    result = array("d", map(func, *columns))
+    budget.check()
+    return result
+
+
+def _is_literal(node):
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        node = node.operand
+    return isinstance(node, ast.Constant)
+
+
+def _checked_pow(base, exponent):
+    if isinstance(base, complex) or isinstance(exponent, complex):
+        raise CalculatorError("Complex results are not supported")
+    if abs(exponent) > MAX_EXPONENT:
+        raise CalculatorError(f"Exponent is limited to {MAX_EXPONENT}")
+    if abs(base) > 1 and exponent > 0:
+        digits = exponent * math.log10(abs(base))
+        if digits > MAX_RESULT_DIGITS:
+            raise CalculatorError("Result is too large")
+    result = base ** exponent
+    if isinstance(result, complex):
+        raise CalculatorError("Complex results are not supported")
+    return result
+
+
+class _Compiler:
+    """Turns a whitelisted AST into nested closures taking a _Budget"""
+
+    def compile(self, node):
+        method = getattr(self, f"_compile_{type(node).__name__}", None)
+        if method is None:
+            raise CalculatorError(f"Unsupported syntax: {type(node).__name__}")
+        return method(node)
+
+    def _compile_Expression(self, node):
+        return self.compile(node.body)
+
+    def _compile_Constant(self, node):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise CalculatorError("Only numbers are allowed")
+        return lambda budget: value
+
+    def _compile_Name(self, node):
+        if node.id not in CONSTANTS:
+            raise CalculatorError(f"Unknown name: {node.id}")
+        value = CONSTANTS[node.id]
+        return lambda budget: value
+
+    def _compile_UnaryOp(self, node):
+        op = _UNARY_OPS.get(type(node.op))
+        if op is None:
+            raise CalculatorError("Unsupported operator")
+        operand = self.compile(node.operand)
+
+        def unary(budget):
+            value = operand(budget)
+            return _broadcast(op, [value], budget) if isinstance(value, array) else op(value)
+        return unary
+
+    def _compile_BinOp(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        if isinstance(node.op, ast.Pow):
+            def power(budget):
+                base, exponent = left(budget), right(budget)
+                budget.check()
+                return _broadcast(_checked_pow, [base, exponent], budget)
+            return power
+        if isinstance(node.op, ast.BitOr):
+            return lambda budget: _range(budget, left(budget), right(budget))
+        op = _BINARY_OPS.get(type(node.op))
+        if op is None:
+            raise CalculatorError("Unsupported operator")
+
+        def binary(budget):
+            a, b = left(budget), right(budget)
+            if isinstance(a, array) or isinstance(b, array):
+                return _broadcast(op, [a, b], budget)
+            return op(a, b)
+        return binary
+
+    def _compile_List(self, node):
+        if all(_is_literal(element) for element in node.elts):
+            # A pasted list of numbers is built once, at compile time; vectors are never modified
+            vector = array("d", (self.compile(element)(None) for element in node.elts))
+            return lambda budget: vector
+        elements = [self.compile(element) for element in node.elts]
+        return lambda budget: _fill([element(budget) for element in elements], budget)
+
+    def _compile_Call(self, node):
+        name = getattr(node.func, "id", "?")
+        if not isinstance(node.func, ast.Name) or (name not in FUNCTIONS and name not in AGGREGATES):
+            raise CalculatorError(f"Unknown function: {name}")
+        if node.keywords:
+            raise CalculatorError("Keyword arguments are not supported")
+        args = [self.compile(arg) for arg in node.args]
+        if name in AGGREGATES:
+            aggregate = AGGREGATES[name]
+
+            def reduce(budget):
+                values = [arg(budget) for arg in args]
+                budget.check()
+                return aggregate(budget, *values)
+            return reduce
+        func = FUNCTIONS[name]
+
+        def call(budget):
+            values = [arg(budget) for arg in args]
+            budget.check()
+            return _broadcast(func, values, budget)
+        return call
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compile_normalized(expression):
+    limit = _length_limit(expression)
+    if len(expression) > limit:
+        raise CalculatorError(f"Expression is limited to {limit} characters")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, ValueError):
+        raise CalculatorError("Invalid expression syntax") from None
+    except (RecursionError, MemoryError, OverflowError):
+        # `-------1` or `[((((1))))]` nested past what the parser can hold
+        raise CalculatorError("Expression is nested too deeply") from None
+    # Numbers pasted into a list are counted separately from the rest of the expression
+    literals = [element for node in ast.walk(tree) if isinstance(node, ast.List)
+                for element in node.elts if _is_literal(element)]
+    if len(literals) > MAX_LIST_LITERALS:
+        raise CalculatorError(f"Lists are limited to {MAX_LIST_LITERALS} numbers")
+    nodes = sum(1 for _ in ast.walk(tree)) - sum(1 for literal in literals for _ in ast.walk(literal))
+    if nodes > MAX_NODES:
+        raise CalculatorError(f"Expression is limited to {MAX_NODES} terms")
+    return _Compiler().compile(tree)
+
+
+def compile_expression(text):
+    """Compiled callable for an expression; repeated expressions hit the LRU cache"""
+    return _compile_normalized(normalize_expression(text))
+
+
+def evaluate(text, time_limit=TIME_LIMIT):
+    """Evaluate an expression, raising CalculatorError for anything invalid or too costly"""
+    return _evaluate(text, _Budget(time_limit))
+
+
+def _evaluate(text, budget):
+    compiled = compile_expression(text)
+    try:
+        result = compiled(budget)
+        if isinstance(result, array):
+            raise CalculatorError(
+                f"Result is a list of {len(result)} numbers; reduce it with sum(), mean(), max() or p95()"
+            )
+        return result
+    except CalculatorError:
+        raise
+    except ZeroDivisionError:
+        raise CalculatorError("Division by zero") from None
+    except OverflowError:
+        raise CalculatorError("Result is too large") from None
+    except (ValueError, TypeError) as e:
+        raise CalculatorError(f"Math error: {e}") from None
+
+
+def evaluate_batch(text, time_limit=TIME_LIMIT):
+    """Evaluate each non-empty line of `text` under one shared budget
+
+    Returns [(line, result or CalculatorError)], so one bad line does not
+    hide the others' results.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > MAX_BATCH_LINES:
+        raise CalculatorError(f"A message is limited to {MAX_BATCH_LINES} expressions")
+    budget = _Budget(time_limit * max(1, len(lines)))
+    results = []
+    for line in lines:
+        try:
+            results.append((line, _evaluate(line, budget)))
+        except CalculatorError as e:
+            results.append((line, e))
+    return results
+
+
+def format_batch(results):
+    """One reply for evaluate_batch(): `expression = result` per line"""
+    lines = []
+    for expression, result in results:
+        if isinstance(result, CalculatorError):
+            lines.append(f"{expression} → ⚠️ {result}")
+            continue
+        try:
+            lines.append(f"{expression} = {format_result(result)}")
+        except CalculatorError as e:
+            lines.append(f"{expression} → ⚠️ {e}")
+    return "\n".join(lines)
+
+
+def format_result(value):
+    """Render a result the way the bot shows it: whole numbers without a trailing .0"""
+    if isinstance(value, float):
+        if math.isinf(value) or math.isnan(value):
+            raise CalculatorError("Result is not a finite number")
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.10g}"
+    try:
+        return str(value)
+    except ValueError:
+        # int -> str conversion refuses very long integers
+        raise CalculatorError("Result is too large") from None
+
+
+def cache_info():
+    """Hit/miss statistics of the compiled-expression cache"""
+    return _compile_normalized.cache_info()
@@ -0,0 +1,208 @@
+"""
+Registry-based command routing for ProductivityBot
+
+Handlers register with a decorator and are looked up with one dict access
+on the first token of the message, so dispatch cost does not grow with the
+number of commands. Aliases, the plain-text fallbacks (e.g. math
+auto-detection) and the default handler (welcome message) are first-class,
+and the `help` and `menu` texts are generated from the registered metadata.
+
+    router = CommandRouter()
+
+    class ProductivityBot(ActivityHandler):
+        @router.command("calc", aliases=["calculate"], category="Calculator",
+                        usage="calc <expression>", summary="Evaluate an expression")
+        async def handle_calc(self, turn_context, args):
+            ...
+
+        async def on_message_activity(self, turn_context):
+            await router.dispatch(self, turn_context, turn_context.activity.text)
+"""
+
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+from profiling import span
+
+COMMAND_LATENCY = REGISTRY.histogram("bot_command_seconds", "Command handler latency by command")
+COMMAND_ERRORS = REGISTRY.counter("bot_command_errors_total", "Command handlers that raised, by command and error type")
+
+
+class Command:
+    """A registered command and its metadata"""
+
+    __slots__ = ("name", "handler", "aliases", "summary", "usage", "category", "examples", "hidden")
+
+    def __init__(self, name, handler, aliases=(), summary="", usage="", category="General",
+                 examples=(), hidden=False):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.summary = summary
+        self.usage = usage or name
+        self.category = category
+        self.examples = tuple(examples)
+        self.hidden = hidden
+
+    def __repr__(self):
+        return f"Command({self.name!r})"
+
+
+class Route:
+    """Result of resolving a message: the command (None for fallbacks), handler and argument text"""
+
+    __slots__ = ("command", "handler", "args")
+
+    def __init__(self, command, handler, args):
+        self.command = command
+        self.handler = handler
+        self.args = args
+
+    @property
+    def name(self):
+        if self.command is not None:
+            return self.command.name
+        return getattr(self.handler, "route_name", getattr(self.handler, "__name__", "fallback"))
+
+
+class CommandRouter:
+    """Maps the first word of a message to a handler"""
+
+    def __init__(self):
+        self._commands = OrderedDict()
+        self._lookup = {}
+        self._fallbacks = []
+        self._default = None
+        self._categories = OrderedDict()
+
+    # -- registration ------------------------------------------------------
+
+    def category(self, name, title=None, emoji=""):
+        """Declare a help category; categories are listed in declaration order"""
+        self._categories[name] = {"title": title or name.upper(), "emoji": emoji}
+
+    def command(self, name, aliases=(), summary="", usage="", category="General", examples=(),
+                hidden=False):
+        """Decorator registering a handler for `name` and its aliases"""
+
+        def decorator(handler):
+            self.add_command(Command(
+                name, handler, aliases=aliases, summary=summary, usage=usage,
+                category=category, examples=examples, hidden=hidden
+            ))
+            return handler
+
+        return decorator
+
+    def add_command(self, command):
+        keys = [key.lower() for key in (command.name, *command.aliases)]
+        # Check every name before registering any, so a refused command leaves no aliases behind
+        for index, key in enumerate(keys):
+            if key in self._lookup or key in keys[:index]:
+                raise ValueError(f"Command or alias {key!r} is already registered")
+        for key in keys:
+            self._lookup[key] = command
+        self._commands[command.name] = command
+        if command.category not in self._categories:
+            self.category(command.category)
+
+    def fallback(self, predicate, name=None):
+        """Decorator for a handler tried, in registration order, when no command matches
+
+        `predicate(text)` decides whether the handler takes the message; the
+        handler receives the whole message as its argument text.
+        """
+
+        def decorator(handler):
+            handler.route_name = name or handler.__name__
+            self._fallbacks.append((predicate, handler))
+            return handler
+
+        return decorator
+
+    def default(self, handler):
+        """Decorator for the handler used when nothing else matches"""
+        handler.route_name = getattr(handler, "route_name", "default")
+        self._default = handler
+        return handler
+
+    # -- lookup ------------------------------------------------------------
+
+    @property
+    def commands(self):
+        return list(self._commands.values())
+
+    def get(self, name):
+        return self._lookup.get(name.lower())
+
+    def resolve(self, text):
+        """Route for a message, or None if nothing (not even a default) handles it"""
+        text = (text or "").strip()
+        # Any whitespace ends the command word, so `calc` followed by a newline routes too
+        head, rest = (text.split(None, 1) + ["", ""])[:2]
+        command = self._lookup.get(head.lower())
+        if command is not None:
+            return Route(command, command.handler, rest.strip())
+        for predicate, handler in self._fallbacks:
+            if predicate(text):
+                return Route(None, handler, text)
+        if self._default is not None:
+            return Route(None, self._default, text)
+        return None
+
+    async def dispatch(self, owner, turn_context, text):
+        """Resolve `text` and await its handler; returns the Route that ran, or None"""
+        route = self.resolve(text)
+        if route is None:
+            return None
+        started = time.perf_counter()
+        try:
+            with span(f"command:{route.name}"):
+                if owner is None:
+                    await route.handler(turn_context, route.args)
+                else:
+                    await route.handler(owner, turn_context, route.args)
+        except Exception as e:
+            COMMAND_ERRORS.inc(command=route.name, error=type(e).__name__)
+            raise
+        finally:
+            COMMAND_LATENCY.observe(time.perf_counter() - started, command=route.name)
+        return route
+
+    # -- generated help ----------------------------------------------------
+
+    def _by_category(self):
+        grouped = OrderedDict((name, []) for name in self._categories)
+        for command in self._commands.values():
+            if not command.hidden:
+                grouped[command.category].append(command)
+        return [(name, commands) for name, commands in grouped.items() if commands]
+
+    def help_text(self, title="🤖 **Productivity Bot Command Guide**"):
+        """Full command guide built from every visible command"""
+        lines = [title, ""]
+        for category, commands in self._by_category():
+            meta = self._categories[category]
+            prefix = f"{meta['emoji']} " if meta["emoji"] else ""
+            lines.append(f"**{prefix}{meta['title']}**")
+            for command in commands:
+                line = f"• `{command.usage}`"
+                if command.summary:
+                    line += f" - {command.summary}"
+                lines.append(line)
+                for example in command.examples:
+                    lines.append(f"  e.g. `{example}`")
+            lines.append("")
+        return "\n".join(lines).rstrip()
+
+    def menu_text(self, title="📋 **Interactive Menu**"):
+        """Compact menu: one line per category with its command names"""
+        lines = [title, ""]
+        for category, commands in self._by_category():
+            meta = self._categories[category]
+            names = ", ".join(f"`{command.name}`" for command in commands)
+            prefix = f"{meta['emoji']} " if meta["emoji"] else ""
+            lines.append(f"{prefix}**{meta['title']}**: {names}")
+        lines.append("")
+        lines.append("Type `help` for the full command guide.")
+        return "\n".join(lines)
@@ -0,0 +1,251 @@
+"""
+Content for the `joke`, `quote` and `password` commands
+
+Corpora are UTF-8 text files with one entry per line (data/jokes.txt,
+data/quotes.txt). Corpus memory-maps its file read-only and keeps only an
+`array("I")` of line offsets, so loading it in the gunicorn master
+(bot_runtime.preload) leaves every worker reading the same page-cache
+pages: a forked worker never copies them, and a corpus costs no Python
+objects per entry until an entry is shown.
+
+Rotation hands each user the entries of a corpus in a per-user shuffled
+order without repeats until all have been seen, then reshuffles. The order
+is derived from the user id, so only a position needs to be kept per user
+(in the user's state, see conversation_state), and every worker agrees on
+what comes next.
+
+PasswordGenerator draws from a buffer of `os.urandom` bytes refilled in
+bulk, maps bytes to characters by rejection sampling (no modulo bias) and
+enforces the character classes of a policy preset.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import string
+import threading
+from array import array
+from dataclasses import dataclass
+
+
+class ContentError(ValueError):
+    """Raised for content requests that cannot be served"""
+
+
+class Corpus:
+    """Read-only, memory-mapped list of the non-empty lines of a text file"""
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        # Start and end offset of each entry, two 32-bit integers per line
+        self._offsets = array("I")
+        start = 0
+        while start < size:
+            end = self._map.find(b"\n", start)
+            if end < 0:
+                end = size
+            line_end = end - 1 if end > start and self._map[end - 1:end] == b"\r" else end
+            if self._map[start:line_end].strip():
+                self._offsets.append(start)
+                self._offsets.append(line_end)
+            start = end + 1
+        if not self._offsets:
+            raise ContentError(f"{path} has no entries")
+
+    def __len__(self):
+        return len(self._offsets) // 2
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        index %= len(self)
+        start, end = self._offsets[2 * index], self._offsets[2 * index + 1]
+        return self._map[start:end].decode("utf-8").strip()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+class Rotation:
+    """Per-user, non-repeating order over a corpus
+
+    Cycle `c` of a user visits the entries in the order of a keyed
+    permutation of `range(n)`: a four-round Feistel network over the
+    smallest even number of bits that covers `n`, walked until it lands
+    below `n`. The key is the user id and the cycle, so each cycle is a new
+    shuffle, and only the user's position is stored.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, corpus, salt=""):
+        self.corpus = corpus
+        self.salt = salt
+        self.key = f"content.{corpus.name}"
+        bits = max(2, (len(corpus) - 1).bit_length())
+        self._half = (bits + 1) // 2
+        self._mask = (1 << self._half) - 1
+
+    def _round_keys(self, user_id, cycle):
+        digest = hashlib.blake2b(f"{self.salt}:{user_id}:{cycle}".encode(), digest_size=4 * self.ROUNDS).digest()
+        return [int.from_bytes(digest[i:i + 4], "big") for i in range(0, len(digest), 4)]
+
+    def _permute(self, round_keys, k):
+        n, half, mask = len(self.corpus), self._half, self._mask
+        x = k
+        while True:
+            left, right = x >> half, x & mask
+            for round_key in round_keys:
+                # One hash per cycle keys the rounds; integer mixing is enough within them
+                f = ((right ^ round_key) * 0x9E3779B1) & 0xFFFFFFFF
+                f ^= f >> 15
+                f = (f * 0x85EBCA6B) & 0xFFFFFFFF
+                f ^= f >> 13
+                left, right = right, left ^ (f & mask)
+            x = (left << half) | right
+            if x < n:
+                return x
+
+    def index(self, user_id, position):
+        """Index of the entry a user sees at `position` (0, 1, 2, ...)"""
+        n = len(self.corpus)
+        if n == 2:
+            # Every cycle would be its own first two entries; alternate instead
+            return (self._permute(self._round_keys(user_id, 0), 0) + position) % 2
+        cycle, k = divmod(position, n)
+        round_keys = self._round_keys(user_id, cycle)
+        if cycle and n > 2 and k < 2:
+            previous = self._round_keys(user_id, cycle - 1)
+            if self._permute(round_keys, 0) == self._permute(previous, n - 1):
+                # The cycle would start with the entry that ended the previous one; swap its first two
+                k = 1 - k
+        return self._permute(round_keys, k)
+
+    def next(self, user_id, state):
+        """The user's next entry; advances the position kept in `state` (a dict or StateView)"""
+        position = state.get(self.key, 0)
+        state[self.key] = position + 1
+        return self.corpus[self.index(user_id, position)]
+
+
+@dataclass(frozen=True)
+class PasswordPolicy:
+    """Alphabet, required character classes and length limits of a password preset"""
+
+    name: str
+    classes: tuple
+    default_length: int = 16
+    min_length: int = 8
+    max_length: int = 128
+
+    @property
+    def alphabet(self):
+        return "".join(self.classes)
+
+
+_AMBIGUOUS = set("0O1lI|`'\"")
+_SYMBOLS = "!@#$%^&*()-_=+[]{};:,.<>/?~"
+
+POLICIES = {
+    "strong": PasswordPolicy("strong", (string.ascii_lowercase, string.ascii_uppercase, string.digits, _SYMBOLS)),
+    "alnum": PasswordPolicy("alnum", (string.ascii_lowercase, string.ascii_uppercase, string.digits)),
+    "readable": PasswordPolicy(
+        "readable",
+        tuple("".join(c for c in chars if c not in _AMBIGUOUS)
+              for chars in (string.ascii_lowercase, string.ascii_uppercase, string.digits, "!#$%&*+-=?@")),
+    ),
+    "pin": PasswordPolicy("pin", (string.digits,), default_length=6, min_length=4, max_length=32),
+    "hex": PasswordPolicy("hex", ("0123456789abcdef",), default_length=32, min_length=8, max_length=128),
+}
+DEFAULT_POLICY = "strong"
+
+
+class PasswordGenerator:
+    """Passwords from a bulk-refilled `os.urandom` buffer, by rejection sampling
+
+    Thread-safe, and fork-safe: a child process never reuses bytes its
+    parent had buffered.
+    """
+
+    def __init__(self, buffer_size=4096):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._buffer = b""
+        self._position = 0
+        self._pid = os.getpid()
+
+    def _random_bytes(self, count):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._buffer, self._position, self._pid = b"", 0, os.getpid()
+            if self._position + count > len(self._buffer):
+                self._buffer = self._buffer[self._position:] + os.urandom(max(self.buffer_size, count))
+                self._position = 0
+            chunk = self._buffer[self._position:self._position + count]
+            self._position += count
+            return chunk
+
+    def choices(self, alphabet, count):
+        """`count` characters drawn uniformly from `alphabet`"""
+        size = len(alphabet)
+        if not 1 <= size <= 256:
+            raise ContentError("Alphabets need between 1 and 256 characters")
+        # Bytes at or above `limit` would favour the first characters, so they are skipped
+        limit = 256 - 256 % size
+        picked = []
+        while len(picked) < count:
+            # Expected rejections are below 50%, so ask for enough bytes to finish in one pass
+            for byte in self._random_bytes((count - len(picked)) * 2):
+                if byte < limit:
+                    picked.append(alphabet[byte % size])
+                    if len(picked) == count:
+                        break
+        return "".join(picked)
+
+    def generate(self, length=None, policy=DEFAULT_POLICY):
+        """A password of `length` characters with at least one character of every class of the policy"""
+        if isinstance(policy, str):
+            if policy not in POLICIES:
+                raise ContentError(f"Unknown password policy {policy}; use one of {', '.join(POLICIES)}")
+            policy = POLICIES[policy]
+        length = policy.default_length if length is None else length
+        if not max(policy.min_length, len(policy.classes)) <= length <= policy.max_length:
+            raise ContentError(
+                f"{policy.name} passwords are {policy.min_length} to {policy.max_length} characters long"
+            )
+        alphabet = policy.alphabet
+        while True:
+            password = self.choices(alphabet, length)
+            # Rejecting whole passwords that miss a class keeps the result uniform over the valid ones
+            if all(any(c in chars for c in password) for chars in policy.classes):
+                return password
+
+
+def parse_password_args(args):
+    """(length or None, policy name) from `password [length] [policy]`, in either order"""
+    length, policy = None, DEFAULT_POLICY
+    for word in (args or "").lower().split():
+        if re.fullmatch(r"\d{1,4}", word):
+            length = int(word)
+        elif word in POLICIES:
+            policy = word
+        else:
+            raise ContentError(f"Usage: password [length] [{'|'.join(POLICIES)}]")
+    return length, policy
+
+
+def password_reply(generator, args=""):
+    """Reply text for `password [length] [policy]`"""
+    length, policy = parse_password_args(args)
+    password = generator.generate(length, policy)
+    return (
+        f"🔐 **Password Generated** ({len(password)} characters, {policy})\n\n"
+        f"`{password}`\n\n"
+        "Copy it into your password manager; it is not stored anywhere."
+    )
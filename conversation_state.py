@@ -0,0 +1,523 @@
+"""
+Per-conversation and per-user bot state with a write-behind cache
+
+botbuilder's BotState reads a scope's whole state object at the start of a
+turn and writes the whole object back when anything in it changed, so a turn
+pays to deserialize and serialize everything the user has accumulated. Here
+a state record (one conversation, or one user) is a set of independent JSON
+fields, each stored with its own ETag:
+
+  * a turn reads only the fields it touches, from this worker's cache when
+    the stored ETag shows nobody has written them since;
+  * at the end of the turn only fields whose serialized value changed are
+    written, whether they were assigned or mutated in place;
+  * writes are queued and flushed in batches after `flush_interval`
+    seconds (write-behind), or written at once when it is 0;
+  * every write carries the ETag the turn read. A field another worker
+    changed in the meantime is not overwritten: the write is dropped and
+    counted as a conflict (or StateConflictError is raised in write-through
+    mode) and the next turn reads the other worker's value.
+
+StateStorage is the backend interface; MemoryStateStorage keeps records in
+the process, SqliteStateStorage in a WAL-mode file and FileStateStorage in
+one file per field, both shared by every gunicorn worker on the host.
+StateMiddleware saves the views a turn opened once the bot has handled it.
+"""
+
+import atexit
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from botbuilder.core import Middleware
+from metrics import REGISTRY
+from sqlite_db import ConnectionCache, transaction
+
+logger = logging.getLogger(__name__)
+
+STATE_READS = REGISTRY.counter("bot_state_reads_total", "State field reads by result (hit, miss, stale, pending)")
+STATE_WRITES = REGISTRY.counter("bot_state_writes_total", "State fields written to storage")
+STATE_CONFLICTS = REGISTRY.counter("bot_state_conflicts_total", "State field writes refused by an ETag mismatch")
+
+STATE_KEY = "conversation_state.views"
+ANY = "*"
+FIELD_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]{0,63}$")
+_DELETED = object()
+
+
+class StateConflictError(Exception):
+    """Raised in write-through mode when fields were changed by another writer"""
+
+    def __init__(self, key, fields):
+        super().__init__(f"State of {key} changed concurrently: {', '.join(sorted(fields))}")
+        self.key = key
+        self.fields = fields
+
+
+def new_etag():
+    return uuid.uuid4().hex[:16]
+
+
+def serialize(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+class StateStorage:
+    """Interface for state backends: records of JSON text fields, each with an ETag
+
+    An expected ETag of None means the field must not exist, ANY matches
+    whatever is stored.
+    """
+
+    def read(self, key, fields):
+        """{field: (text, etag)} for the requested fields that exist"""
+        raise NotImplementedError
+
+    def etags(self, key, fields):
+        """{field: etag} for the requested fields that exist; cheaper than read()"""
+        return {field: etag for field, (_, etag) in self.read(key, fields).items()}
+
+    def write(self, key, changes):
+        """Apply {field: (text or None to delete, expected_etag, new_etag)} to one record
+
+        Fields whose stored ETag does not match are left alone and returned;
+        the others are written together.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release resources"""
+
+
+def _matches(stored, expected):
+    return expected == ANY or stored == expected
+
+
+class MemoryStateStorage(StateStorage):
+    """State held in this process only"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def read(self, key, fields):
+        with self._lock:
+            record = self._records.get(key, {})
+            return {field: record[field] for field in fields if field in record}
+
+    def etags(self, key, fields):
+        with self._lock:
+            record = self._records.get(key, {})
+            return {field: record[field][1] for field in fields if field in record}
+
+    def write(self, key, changes):
+        conflicts = []
+        with self._lock:
+            record = self._records.setdefault(key, {})
+            for field, (text, expected, etag) in changes.items():
+                if not _matches(record.get(field, (None, None))[1], expected):
+                    conflicts.append(field)
+                elif text is None:
+                    record.pop(field, None)
+                else:
+                    record[field] = (text, etag)
+            if not record:
+                del self._records[key]
+        return conflicts
+
+
+class SqliteStateStorage(StateStorage):
+    """State in a WAL-mode SQLite file, one row per field"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS state_fields ("
+        " key TEXT NOT NULL,"
+        " field TEXT NOT NULL,"
+        " value TEXT NOT NULL,"
+        " etag TEXT NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (key, field)) WITHOUT ROWID"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = ConnectionCache(path)
+        self._connections.get().execute(self.SCHEMA)
+
+    def _select(self, conn, columns, key, fields):
+        marks = ",".join("?" * len(fields))
+        return conn.execute(
+            f"SELECT field, {columns} FROM state_fields WHERE key = ? AND field IN ({marks})", (key, *fields)
+        ).fetchall()
+
+    def read(self, key, fields):
+        if not fields:
+            return {}
+        rows = self._select(self._connections.get(), "value, etag", key, fields)
+        return {field: (value, etag) for field, value, etag in rows}
+
+    def etags(self, key, fields):
+        if not fields:
+            return {}
+        return dict(self._select(self._connections.get(), "etag", key, fields))
+
+    def write(self, key, changes):
+        conn = self._connections.get()
+        conflicts = []
+        with transaction(conn):
+            stored = dict(self._select(conn, "etag", key, list(changes)))
+            now = time.time()
+            for field, (text, expected, etag) in changes.items():
+                if not _matches(stored.get(field), expected):
+                    conflicts.append(field)
+                elif text is None:
+                    conn.execute("DELETE FROM state_fields WHERE key = ? AND field = ?", (key, field))
+                else:
+                    conn.execute(
+                        "INSERT INTO state_fields (key, field, value, etag, updated_at) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(key, field) DO UPDATE SET value = excluded.value, etag = excluded.etag, "
+                        "updated_at = excluded.updated_at",
+                        (key, field, text, etag, now),
+                    )
+        return conflicts
+
+
+class FileStateStorage(StateStorage):
+    """State as files in a directory: one directory per record, one file per field
+
+    Each file holds the ETag on its first line and the JSON text after it,
+    and is replaced atomically. Writers to a record take an exclusive lock
+    on the record's lock file while they check ETags and replace files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _record_dir(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+
+    def _load(self, directory, field):
+        try:
+            with open(os.path.join(directory, field + ".json")) as f:
+                etag = f.readline().rstrip("\n")
+                return f.read(), etag
+        except FileNotFoundError:
+            return None
+
+    def read(self, key, fields):
+        directory = self._record_dir(key)
+        found = {}
+        for field in fields:
+            entry = self._load(directory, field)
+            if entry is not None:
+                found[field] = entry
+        return found
+
+    def etags(self, key, fields):
+        directory = self._record_dir(key)
+        found = {}
+        for field in fields:
+            try:
+                with open(os.path.join(directory, field + ".json")) as f:
+                    found[field] = f.readline().rstrip("\n")
+            except FileNotFoundError:
+                pass
+        return found
+
+    @contextmanager
+    def _locked(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def write(self, key, changes):
+        directory = self._record_dir(key)
+        conflicts = []
+        with self._locked(directory):
+            stored = self.etags(key, list(changes))
+            for field, (text, expected, etag) in changes.items():
+                target = os.path.join(directory, field + ".json")
+                if not _matches(stored.get(field), expected):
+                    conflicts.append(field)
+                elif text is None:
+                    try:
+                        os.remove(target)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+                    try:
+                        with os.fdopen(fd, "w") as f:
+                            f.write(f"{etag}\n{text}")
+                        os.replace(tmp, target)
+                    except BaseException:
+                        os.unlink(tmp)
+                        raise
+        return conflicts
+
+
+class StateCache:
+    """Write-behind cache of state fields over a StateStorage, shared by every turn of a worker
+
+    Holds the (text, etag) last read or written for each field of up to
+    `max_records` records, and the writes not yet flushed. With `validate`
+    a cached field is used only after checking its stored ETag, so turns
+    served by different workers see each other's writes once flushed.
+    """
+
+    def __init__(self, storage, flush_interval=0.05, max_records=1024, validate=True):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_records = max_records
+        self.validate = validate
+        self._lock = threading.RLock()
+        # key -> {field: (text or None, etag or None)}
+        self._cache = OrderedDict()
+        # key -> {field: [text or None, expected_etag, new_etag]}
+        self._pending = {}
+        self._pending_since = None
+        self._flusher = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def view(self, key):
+        """A StateView of one record for the current turn"""
+        return StateView(self, key)
+
+    def conversation(self, turn_context):
+        """The conversation's StateView for this turn, shared by everything in the turn"""
+        activity = turn_context.activity
+        return self._turn_view(turn_context, f"conversation/{activity.channel_id}/{activity.conversation.id}")
+
+    def user(self, turn_context):
+        """The sending user's StateView for this turn"""
+        activity = turn_context.activity
+        return self._turn_view(turn_context, f"user/{activity.channel_id}/{activity.from_property.id}")
+
+    def _turn_view(self, turn_context, key):
+        views = turn_context.turn_state.setdefault(STATE_KEY, {})
+        if key not in views:
+            views[key] = self.view(key)
+        return views[key]
+
+    # -- reads -------------------------------------------------------------
+
+    def read(self, key, field):
+        """(text, etag) of a field, (None, None) if it does not exist"""
+        with self._lock:
+            pending = self._pending.get(key, {}).get(field)
+            if pending is not None:
+                STATE_READS.inc(result="pending")
+                return pending[0], pending[2]
+            cached = self._cache.get(key, {}).get(field)
+            if cached is not None:
+                if not self.validate or self.storage.etags(key, [field]).get(field) == cached[1]:
+                    self._cache.move_to_end(key)
+                    STATE_READS.inc(result="hit")
+                    return cached
+                STATE_READS.inc(result="stale")
+            else:
+                STATE_READS.inc(result="miss")
+            entry = self.storage.read(key, [field]).get(field, (None, None))
+            self._remember(key, {field: entry})
+            return entry
+
+    def _remember(self, key, entries):
+        record = self._cache.setdefault(key, {})
+        record.update(entries)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_records:
+            self._cache.popitem(last=False)
+
+    def _forget(self, key, fields):
+        record = self._cache.get(key)
+        if record is not None:
+            for field in fields:
+                record.pop(field, None)
+
+    # -- writes ------------------------------------------------------------
+
+    def save(self, key, changes):
+        """Queue {field: (text or None, etag read)} for writing; written at once in write-through mode"""
+        if not changes:
+            return
+        with self._lock:
+            pending = self._pending.setdefault(key, {})
+            for field, (text, expected) in changes.items():
+                etag = new_etag() if text is not None else None
+                if field in pending:
+                    # Coalesce: keep the ETag storage holds, write only the latest value
+                    pending[field][0], pending[field][2] = text, etag
+                else:
+                    pending[field] = [text, expected, etag]
+                self._remember(key, {field: (text, etag)})
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if self.flush_interval <= 0:
+                conflicts = self.flush()
+                if key in conflicts:
+                    raise StateConflictError(key, conflicts[key])
+            else:
+                self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._closed or (self._flusher is not None and self._flusher.is_alive()):
+            return
+
+        def run():
+            while not self._closed:
+                time.sleep(self.flush_interval)
+                try:
+                    with self._lock:
+                        if self._pending and time.monotonic() - self._pending_since >= self.flush_interval:
+                            self.flush()
+                except Exception as e:
+                    logger.error("State background flush failed: %s", e, exc_info=True)
+
+        self._flusher = threading.Thread(target=run, name="state-flush", daemon=True)
+        self._flusher.start()
+
+    def flush(self):
+        """Write every queued field; returns {key: [fields refused by an ETag mismatch]}"""
+        refused = {}
+        with self._lock:
+            pending, self._pending, self._pending_since = self._pending, {}, None
+            for index, (key, fields) in enumerate(pending.items()):
+                changes = {field: tuple(change) for field, change in fields.items()}
+                try:
+                    conflicts = self.storage.write(key, changes)
+                except Exception:
+                    # Keep what was not written so the next flush retries it
+                    for later_key, later_fields in list(pending.items())[index:]:
+                        self._pending.setdefault(later_key, {}).update(later_fields)
+                    self._pending_since = time.monotonic()
+                    raise
+                STATE_WRITES.inc(len(changes) - len(conflicts))
+                if conflicts:
+                    STATE_CONFLICTS.inc(len(conflicts))
+                    logger.warning("State fields of %s changed by another writer, update dropped: %s",
+                                   key, ", ".join(sorted(conflicts)))
+                    # Read the other writer's values next time
+                    self._forget(key, conflicts)
+                    refused[key] = conflicts
+        return refused
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self.storage.close()
+
+
+class StateView:
+    """One record as seen by one turn
+
+    Fields are read on first access. save() serializes the fields the turn
+    accessed and writes those that differ from what was read.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        # field -> (text, etag) as read
+        self._read = {}
+        # field -> value handed to the turn, or _DELETED
+        self._values = {}
+
+    def _load(self, field):
+        if not FIELD_PATTERN.match(field):
+            raise ValueError(f"Invalid state field name: {field!r}")
+        if field not in self._read:
+            self._read[field] = self.cache.read(self.key, field)
+        return self._read[field]
+
+    def get(self, field, default=None):
+        """The field's value, or `default` if it does not exist"""
+        if field not in self._values:
+            text, _ = self._load(field)
+            self._values[field] = _DELETED if text is None else json.loads(text)
+        value = self._values[field]
+        return default if value is _DELETED else value
+
+    def set(self, field, value):
+        self._load(field)
+        self._values[field] = value
+
+    def setdefault(self, field, default):
+        """The field's value, storing `default` first if it does not exist"""
+        value = self.get(field, _DELETED)
+        if value is _DELETED:
+            self._values[field] = value = default
+        return value
+
+    def delete(self, field):
+        self._load(field)
+        self._values[field] = _DELETED
+
+    def __contains__(self, field):
+        return self.get(field, _DELETED) is not _DELETED
+
+    def __getitem__(self, field):
+        value = self.get(field, _DELETED)
+        if value is _DELETED:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        self.set(field, value)
+
+    def __delitem__(self, field):
+        self.delete(field)
+
+    def changes(self):
+        """{field: (text or None, etag read)} for fields whose value differs from what was read"""
+        changed = {}
+        for field, value in self._values.items():
+            text, etag = self._read[field]
+            new_text = None if value is _DELETED else serialize(value)
+            if new_text != text:
+                changed[field] = (new_text, etag)
+        return changed
+
+    def save(self):
+        """Hand the changed fields to the cache, and start the next save from them"""
+        changed = self.changes()
+        self.cache.save(self.key, changed)
+        for field, (text, _) in changed.items():
+            self._read[field] = self.cache.read(self.key, field)
+
+
+class StateMiddleware(Middleware):
+    """Saves the state views a turn opened once the bot has handled it"""
+
+    async def on_turn(self, context, logic):
+        await logic()
+        for view in context.turn_state.get(STATE_KEY, {}).values():
+            view.save()
+
+
+def create_state_storage(url):
+    """Build a state backend from a URL: memory://, sqlite:///path/to/file or file:///path/to/dir"""
+    if url.startswith("memory://"):
+        return MemoryStateStorage()
+    for scheme, backend in (("sqlite://", SqliteStateStorage), ("file://", FileStateStorage)):
+        if url.startswith(scheme):
+            path = url[len(scheme):]
+            if not path:
+                raise ValueError(f"{scheme} state store URL needs a path")
+            return backend(path)
+    raise ValueError(f"Unsupported state store URL: {url}")
@@ -0,0 +1,183 @@
+"""
+Activity de-duplication for /api/messages
+
+Bot Framework redelivers an activity when the endpoint is slow to answer.
+ActivityDeduplicator remembers every (conversation.id, activity.id) pair it
+has accepted for a TTL so redeliveries can be acknowledged without running
+the turn again. Two backends are available: an in-memory LRU for a single
+process and a SQLite file that every gunicorn worker on the host can share.
+Activities are only recorded once their request has been authenticated, so
+unauthenticated traffic cannot suppress a real redelivery. Async callers use
+is_duplicate_async(), which runs the SQLite backend in the loop's executor.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+from sqlite_db import ConnectionCache
+
+logger = logging.getLogger(__name__)
+
+DEDUP_CHECKED = REGISTRY.counter("bot_dedup_checked_total", "Activities checked for redelivery")
+DEDUP_DUPLICATES = REGISTRY.counter("bot_dedup_duplicates_total", "Redelivered activities short-circuited")
+
+
+class MemoryDedupBackend:
+    """Bounded LRU of seen keys with per-entry expiry, local to one process"""
+
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_if_absent(self, key, ttl):
+        """Record key; returns False if it was already present and not expired"""
+        now = self.clock()
+        with self._lock:
+            self._evict_expired(now)
+            expires_at = self._entries.get(key)
+            if expires_at is not None and expires_at > now:
+                self._entries.move_to_end(key)
+                return False
+            self._entries[key] = now + ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _evict_expired(self, now):
+        # Entries are kept in roughly insertion order, so expired ones sit at the front
+        while self._entries:
+            key, expires_at = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteDedupBackend:
+    """Seen keys in a SQLite file so every worker process on the host shares them"""
+
+    PRUNE_EVERY = 500
+    # Each call is a write transaction, so async callers run it in an executor
+    blocking = True
+
+    def __init__(self, path, max_entries=100000, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.clock = clock
+        self._connections = ConnectionCache(path, timeout=5)
+        self._writes = 0
+        with self._connections.get() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_activities ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS seen_activities_expiry ON seen_activities (expires_at)"
+            )
+
+    def add_if_absent(self, key, ttl):
+        """Record key; returns False if another request or worker already recorded it"""
+        now = self.clock()
+        conn = self._connections.get()
+        cursor = conn.execute(
+            "INSERT INTO seen_activities (key, expires_at) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at "
+            "WHERE seen_activities.expires_at <= ?",
+            (key, now + ttl, now)
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune(conn, now)
+        return cursor.rowcount == 1
+
+    def discard(self, key):
+        self._connections.get().execute("DELETE FROM seen_activities WHERE key = ?", (key,))
+
+    def _prune(self, conn, now):
+        conn.execute("DELETE FROM seen_activities WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM seen_activities WHERE key IN ("
+            "SELECT key FROM seen_activities ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def __len__(self):
+        return self._connections.get().execute("SELECT COUNT(*) FROM seen_activities").fetchone()[0]
+
+
+class ActivityDeduplicator:
+    """Detects redelivered activities by (conversation.id, activity.id)"""
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def key_for(activity):
+        activity_id = getattr(activity, "id", None)
+        conversation = getattr(activity, "conversation", None)
+        conversation_id = getattr(conversation, "id", None)
+        if not activity_id or not conversation_id:
+            return None
+        return f"{conversation_id}:{activity_id}"
+
+    def is_duplicate(self, activity):
+        """Record the activity and report whether it was already seen"""
+        key = self.key_for(activity)
+        if key is None:
+            # Without both ids there is nothing reliable to key on
+            return False
+        DEDUP_CHECKED.inc()
+        try:
+            is_new = self.backend.add_if_absent(key, self.ttl)
+        except Exception as e:
+            # Never drop a turn because the cache is unavailable
+            logger.warning("De-duplication backend error, letting activity through: %s", e)
+            return False
+        if not is_new:
+            DEDUP_DUPLICATES.inc(type=getattr(activity, "type", None) or "unknown")
+        return not is_new
+
+    async def is_duplicate_async(self, activity):
+        """is_duplicate() for coroutines; a blocking backend runs in the loop's executor"""
+        if not getattr(self.backend, "blocking", False):
+            return self.is_duplicate(activity)
+        return await asyncio.get_running_loop().run_in_executor(None, self.is_duplicate, activity)
+
+    def forget(self, activity):
+        """Drop the record of an activity whose turn failed so a redelivery can retry it"""
+        key = self.key_for(activity)
+        if key is not None:
+            try:
+                self.backend.discard(key)
+            except Exception as e:
+                logger.warning("De-duplication backend error on discard: %s", e)
+
+    async def forget_async(self, activity):
+        """forget() for coroutines; a blocking backend runs in the loop's executor"""
+        if not getattr(self.backend, "blocking", False):
+            return self.forget(activity)
+        return await asyncio.get_running_loop().run_in_executor(None, self.forget, activity)
+
+
+def create_deduplicator(backend="memory", ttl=300, max_entries=10000, path=None):
+    """Build a deduplicator from configuration values"""
+    if backend == "sqlite":
+        return ActivityDeduplicator(
+            SqliteDedupBackend(path or "/tmp/bot_dedup.sqlite3", max_entries=max_entries), ttl=ttl
+        )
+    if backend == "memory":
+        return ActivityDeduplicator(MemoryDedupBackend(max_entries=max_entries), ttl=ttl)
+    raise ValueError(f"Unknown de-duplication backend: {backend}")
@@ -0,0 +1,183 @@
+"""
+Fast ingestion path for /api/messages
+
+The endpoint used to parse the body with the stdlib JSON decoder and then
+build the full msrest model graph with `Activity().deserialize()`, which
+costs far more than the parse: every Teams payload carries channelData,
+entities and often attachments that most turns never look at.
+
+parse_activity() refuses an oversized body before decoding it, decodes it
+once (with orjson when it is installed, the stdlib otherwise) and returns a
+LazyActivity. The fields routing needs - type, id, text, from, recipient,
+conversation, channelId, serviceUrl, channelData - are read straight from
+the parsed dict, which is enough for authentication, de-duplication and
+rate limiting. The full Activity is built on first use of any other
+attribute, or by materialize() just before the adapter runs the turn, so a
+redelivered or dropped activity is never deserialized, and in queue mode
+the cost moves off the request path.
+"""
+
+import json
+import logging
+from botbuilder.schema import Activity
+from metrics import REGISTRY
+from profiling import span
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib decoder is used instead
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+INGEST_REJECTED = REGISTRY.counter("bot_ingest_rejected_total", "Request bodies refused before a turn, by reason")
+ACTIVITIES_MATERIALIZED = REGISTRY.counter(
+    "bot_activities_materialized_total", "Activities deserialized into the full Activity model"
+)
+
+DEFAULT_MAX_BODY_BYTES = 256 * 1024
+
+JSON_DECODER = "orjson" if orjson is not None else "json"
+
+
+class IngestError(ValueError):
+    """Raised when a request body is not a usable activity"""
+
+
+class BodyTooLargeError(IngestError):
+    """Raised when a request body exceeds the size limit"""
+
+
+def loads(data):
+    """Decode JSON from bytes or str with the fastest available decoder"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def check_content_length(length, max_bytes=DEFAULT_MAX_BODY_BYTES):
+    """Refuse a declared body size over the limit before any of it is read"""
+    if max_bytes and length is not None and length > max_bytes:
+        INGEST_REJECTED.inc(reason="too_large")
+        raise BodyTooLargeError(f"Request body is limited to {max_bytes} bytes")
+
+
+async def read_limited(stream, max_bytes=DEFAULT_MAX_BODY_BYTES):
+    """Read an async stream (e.g. aiohttp's request.content) up to one byte past the limit"""
+    chunks = []
+    size = 0
+    while not max_bytes or size <= max_bytes:
+        chunk = await stream.read(max_bytes + 1 - size if max_bytes else -1)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks)
+
+
+def parse_activity(data, max_bytes=DEFAULT_MAX_BODY_BYTES):
+    """LazyActivity for a raw request body; raises BodyTooLargeError or IngestError"""
+    if max_bytes and len(data) > max_bytes:
+        # Chunked bodies carry no Content-Length, so the size is checked again once read
+        INGEST_REJECTED.inc(reason="too_large")
+        raise BodyTooLargeError(f"Request body is limited to {max_bytes} bytes")
+    if not data:
+        INGEST_REJECTED.inc(reason="empty")
+        raise IngestError("Empty request body")
+    try:
+        body = loads(data)
+    except ValueError as e:
+        INGEST_REJECTED.inc(reason="invalid_json")
+        raise IngestError(f"Invalid JSON: {e}") from None
+    if not isinstance(body, dict) or not body:
+        INGEST_REJECTED.inc(reason="not_an_activity")
+        raise IngestError("Expected an activity object")
+    return LazyActivity(body)
+
+
+class AccountView:
+    """Read-only view of the from, recipient or conversation object of a parsed body"""
+
+    __slots__ = ("_data",)
+
+    # Activity attribute names of the fields read before the turn, and their JSON keys
+    FIELDS = {
+        "id": "id",
+        "name": "name",
+        "role": "role",
+        "aad_object_id": "aadObjectId",
+        "tenant_id": "tenantId",
+        "conversation_type": "conversationType",
+        "is_group": "isGroup",
+    }
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        try:
+            return self._data.get(self.FIELDS[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self):
+        return f"AccountView({self._data.get('id')!r})"
+
+
+class LazyActivity:
+    """An activity whose routing fields come from the parsed body, and the rest from a full Activity built on demand"""
+
+    __slots__ = ("body", "_activity")
+
+    def __init__(self, body):
+        self.body = body
+        self._activity = None
+
+    @property
+    def activity(self):
+        """The full Activity, deserialized once"""
+        if self._activity is None:
+            with span("deserialize"):
+                self._activity = Activity().deserialize(self.body)
+            ACTIVITIES_MATERIALIZED.inc()
+        return self._activity
+
+    @property
+    def materialized(self):
+        return self._activity is not None
+
+    def _field(self, name, key):
+        # Once built, the Activity is authoritative: the adapter may have filled fields in
+        if self._activity is not None:
+            return getattr(self._activity, name)
+        return self.body.get(key)
+
+    def _account(self, name, key):
+        if self._activity is not None:
+            return getattr(self._activity, name)
+        data = self.body.get(key)
+        return AccountView(data) if isinstance(data, dict) else None
+
+    type = property(lambda self: self._field("type", "type"))
+    id = property(lambda self: self._field("id", "id"))
+    text = property(lambda self: self._field("text", "text"))
+    channel_id = property(lambda self: self._field("channel_id", "channelId"))
+    service_url = property(lambda self: self._field("service_url", "serviceUrl"))
+    channel_data = property(lambda self: self._field("channel_data", "channelData"))
+    from_property = property(lambda self: self._account("from_property", "from"))
+    recipient = property(lambda self: self._account("recipient", "recipient"))
+    conversation = property(lambda self: self._account("conversation", "conversation"))
+
+    def __getattr__(self, name):
+        # Only reached for attributes the body view does not serve
+        return getattr(self.activity, name)
+
+    def __repr__(self):
+        return f"LazyActivity(type={self.type!r}, id={self.id!r})"
+
+
+def materialize(activity):
+    """The full Activity for a LazyActivity; any other activity is returned as is"""
+    if isinstance(activity, LazyActivity):
+        return activity.activity
+    return activity
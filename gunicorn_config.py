@@ -0,0 +1,204 @@
+"""
+Gunicorn worker model and sizing for wsgi.py
+
+resolve() turns the host and the BOT_* environment into gunicorn options:
+
+  * the worker class: `sync` for a CPU-bound command mix, `gthread` when
+    turns spend most of their time waiting (connector replies, the weather
+    provider, SQLite), and aiohttp's worker in BOT_SERVER_MODE=aiohttp;
+  * the worker count from the CPUs the process may actually use (affinity
+    and cgroup quota, not the host's core count), capped so the expected
+    RSS of all workers fits in the memory that is available;
+  * threads per gthread worker from the share of a turn spent waiting, as
+    estimated from BOT_COMMAND_MIX.
+
+Every value can be pinned with its environment variable; the reason for
+each automatic choice is returned alongside the options so it can be
+logged at startup. scripts/loadtest.py --sweep measures alternatives.
+"""
+
+import math
+import os
+
+SYNC_WORKER = "sync"
+THREAD_WORKER = "gthread"
+AIOHTTP_WORKER = "aiohttp.GunicornWebWorker"
+WORKER_CLASSES = {"sync": SYNC_WORKER, "gthread": THREAD_WORKER, "aiohttp": AIOHTTP_WORKER}
+
+DEFAULT_COMMAND_MIX = "calc=35,task=20,weather=20,qr=10,poll=10,help=5"
+
+# Rough share of a turn's wall time spent waiting rather than on the CPU.
+# Every turn ends with a reply to the Bot Connector; weather adds a provider
+# call, task and poll a SQLite write, qr a render on its own pool.
+IO_SHARE = {
+    "calc": 0.5,
+    "task": 0.6,
+    "weather": 0.9,
+    "qr": 0.4,
+    "poll": 0.6,
+    "help": 0.5,
+}
+
+# Above this share of waiting a thread per worker is not enough
+GTHREAD_IO_SHARE = 0.5
+MAX_THREADS = 32
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_count():
+    """CPUs this process may use: its affinity mask, reduced to a cgroup CPU quota if one is set"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = period = None
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        limit, _, per = cpu_max.partition(" ")
+        if limit != "max":
+            quota, period = int(limit), int(per or 100000)
+    else:
+        limit = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        if limit and int(limit) > 0:
+            quota, period = int(limit), int(_read("/sys/fs/cgroup/cpu/cpu.cfs_period_us") or 100000)
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota / period)))
+    return cpus
+
+
+def available_memory():
+    """Bytes available to this process: MemAvailable, or the cgroup limit if lower; None if unknown"""
+    candidates = []
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        if line.startswith("MemAvailable:"):
+            candidates.append(int(line.split()[1]) * 1024)
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit = _read(path)
+        # cgroup v1 reports "no limit" as a number close to 2**63
+        if limit and limit.isdigit() and int(limit) < 1 << 60:
+            usage = _read(path.replace("memory.max", "memory.current").replace("limit_in_bytes", "usage_in_bytes"))
+            candidates.append(int(limit) - int(usage or 0))
+            break
+    return min(candidates) if candidates else None
+
+
+def parse_command_mix(text):
+    """Parse "calc=35,weather=20" into {command: weight}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        if not name:
+            continue
+        if name not in IO_SHARE:
+            raise ValueError(f"Unknown command in mix: {name!r}; expected one of {', '.join(IO_SHARE)}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight for {name!r}: {weight!r}") from None
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError(f"Empty command mix: {text!r}")
+    return mix
+
+
+def io_share(mix):
+    """Weighted share of a turn spent waiting for the given command mix"""
+    return sum(IO_SHARE[name] * weight for name, weight in mix.items()) / sum(mix.values())
+
+
+def _int(env, name, default):
+    value = env.get(name, "")
+    return int(value) if value.strip() else default
+
+
+def resolve(env=None, cpus=None, memory=None):
+    """Gunicorn options for this host and environment, and the reason for each automatic choice
+
+    Returns (options, reasons). `cpus` and `memory` (bytes) default to what
+    the process can measure; tests and the sweep pass them explicitly.
+    """
+    env = os.environ if env is None else env
+    cpus = _int(env, "BOT_CPU_COUNT", cpus or cpu_count())
+    memory = memory if memory is not None else available_memory()
+    server_mode = env.get("BOT_SERVER_MODE", "flask").lower()
+    requested = env.get("BOT_WORKER_CLASS", "auto").lower()
+    mix = parse_command_mix(env.get("BOT_COMMAND_MIX", DEFAULT_COMMAND_MIX))
+    waiting = io_share(mix)
+    reasons = {
+        "host": f"{cpus} CPUs, "
+        + (f"{memory // (1024 * 1024)} MB available" if memory is not None else "memory unknown")
+    }
+
+    if requested not in ("auto", *WORKER_CLASSES):
+        raise ValueError(f"Unknown BOT_WORKER_CLASS: {requested}")
+    if server_mode == "aiohttp":
+        if requested not in ("auto", "aiohttp"):
+            raise ValueError(f"BOT_SERVER_MODE=aiohttp needs the aiohttp worker, not {requested}")
+        worker_class = AIOHTTP_WORKER
+        reasons["worker_class"] = "BOT_SERVER_MODE=aiohttp"
+    elif requested == "aiohttp":
+        raise ValueError("BOT_WORKER_CLASS=aiohttp needs BOT_SERVER_MODE=aiohttp")
+    elif requested != "auto":
+        worker_class = WORKER_CLASSES[requested]
+        reasons["worker_class"] = "BOT_WORKER_CLASS"
+    elif waiting >= GTHREAD_IO_SHARE:
+        worker_class = THREAD_WORKER
+        reasons["worker_class"] = f"command mix waits {waiting:.0%} of a turn"
+    else:
+        worker_class = SYNC_WORKER
+        reasons["worker_class"] = f"command mix is CPU-bound ({waiting:.0%} waiting)"
+
+    if worker_class == THREAD_WORKER:
+        threads = _int(env, "BOT_THREADS", 0)
+        if threads:
+            reasons["threads"] = "BOT_THREADS"
+        else:
+            # Enough threads that one is usually on the CPU while the rest wait
+            threads = min(MAX_THREADS, max(2, math.ceil(round(2 / max(1 - waiting, 1 / MAX_THREADS), 6))))
+            reasons["threads"] = f"{waiting:.0%} of a turn waiting"
+    else:
+        threads = 1
+
+    workers = _int(env, "BOT_WORKERS", 0)
+    if workers:
+        reasons["workers"] = "BOT_WORKERS"
+    else:
+        if worker_class == SYNC_WORKER:
+            # One request per worker, so extra workers cover the time each spends waiting
+            workers, rule = cpus * 2 + 1, f"2 x {cpus} CPUs + 1"
+        else:
+            # Concurrency comes from threads or the event loop; one worker per CPU is enough
+            workers, rule = cpus, f"{cpus} CPUs"
+        reasons["workers"] = rule
+        worker_memory = _int(env, "BOT_WORKER_MEMORY_MB", 150) * 1024 * 1024
+        fraction = float(env.get("BOT_MEMORY_FRACTION", "0.75"))
+        if memory is not None:
+            fits = max(1, int(memory * fraction // worker_memory))
+            if fits < workers:
+                workers = fits
+                reasons["workers"] = (
+                    f"{rule}, capped by memory: {memory // (1024 * 1024)} MB available, "
+                    f"{worker_memory // (1024 * 1024)} MB per worker"
+                )
+
+    options = {
+        "bind": f"0.0.0.0:{env.get('PORT', '8000')}",
+        "workers": workers,
+        "worker_class": worker_class,
+        "threads": threads,
+        "timeout": _int(env, "BOT_WORKER_TIMEOUT", 120),
+        "graceful_timeout": _int(env, "BOT_GRACEFUL_TIMEOUT", 30),
+        "keepalive": _int(env, "BOT_KEEPALIVE", 5),
+        "max_requests": _int(env, "BOT_MAX_REQUESTS", 1000),
+        "max_requests_jitter": _int(env, "BOT_MAX_REQUESTS_JITTER", 100),
+    }
+    if worker_class == AIOHTTP_WORKER:
+        # Only meaningful for async workers; sync and gthread ignore it
+        options["worker_connections"] = _int(env, "BOT_WORKER_CONNECTIONS", 1000)
+    return options, reasons
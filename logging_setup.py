@@ -0,0 +1,205 @@
+"""
+Non-blocking, structured logging for the Teams Productivity Bot
+
+Request threads only put records on an in-memory queue (QueueHandler); a
+single QueueListener thread formats them as JSON lines and writes them to
+stderr and a log file. Every record carries the correlation id of
+the request that produced it, and DEBUG/INFO lines can be sampled per
+request so busy workers keep whole traces for a fraction of turns.
+
+Size-based rotation is not safe with several processes writing one file,
+so each process writes its own size-rotated file when LOG_FILE contains
+`{pid}` (the default). A fixed LOG_FILE is opened with WatchedFileHandler
+and left to external rotation (logrotate), which every process notices.
+A process forked after configure_logging() - a gunicorn worker of a
+preloaded master - reopens its handlers and restarts the listener thread.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id"}
+
+DEFAULT_LOG_FILE = "/tmp/bot-{pid}.log"
+
+_listener = None
+_queue_handler = None
+_config = None
+
+
+def new_correlation_id(value=None):
+    """Set the correlation id for the current request context and return it"""
+    value = value or uuid.uuid4().hex[:16]
+    correlation_id.set(value)
+    return value
+
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamp each record with the correlation id of the current context"""
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records per level; WARNING and above are never dropped
+
+    With a correlation id the decision is made once per request (by hashing
+    the id), so a sampled turn keeps all of its lines and an unsampled turn
+    keeps none of them.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {
+            level if isinstance(level, int) else logging.getLevelName(level.upper()): rate
+            for level, rate in rates.items()
+        }
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        cid = getattr(record, "correlation_id", None)
+        if cid:
+            return (zlib.crc32(cid.encode()) % 10000) < rate * 10000
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields plus any `extra` values"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        cid = getattr(record, "correlation_id", None)
+        if cid:
+            entry["correlation_id"] = cid
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def parse_sample_rates(spec):
+    """Parse 'DEBUG=0.01,INFO=0.1' into {'DEBUG': 0.01, 'INFO': 0.1}"""
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            level, rate = part.split("=", 1)
+            rates[level.strip().upper()] = float(rate)
+    return rates
+
+
+def file_handler(log_file, max_bytes, backup_count):
+    """Size-rotated handler for a per-process `{pid}` file, WatchedFileHandler for a shared one"""
+    if "{pid}" in log_file:
+        return logging.handlers.RotatingFileHandler(
+            log_file.format(pid=os.getpid()), maxBytes=max_bytes, backupCount=backup_count
+        )
+    return logging.handlers.WatchedFileHandler(log_file)
+
+
+def configure_logging(level=None, log_file=None, max_bytes=None, backup_count=None,
+                      log_format=None, sample_rates=None):
+    """Route the root logger through a queue to JSON stream and rotating file handlers
+
+    Every argument defaults to its LOG_* environment variable. Calling this
+    again replaces the previous configuration.
+    """
+    global _listener, _queue_handler, _config
+
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    log_file = log_file if log_file is not None else os.environ.get("LOG_FILE", DEFAULT_LOG_FILE)
+    max_bytes = max_bytes or int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = backup_count if backup_count is not None else int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+    log_format = (log_format or os.environ.get("LOG_FORMAT", "json")).lower()
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+    shutdown_logging()
+    _config = dict(level=level, log_file=log_file, max_bytes=max_bytes, backup_count=backup_count,
+                   log_format=log_format, sample_rates=sample_rates)
+
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+        )
+
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(file_handler(log_file, max_bytes, backup_count))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    # QueueHandler.prepare() only merges args into msg on the calling thread;
+    # JSON encoding and file I/O happen on the listener thread
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _queue_handler.addFilter(CorrelationIdFilter())
+    if sample_rates:
+        _queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records, stop the listener thread and detach from the root logger"""
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _restart_listener_after_fork():
+    # The listener thread does not survive fork (gunicorn preload), and a
+    # `{pid}` file belongs to the parent, so each worker rebuilds its handlers
+    # and starts its own thread reading from a fresh queue
+    if _listener is None or _config is None:
+        return
+    configure_logging(**_config)
+
+
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
+atexit.register(shutdown_logging)
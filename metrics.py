@@ -0,0 +1,440 @@
+"""
+In-process metrics registry for the Teams Productivity Bot
+
+Counters, gauges and histograms keyed by metric name and label values.
+All operations are thread-safe so the Flask request threads and the
+background event loop can record into the same registry.
+
+Every gunicorn worker has its own registry. MultiprocessDirectory has each
+worker publish an export of its registry to a shared directory, and merges
+all of them for `/metrics`: counters and histograms are summed, gauges are
+combined by their `multiprocess_mode`. Counts from workers that have exited
+are folded into an archive file so totals never go backwards when gunicorn
+recycles a worker. render_prometheus() writes the Prometheus text format.
+"""
+
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+GAUGE_MODES = ("sum", "max", "min", "all")
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    """Monotonically increasing value per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    """Value per label set that can go up and down
+
+    `multiprocess_mode` says how workers' values combine: "sum", "max",
+    "min", or "all" to keep one series per worker under a `pid` label.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text="", multiprocess_mode="sum"):
+        super().__init__(name, help_text)
+        if multiprocess_mode not in GAUGE_MODES:
+            raise ValueError(f"Unknown multiprocess mode: {multiprocess_mode}")
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Bucketed distribution of observed values per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "sum": 0.0
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["count"] += 1
+            state["sum"] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(_label_key(labels))
+        return state["count"] if state else 0
+
+    def samples(self):
+        with self._lock:
+            return {
+                key: {"buckets": list(state["buckets"]), "count": state["count"], "sum": state["sum"]}
+                for key, state in self._values.items()
+            }
+
+
+class MetricsRegistry:
+    """Named collection of metrics; asking twice for a name returns the same metric"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            elif not isinstance(metric, cls) or metric.kind != cls.kind:
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text="", multiprocess_mode="sum"):
+        return self._get_or_create(Gauge, name, help_text, multiprocess_mode=multiprocess_mode)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self):
+        """JSON-friendly view of every metric, used by the health endpoint"""
+        result = {}
+        for metric in self.metrics():
+            series = {}
+            for key, value in metric.samples().items():
+                label = ",".join(f"{k}={v}" for k, v in key) or "total"
+                if metric.kind == "histogram":
+                    value = {"count": value["count"], "sum": round(value["sum"], 6)}
+                series[label] = value
+            result[metric.name] = series
+        return result
+
+    def export(self):
+        """Plain-data copy of every metric, the unit workers publish and merge"""
+        exported = {}
+        for metric in self.metrics():
+            entry = {"kind": metric.kind, "help": metric.help, "series": []}
+            if metric.kind == "histogram":
+                entry["buckets"] = list(metric.buckets)
+            if metric.kind == "gauge":
+                entry["mode"] = metric.multiprocess_mode
+            for key, value in metric.samples().items():
+                entry["series"].append([[list(pair) for pair in key], value])
+            exported[metric.name] = entry
+        return exported
+
+
+REGISTRY = MetricsRegistry()
+
+
+def merge_exports(exports):
+    """Combine per-worker exports, given as (pid, export, alive) triples, into one export
+
+    Gauges of workers that are no longer alive are left out.
+    """
+    merged = {}
+    series_by_metric = {}
+    for pid, exported, alive in exports:
+        for name, entry in exported.items():
+            if entry["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {k: v for k, v in entry.items() if k != "series"})
+            series = series_by_metric.setdefault(name, {})
+            mode = entry.get("mode", "sum")
+            for labels, value in entry["series"]:
+                if entry["kind"] == "gauge" and mode == "all":
+                    labels = labels + [["pid", str(pid)]]
+                key = tuple(sorted(tuple(pair) for pair in labels))
+                current = series.get(key)
+                if current is None:
+                    series[key] = dict(value, buckets=list(value["buckets"])) if isinstance(value, dict) else value
+                elif entry["kind"] == "histogram":
+                    current["count"] += value["count"]
+                    current["sum"] += value["sum"]
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                elif entry["kind"] == "gauge" and mode == "max":
+                    series[key] = max(current, value)
+                elif entry["kind"] == "gauge" and mode == "min":
+                    series[key] = min(current, value)
+                else:
+                    series[key] = current + value
+            target["series"] = series
+    for name, entry in merged.items():
+        entry["series"] = [[[list(pair) for pair in key], value] for key, value in series_by_metric[name].items()]
+    return merged
+
+
+def _escape(value, quotes=True):
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_labels(labels, extra=()):
+    pairs = [tuple(pair) for pair in labels] + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus(exported):
+    """Prometheus text exposition format (version 0.0.4) for an export"""
+    lines = []
+    for name in sorted(exported):
+        entry = exported[name]
+        lines.append(f"# HELP {name} {_escape(entry['help'] or name, quotes=False)}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        for labels, value in sorted(entry["series"], key=lambda item: item[0]):
+            if entry["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            # Bucket counts are already cumulative: observe() counts a value in every bucket it fits
+            for bound, count in zip(entry["buckets"], value["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(float(bound)))])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(value['sum']))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MultiprocessDirectory:
+    """Shares registry exports between the worker processes of one host through a directory"""
+
+    ARCHIVE = "archive.json"
+
+    def __init__(self, path, registry=REGISTRY, interval=5.0):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def clear(self):
+        """Remove every published export; call in the gunicorn master before workers start"""
+        for path in glob.glob(os.path.join(self.path, "*.json")):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def start(self):
+        """Publish this worker's export every `interval` seconds from a daemon thread
+
+        Cheap to call on every request: it starts a thread once per process
+        and returns True only for the call that did.
+        """
+        if self._pid == os.getpid():
+            return False
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as e:
+                logger.warning("Could not publish metrics: %s", e)
+
+    def publish(self):
+        """Write this worker's current export to `<pid>.json`"""
+        self._write(os.path.join(self.path, f"{os.getpid()}.json"), self.registry.export())
+
+    def collect(self):
+        """Merged export of every worker on the host, this one included and fresh"""
+        self.publish()
+        with _DirectoryLock(os.path.join(self.path, ".lock")):
+            exports = []
+            archive = self._read(os.path.join(self.path, self.ARCHIVE)) or {}
+            dead = []
+            for path in glob.glob(os.path.join(self.path, "*.json")):
+                stem = os.path.basename(path)[:-len(".json")]
+                if not stem.isdigit():
+                    continue
+                exported = self._read(path)
+                if exported is None:
+                    continue
+                pid = int(stem)
+                alive = pid == os.getpid() or _pid_alive(pid)
+                exports.append((pid, exported, alive))
+                if not alive:
+                    dead.append((path, pid, exported))
+            if dead:
+                # Fold exited workers into the archive so their counts survive and the directory stays small
+                archive = merge_exports([(0, archive, False)] + [(pid, exported, False) for _, pid, exported in dead])
+                self._write(os.path.join(self.path, self.ARCHIVE), archive)
+                for path, _, _ in dead:
+                    os.unlink(path)
+                exports = [item for item in exports if item[2]]
+        return merge_exports([(0, archive, False)] + exports)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, exported):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(exported, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class _DirectoryLock:
+    """Exclusive advisory lock so only one worker folds exited workers into the archive at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self._fd)
+        self._fd = None
+
+
+class LoopLagMonitor:
+    """Measures how late an event loop wakes from a short sleep, a direct read of loop congestion"""
+
+    def __init__(self, name, interval=0.5, registry=REGISTRY):
+        self.name = name
+        self.interval = interval
+        self.gauge = registry.gauge(
+            "bot_event_loop_last_lag_seconds", "Latest event loop scheduling delay", multiprocess_mode="max"
+        )
+        self.histogram = registry.histogram(
+            "bot_event_loop_lag_seconds", "Event loop scheduling delay",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+        )
+        self._task = None
+
+    def start(self, loop=None):
+        """Start sampling on `loop` (thread-safe), or on the running loop"""
+        if loop is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        else:
+            loop.call_soon_threadsafe(self._start_on_loop)
+        return self
+
+    def _start_on_loop(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.gauge.set(lag, loop=self.name)
+            self.histogram.observe(lag, loop=self.name)
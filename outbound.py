@@ -0,0 +1,376 @@
+"""
+Outbound reply delivery to the Bot Connector
+
+The SDK sends every `turn_context.send_activity` as its own POST through a
+connector client bound to the turn's event loop, and the Flask sync mode
+runs each turn on a new loop, so no connection is ever reused. This module
+replaces that path:
+
+  * ConnectorSender owns one pooled aiohttp.ClientSession per worker, on a
+    private event loop thread, so connections to the connector stay open
+    across turns whichever serving mode runs the turn. 429 and 5xx answers
+    and failed connection attempts are retried with jittered exponential
+    backoff, honouring Retry-After. Timeouts are not retried, since the
+    connector may already have posted the message.
+
+  * Outbox buffers a turn's consecutive plain-text replies to the same
+    conversation for a short window and sends them as one activity. Any
+    other activity (cards, typing, delays) flushes the buffer first, so the
+    order users see is unchanged, and the turn does not finish until
+    everything it sent has been delivered.
+
+OutboundAdapter wires both into the Bot Framework adapter, and
+continue_conversation() starts proactive turns (poll card updates,
+reminders) through whichever adapter is in use.
+"""
+
+import asyncio
+import copy
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+import aiohttp
+from botbuilder.core import BotAdapter
+from botbuilder.schema import ActivityTypes, ConversationReference, ResourceResponse
+from botframework.connector.auth import ClaimsIdentity
+from auth_cache import CachingBotFrameworkAdapter
+from metrics import REGISTRY
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_LATENCY = REGISTRY.histogram(
+    "bot_outbound_seconds", "Time to deliver an activity to the connector, retries included"
+)
+OUTBOUND_RETRIES = REGISTRY.counter("bot_outbound_retries_total", "Connector sends retried, by reason")
+OUTBOUND_ACTIVITIES = REGISTRY.counter(
+    "bot_outbound_activities_total", "Outgoing activities by result (sent, coalesced, failed)"
+)
+
+OUTBOX_KEY = "outbound.outbox"
+# Activity types the SDK handles without calling the connector
+_LOCAL_TYPES = ("delay", ActivityTypes.invoke_response, ActivityTypes.trace)
+
+
+class OutboundError(Exception):
+    """Raised when the connector does not accept an activity"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_retry_after(value, now=time.time):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now())
+    except (TypeError, ValueError):
+        return None
+
+
+def activity_url(activity):
+    """Connector endpoint for an activity: a reply when it has replyToId, else a new message"""
+    url = "{}/v3/conversations/{}/activities".format(
+        activity.service_url.rstrip("/"), quote(activity.conversation.id, safe="")
+    )
+    if activity.reply_to_id:
+        url += "/" + quote(activity.reply_to_id, safe="")
+    return url
+
+
+class ConnectorSender:
+    """Pooled, retrying HTTP client for connector sends, one per worker"""
+
+    def __init__(self, pool_size=50, timeout=15.0, max_retries=3, backoff_base=0.25, backoff_max=8.0,
+                 max_retry_after=30.0, rng=random.random):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.rng = rng
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    async def send(self, activity, credentials=None):
+        """POST `activity` to its conversation and return the connector's ResourceResponse"""
+        with span("outbound.send"):
+            payload = activity.serialize()
+            future = asyncio.run_coroutine_threadsafe(
+                self._deliver(activity_url(activity), payload, credentials), self._ensure_loop()
+            )
+            return await asyncio.wrap_future(future)
+
+    async def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or self._pid != os.getpid():
+            return
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._close_session(), loop))
+        loop.call_soon_threadsafe(loop.stop)
+        await asyncio.to_thread(thread.join, 5)
+        loop.close()
+
+    def _ensure_loop(self):
+        # Started lazily, and again after a fork, since threads do not survive one
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._session = None
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="connector-sender", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _close_session(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _headers(self, credentials):
+        headers = {}
+        if credentials is not None and getattr(credentials, "microsoft_app_id", None):
+            # MSAL caches the token; the first call of a worker goes to the network
+            token = await asyncio.to_thread(credentials.get_access_token)
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    def backoff(self, attempt, retry_after=None):
+        """Delay before retry number `attempt` (0-based), or None if the server asked for too long"""
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            # A little jitter so workers told the same time do not all return at once
+            return retry_after + self.rng() * self.backoff_base
+        return self.rng() * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+
+    async def _deliver(self, url, payload, credentials):
+        session = self._get_session()
+        headers = await self._headers(credentials)
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with session.post(url, json=payload, headers=headers) as resp:
+                    body = await resp.text()
+                    if resp.status < 300:
+                        OUTBOUND_LATENCY.observe(time.perf_counter() - started, outcome="ok")
+                        data = json.loads(body) if body.strip() else {}
+                        return ResourceResponse(id=data.get("id", "") if isinstance(data, dict) else "")
+                    status = resp.status
+                    reason = str(status)
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    error = OutboundError(f"Connector answered {status}: {body[:200]}", status)
+                    retryable = status == 429 or status >= 500
+            except aiohttp.ClientConnectorError as e:
+                # Nothing reached the connector, so trying again cannot duplicate the message
+                reason, error, retryable = "connect", OutboundError(f"Cannot reach connector: {e}"), True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason, error, retryable = "transport", OutboundError(f"Connector request failed: {e!r}"), False
+
+            delay = self.backoff(attempt, retry_after) if retryable and attempt < self.max_retries else None
+            if delay is None:
+                OUTBOUND_LATENCY.observe(time.perf_counter() - started, outcome="error")
+                raise error
+            OUTBOUND_RETRIES.inc(reason=reason)
+            logger.info("Retrying connector send in %.2fs after %s", delay, reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def mergeable(activity):
+    """Whether an activity is a plain-text message that can be merged with its neighbours"""
+    return (
+        activity.type == ActivityTypes.message
+        and bool(activity.text)
+        and not activity.attachments
+        and not activity.suggested_actions
+        and not activity.entities
+        and not activity.channel_data
+        and not activity.speak
+    )
+
+
+class _Batch:
+    __slots__ = ("activities", "chars", "credentials", "timer")
+
+    def __init__(self, credentials):
+        self.activities = []
+        self.chars = 0
+        self.credentials = credentials
+        self.timer = None
+
+
+class Outbox:
+    """One turn's outgoing activities, with consecutive text replies merged per conversation"""
+
+    def __init__(self, sender, window=0.05, max_chars=12000, separator="\n\n"):
+        self.sender = sender
+        self.window = window
+        self.max_chars = max_chars
+        self.separator = separator
+        self._pending = {}
+        self._tails = {}
+        self._deliveries = []
+
+    @staticmethod
+    def _key(activity):
+        return activity.service_url, activity.conversation.id, activity.reply_to_id
+
+    async def send(self, activity, credentials=None):
+        """Queue or send one activity; buffered text answers at once with an empty id, like the SDK"""
+        key = self._key(activity)
+        if self.window > 0 and mergeable(activity):
+            batch = self._pending.get(key)
+            if batch is not None and (
+                batch.chars + len(activity.text) > self.max_chars
+                or batch.activities[0].text_format != activity.text_format
+            ):
+                self.flush(key)
+                batch = None
+            if batch is None:
+                batch = self._pending[key] = _Batch(credentials)
+                batch.timer = asyncio.get_running_loop().call_later(self.window, self.flush, key)
+            batch.activities.append(activity)
+            batch.chars += len(activity.text)
+            return ResourceResponse(id="")
+
+        self.flush(key)
+        return await self._deliver(key, activity, credentials)
+
+    def flush(self, key=None):
+        """Hand buffered text for `key` (or every conversation) to delivery without waiting for it"""
+        for pending_key in list(self._pending) if key is None else [key]:
+            batch = self._pending.pop(pending_key, None)
+            if batch is None:
+                continue
+            batch.timer.cancel()
+            activity = batch.activities[0]
+            if len(batch.activities) > 1:
+                OUTBOUND_ACTIVITIES.inc(len(batch.activities) - 1, result="coalesced")
+                activity = copy.copy(activity)
+                activity.text = self.separator.join(item.text for item in batch.activities)
+            self._deliveries.append(self._deliver(pending_key, activity, batch.credentials))
+
+    async def drain(self):
+        """Flush and wait until everything sent this turn was delivered; raises the first failure"""
+        self.flush()
+        deliveries, self._deliveries = self._deliveries, []
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def _deliver(self, key, activity, credentials):
+        # Deliveries to one conversation are chained so they arrive in the order sent
+        task = asyncio.get_running_loop().create_task(self._send_after(self._tails.get(key), activity, credentials))
+        self._tails[key] = task
+        task.add_done_callback(functools.partial(self._finished, key))
+        return task
+
+    async def _send_after(self, previous, activity, credentials):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            response = await self.sender.send(activity, credentials)
+        except Exception:
+            OUTBOUND_ACTIVITIES.inc(result="failed")
+            raise
+        OUTBOUND_ACTIVITIES.inc(result="sent")
+        return response
+
+    def _finished(self, key, task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+
+class OutboundAdapter(CachingBotFrameworkAdapter):
+    """Adapter that delivers replies through a shared ConnectorSender and a per-turn Outbox"""
+
+    def __init__(self, settings, sender=None, window=0.05, max_chars=12000, token_cache=None):
+        super().__init__(settings, token_cache)
+        self.sender = sender if sender is not None else ConnectorSender()
+        self.window = window
+        self.max_chars = max_chars
+
+    def outbox(self, context):
+        outbox = context.turn_state.get(OUTBOX_KEY)
+        if outbox is None:
+            outbox = context.turn_state[OUTBOX_KEY] = Outbox(self.sender, self.window, self.max_chars)
+        return outbox
+
+    async def send_activities(self, context, activities):
+        client = context.turn_state.get(BotAdapter.BOT_CONNECTOR_CLIENT_KEY)
+        if client is None:
+            return await super().send_activities(context, activities)
+
+        outbox = self.outbox(context)
+        responses = []
+        for activity in activities:
+            if (
+                activity.type in _LOCAL_TYPES
+                or not getattr(activity, "service_url", None)
+                or not getattr(activity.conversation, "id", None)
+            ):
+                # Let the SDK handle (or reject) it, after whatever was said before it
+                outbox.flush()
+                responses.extend(await super().send_activities(context, [activity]))
+            else:
+                responses.append(await outbox.send(activity, client.config.credentials))
+        return responses
+
+    async def run_pipeline(self, context, callback=None):
+        try:
+            result = await super().run_pipeline(context, callback)
+        except Exception:
+            try:
+                await self._drain(context)
+            except Exception as e:
+                logger.error("Delivering replies of a failed turn: %s", e)
+            raise
+        await self._drain(context)
+        return result
+
+    @staticmethod
+    async def _drain(context):
+        outbox = context.turn_state.get(OUTBOX_KEY)
+        if outbox is not None:
+            await outbox.drain()
+
+
+async def continue_conversation(adapter, reference, callback, app_id=""):
+    """Run `callback` in a proactive turn of the conversation `reference` (a dict or ConversationReference)"""
+    if isinstance(reference, dict):
+        reference = ConversationReference().deserialize(reference)
+    if app_id:
+        return await adapter.continue_conversation(reference, callback, app_id)
+    # Development mode has no app id to build the bot's identity from
+    return await adapter.continue_conversation(reference, callback, claims_identity=ClaimsIdentity({}, True))
@@ -0,0 +1,548 @@
+"""
+Poll storage, vote aggregation and in-place card updates for the `poll` command
+
+`poll Lunch? Pizza, Sushi, Tacos` posts an Adaptive Card with a button per
+option. A button press arrives as a turn whose `activity.value` names the
+poll and the option, and is handed to PollEngine.vote(), which only queues
+it: no reply is sent per vote.
+
+Votes are written in batches (every `flush_interval` seconds or
+`batch_size` votes) to a SQLite file shared by every gunicorn worker. Each
+worker adds its batch to its own shard of each option's counter
+(`count = count + delta`, one row per poll, option and shard) inside one
+transaction that also records who voted for what, so a changed vote moves
+from one option to the other and concurrent workers never lose an update.
+An option's total is the sum of its shards.
+
+A PollAggregator then updates each poll's card in place at most once per
+`interval`, and only if votes arrived since the last update. Any worker may
+run it: a poll's version is claimed with a compare-and-set before its card
+is rendered, so each version is rendered by exactly one worker. Polls close
+on `poll close <id>` (creator only) or when they expire; votes for a closed
+poll are refused and the card's final state has no buttons.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import shlex
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from botbuilder.core import CardFactory, MessageFactory, TurnContext
+from metrics import REGISTRY
+from sqlite_db import ConnectionCache, transaction
+from outbound import continue_conversation
+
+logger = logging.getLogger(__name__)
+
+POLL_VOTES = REGISTRY.counter("bot_poll_votes_total", "Poll votes by result (accepted, closed, unknown, invalid)")
+POLL_CARD_UPDATES = REGISTRY.counter("bot_poll_card_updates_total", "Poll cards updated in place, by outcome")
+
+VOTE_ACTION = "poll_vote"
+CLOSE_ACTION = "poll_close"
+
+ACCEPTED = "accepted"
+CLOSED = "closed"
+UNKNOWN = "unknown"
+INVALID = "invalid"
+
+MIN_OPTIONS = 2
+MAX_OPTIONS = 10
+MAX_TEXT_CHARS = 200
+
+
+class PollError(ValueError):
+    """Raised for poll commands that cannot be carried out"""
+
+
+@dataclass(frozen=True)
+class Poll:
+    """A poll and the message its card was posted as"""
+
+    id: str
+    conversation_id: str
+    question: str
+    options: tuple
+    created_by: str
+    created_at: float
+    expires_at: float
+    closed_at: float = None
+    activity_id: str = None
+    reference: dict = None
+    version: int = 0
+    rendered_version: int = 0
+
+    def is_open(self, now):
+        return self.closed_at is None and now < self.expires_at
+
+
+def parse_poll(text):
+    """(question, options) from `Lunch? Pizza, Sushi` or `"Lunch?" "Pizza" "Sushi"`"""
+    text = (text or "").strip()
+    if text.startswith('"'):
+        try:
+            parts = shlex.split(text)
+        except ValueError:
+            raise PollError("Unbalanced quotes in poll") from None
+        question, options = (parts[0], parts[1:]) if parts else ("", [])
+    else:
+        question, mark, rest = text.partition("?")
+        question += mark
+        options = rest.split(",")
+    question = question.strip()
+    options = [option.strip() for option in options if option.strip()]
+    if not question or len(options) < MIN_OPTIONS:
+        raise PollError("Usage: poll <question>? <option>, <option>[, ...]")
+    if len(options) > MAX_OPTIONS:
+        raise PollError(f"A poll can have at most {MAX_OPTIONS} options")
+    if len(set(option.casefold() for option in options)) != len(options):
+        raise PollError("Poll options must be different")
+    if any(len(item) > MAX_TEXT_CHARS for item in [question, *options]):
+        raise PollError(f"Questions and options are limited to {MAX_TEXT_CHARS} characters")
+    return question, options
+
+
+class SqlitePollStore:
+    """Polls, votes and sharded per-option counters in a WAL-mode SQLite file"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS polls ("
+        " poll_id TEXT PRIMARY KEY,"
+        " conversation_id TEXT NOT NULL,"
+        " question TEXT NOT NULL,"
+        " options TEXT NOT NULL,"
+        " created_by TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " expires_at REAL NOT NULL,"
+        " closed_at REAL,"
+        " activity_id TEXT,"
+        " reference TEXT,"
+        " version INTEGER NOT NULL DEFAULT 0,"
+        " rendered_version INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS polls_open ON polls (closed_at, expires_at)",
+        "CREATE TABLE IF NOT EXISTS poll_votes ("
+        " poll_id TEXT NOT NULL,"
+        " user_id TEXT NOT NULL,"
+        " option INTEGER NOT NULL,"
+        " PRIMARY KEY (poll_id, user_id)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS poll_counts ("
+        " poll_id TEXT NOT NULL,"
+        " option INTEGER NOT NULL,"
+        " shard INTEGER NOT NULL,"
+        " count INTEGER NOT NULL,"
+        " PRIMARY KEY (poll_id, option, shard)) WITHOUT ROWID",
+    )
+    COLUMNS = (
+        "poll_id, conversation_id, question, options, created_by, created_at, expires_at, "
+        "closed_at, activity_id, reference, version, rendered_version"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = ConnectionCache(path)
+        conn = self._connections.get()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    @staticmethod
+    def _poll(row):
+        return Poll(
+            row[0], row[1], row[2], tuple(json.loads(row[3])), row[4], row[5], row[6], row[7], row[8],
+            json.loads(row[9]) if row[9] else None, row[10], row[11],
+        )
+
+    def create(self, poll):
+        self._connections.get().execute(
+            f"INSERT INTO polls ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, NULL, 0, 0)",
+            (poll.id, poll.conversation_id, poll.question, json.dumps(list(poll.options)), poll.created_by,
+             poll.created_at, poll.expires_at),
+        )
+
+    def get(self, poll_id):
+        row = self._connections.get().execute(
+            f"SELECT {self.COLUMNS} FROM polls WHERE poll_id = ?", (poll_id,)
+        ).fetchone()
+        return self._poll(row) if row else None
+
+    def set_message(self, poll_id, activity_id, reference):
+        """Record the card's activity id and conversation reference; the next aggregation renders it"""
+        self._connections.get().execute(
+            "UPDATE polls SET activity_id = ?, reference = ?, version = version + 1 WHERE poll_id = ?",
+            (activity_id, json.dumps(reference), poll_id),
+        )
+
+    def apply_votes(self, votes, shard):
+        """Apply [(poll_id, user_id, option, cast_at)] in one transaction; returns how many were refused
+
+        A vote counts if it was cast before the poll closed or expired, even if
+        it is written afterwards.
+        """
+        conn = self._connections.get()
+        polls = {}
+        deltas = defaultdict(int)
+        refused = 0
+        with transaction(conn):
+            for poll_id, user_id, option, cast_at in votes:
+                if poll_id not in polls:
+                    polls[poll_id] = conn.execute(
+                        "SELECT options, closed_at, expires_at FROM polls WHERE poll_id = ?", (poll_id,)
+                    ).fetchone()
+                row = polls[poll_id]
+                if row is None or cast_at >= min(row[2], row[1] or row[2]):
+                    refused += 1
+                    continue
+                if not 0 <= option < len(json.loads(row[0])):
+                    refused += 1
+                    continue
+                previous = conn.execute(
+                    "SELECT option FROM poll_votes WHERE poll_id = ? AND user_id = ?", (poll_id, user_id)
+                ).fetchone()
+                if previous is not None:
+                    if previous[0] == option:
+                        continue
+                    deltas[(poll_id, previous[0])] -= 1
+                deltas[(poll_id, option)] += 1
+                conn.execute(
+                    "INSERT INTO poll_votes (poll_id, user_id, option) VALUES (?, ?, ?) "
+                    "ON CONFLICT(poll_id, user_id) DO UPDATE SET option = excluded.option",
+                    (poll_id, user_id, option),
+                )
+            for (poll_id, option), delta in deltas.items():
+                if delta:
+                    conn.execute(
+                        "INSERT INTO poll_counts (poll_id, option, shard, count) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(poll_id, option, shard) DO UPDATE SET count = count + excluded.count",
+                        (poll_id, option, shard, delta),
+                    )
+            for poll_id in {poll_id for poll_id, _ in deltas}:
+                conn.execute("UPDATE polls SET version = version + 1 WHERE poll_id = ?", (poll_id,))
+        return refused
+
+    def counts(self, poll_id, options):
+        """Total votes per option: the sum of the option's shards"""
+        totals = [0] * options
+        for option, count in self._connections.get().execute(
+            "SELECT option, SUM(count) FROM poll_counts WHERE poll_id = ? GROUP BY option", (poll_id,)
+        ):
+            totals[option] = count
+        return totals
+
+    def close(self, poll_id, at):
+        """Close an open poll; returns False if it was already closed or does not exist"""
+        cursor = self._connections.get().execute(
+            "UPDATE polls SET closed_at = ?, version = version + 1 WHERE poll_id = ? AND closed_at IS NULL",
+            (at, poll_id),
+        )
+        return cursor.rowcount == 1
+
+    def expired(self, now):
+        """Ids of polls past their expiry that are not closed yet"""
+        rows = self._connections.get().execute(
+            "SELECT poll_id FROM polls WHERE closed_at IS NULL AND expires_at <= ?", (now,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def due(self, limit=100):
+        """Polls with a posted card whose latest version has not been rendered"""
+        rows = self._connections.get().execute(
+            f"SELECT {self.COLUMNS} FROM polls WHERE version > rendered_version AND activity_id IS NOT NULL "
+            "LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [self._poll(row) for row in rows]
+
+    def claim(self, poll):
+        """Take the job of rendering `poll.version`; False if another worker already has"""
+        cursor = self._connections.get().execute(
+            "UPDATE polls SET rendered_version = ? WHERE poll_id = ? AND rendered_version = ?",
+            (poll.version, poll.id, poll.rendered_version),
+        )
+        return cursor.rowcount == 1
+
+    def unclaim(self, poll):
+        """Give a failed render back so the next aggregation retries it"""
+        self._connections.get().execute(
+            "UPDATE polls SET rendered_version = ? WHERE poll_id = ? AND rendered_version = ?",
+            (poll.rendered_version, poll.id, poll.version),
+        )
+
+
+def render_card(poll, counts, now=None):
+    """Adaptive Card content for a poll: results so far, and buttons while it is open"""
+    now = time.time() if now is None else now
+    total = sum(counts)
+    is_open = poll.is_open(now)
+    body = [{"type": "TextBlock", "text": f"📊 {poll.question}", "weight": "Bolder", "size": "Medium", "wrap": True}]
+    for option, count in zip(poll.options, counts):
+        share = count / total if total else 0
+        bar = "█" * round(share * 20) + "░" * (20 - round(share * 20))
+        body.append({
+            "type": "ColumnSet",
+            "columns": [
+                {"type": "Column", "width": "stretch", "items": [{"type": "TextBlock", "text": option, "wrap": True}]},
+                {"type": "Column", "width": "auto", "items": [
+                    {"type": "TextBlock", "text": f"{bar} {count} ({share:.0%})", "fontType": "Monospace"},
+                ]},
+            ],
+        })
+    status = "Voting open" if is_open else "Poll closed"
+    body.append({"type": "TextBlock", "text": f"{total} vote{'s' if total != 1 else ''} · {status}",
+                 "isSubtle": True, "spacing": "Medium"})
+    card = {
+        "type": "AdaptiveCard",
+        "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+        "version": "1.4",
+        "body": body,
+    }
+    if is_open:
+        card["actions"] = [
+            {"type": "Action.Submit", "title": option, "data": {"action": VOTE_ACTION, "poll": poll.id, "option": i}}
+            for i, option in enumerate(poll.options)
+        ] + [{"type": "Action.Submit", "title": "Close poll", "data": {"action": CLOSE_ACTION, "poll": poll.id}}]
+    return card
+
+
+def card_activity(poll, counts, now=None):
+    return MessageFactory.attachment(CardFactory.adaptive_card(render_card(poll, counts, now)))
+
+
+class PollEngine:
+    """Creates polls, queues votes and writes them in batches to this worker's counter shards"""
+
+    def __init__(self, store, shards=16, flush_interval=0.2, batch_size=500, duration=24 * 3600, clock=time.time,
+                 max_open=1024):
+        self.store = store
+        self.shards = shards
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.duration = duration
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flusher = None
+        self._flusher_pid = None
+        self._closed = False
+        # poll_id -> (options, expires_at) of open polls seen by this worker, least recently voted first;
+        # closing is checked at write time
+        self.max_open = max_open
+        self._open = OrderedDict()
+
+    @property
+    def shard(self):
+        # Each worker writes its own shard, so workers do not update the same counter rows
+        return os.getpid() % self.shards
+
+    def create(self, conversation_id, question, options, created_by, duration=None):
+        now = self.clock()
+        poll = Poll(
+            uuid.uuid4().hex[:10], conversation_id, question, tuple(options), created_by, now,
+            now + (duration or self.duration),
+        )
+        self.store.create(poll)
+        return poll
+
+    def vote(self, poll_id, user_id, option):
+        """Queue a vote; returns ACCEPTED, CLOSED, UNKNOWN or INVALID"""
+        with self._lock:
+            known = self._open.get(poll_id)
+            if known is not None:
+                self._open.move_to_end(poll_id)
+        if known is None:
+            poll = self.store.get(poll_id)
+            if poll is None:
+                result = UNKNOWN
+            elif not poll.is_open(self.clock()):
+                result = CLOSED
+            else:
+                known = (len(poll.options), poll.expires_at)
+                with self._lock:
+                    self._open[poll_id] = known
+                    if len(self._open) > self.max_open:
+                        self._open.popitem(last=False)
+        if known is not None:
+            if self.clock() >= known[1]:
+                with self._lock:
+                    self._open.pop(poll_id, None)
+                result = CLOSED
+            elif not isinstance(option, int) or not 0 <= option < known[0]:
+                result = INVALID
+            else:
+                result = ACCEPTED
+                with self._lock:
+                    self._pending.append((poll_id, user_id, option, self.clock()))
+                    full = len(self._pending) >= self.batch_size
+                if full:
+                    self.flush()
+                else:
+                    self._ensure_flusher()
+        POLL_VOTES.inc(result=result)
+        return result
+
+    def _ensure_flusher(self):
+        if self._closed or (
+            self._flusher is not None and self._flusher.is_alive() and self._flusher_pid == os.getpid()
+        ):
+            return
+
+        def run():
+            while not self._closed:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error("Poll vote flush failed: %s", e, exc_info=True)
+
+        self._flusher_pid = os.getpid()
+        self._flusher = threading.Thread(target=run, name="poll-flush", daemon=True)
+        self._flusher.start()
+
+    def flush(self):
+        """Write queued votes in one transaction"""
+        with self._lock:
+            votes, self._pending = self._pending, []
+        if not votes:
+            return
+        try:
+            refused = self.store.apply_votes(votes, self.shard)
+        except Exception:
+            with self._lock:
+                self._pending = votes + self._pending
+            raise
+        if refused:
+            # Closed while the votes were queued
+            POLL_VOTES.inc(refused, result=CLOSED)
+
+    def close(self, poll_id, user_id):
+        """Close a poll on its creator's request"""
+        poll = self.store.get(poll_id)
+        if poll is None:
+            raise PollError("No such poll")
+        if poll.created_by != user_id:
+            raise PollError("Only the person who started the poll can close it")
+        self.flush()
+        with self._lock:
+            self._open.pop(poll_id, None)
+        return self.store.close(poll_id, self.clock())
+
+    def shutdown(self):
+        self._closed = True
+        self.flush()
+
+
+class CardUpdater:
+    """Replaces a poll's card in its conversation through the adapter"""
+
+    def __init__(self, adapter, app_id=""):
+        self.adapter = adapter
+        self.app_id = app_id
+
+    async def __call__(self, poll, counts):
+        activity = card_activity(poll, counts)
+        activity.id = poll.activity_id
+
+        async def update(turn_context):
+            await turn_context.update_activity(activity)
+
+        await continue_conversation(self.adapter, poll.reference, update, self.app_id)
+
+
+class PollAggregator:
+    """Closes expired polls and updates changed poll cards every `interval` seconds
+
+    Runs on its own thread and event loop, started lazily in each worker.
+    """
+
+    def __init__(self, engine, updater, interval=2.0):
+        self.engine = engine
+        self.updater = updater
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    async def aggregate(self):
+        """One pass; returns the number of cards updated"""
+        engine, store = self.engine, self.engine.store
+        engine.flush()
+        for poll_id in store.expired(engine.clock()):
+            poll = store.get(poll_id)
+            if poll is not None:
+                store.close(poll_id, poll.expires_at)
+        updated = 0
+        for poll in store.due():
+            if not store.claim(poll):
+                continue
+            try:
+                await self.updater(poll, store.counts(poll.id, len(poll.options)))
+            except Exception as e:
+                store.unclaim(poll)
+                POLL_CARD_UPDATES.inc(outcome="error")
+                logger.warning("Could not update the card of poll %s: %s", poll.id, e)
+                continue
+            POLL_CARD_UPDATES.inc(outcome="updated")
+            updated += 1
+        return updated
+
+    def start(self):
+        """Start the aggregation thread in this process unless it is running"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return self
+
+        async def run():
+            while not self._stop.is_set():
+                try:
+                    await self.aggregate()
+                except Exception as e:
+                    logger.error("Poll aggregation failed: %s", e, exc_info=True)
+                await asyncio.sleep(self.interval)
+
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=asyncio.run, args=(run(),), name="poll-aggregator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+async def post_poll(turn_context, engine, text, duration=None):
+    """Handle `poll ...`: create the poll and post its card, remembering where it was posted"""
+    question, options = parse_poll(text)
+    activity = turn_context.activity
+    poll = engine.create(activity.conversation.id, question, options, activity.from_property.id, duration)
+    response = await turn_context.send_activity(card_activity(poll, [0] * len(options)))
+    reference = TurnContext.get_conversation_reference(activity).serialize()
+    engine.store.set_message(poll.id, response.id if response else None, reference)
+    return poll
+
+
+async def handle_poll_action(turn_context, engine):
+    """Handle a card button press; returns True if the activity was a poll action
+
+    Votes get no reply; the card shows them at the next aggregation.
+    """
+    value = turn_context.activity.value
+    if not isinstance(value, dict) or value.get("action") not in (VOTE_ACTION, CLOSE_ACTION):
+        return False
+    user_id = turn_context.activity.from_property.id
+    if value["action"] == VOTE_ACTION:
+        result = engine.vote(str(value.get("poll")), user_id, value.get("option"))
+        if result == CLOSED:
+            await turn_context.send_activity("This poll is closed.")
+        return True
+    try:
+        engine.close(str(value.get("poll")), user_id)
+    except PollError as e:
+        await turn_context.send_activity(str(e))
+    return True
+
+
+def close_command_poll_id(args):
+    """The poll id of `poll close <id>`, or None if the text is not a close command"""
+    match = re.match(r"^close\s+([0-9a-f]{10})\s*$", (args or "").strip())
+    return match.group(1) if match else None
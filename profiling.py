@@ -0,0 +1,231 @@
+"""
+Opt-in request profiling for /api/messages
+
+Off by default. When BOT_PROFILE_ENABLED is set, a request is profiled if it
+carries the profiling header with the configured secret, if its message
+starts with one of the listed commands, or as one in every `sample_every`
+requests. Without a secret the header is ignored, so a caller cannot make
+the bot write profiles on demand. At most one request
+per worker is profiled at a time. A profiled request gets:
+
+  * a wall-clock stack sampler on the thread serving it, written as a
+    collapsed-stack file (`frame;frame;frame count` lines) that
+    flamegraph.pl, speedscope or inferno render directly, or a cProfile
+    dump when `mode="cprofile"`;
+  * named timing spans (deserialize, auth, turn, command:<name>,
+    outbound.send, ...) logged together with the request's correlation id.
+
+In the aiohttp mode one thread serves every turn, so the sampler also sees
+turns running concurrently with the profiled one; the spans are always the
+profiled request's own. In the queue ack mode only the acknowledgement is
+profiled, since the turn runs later on a worker.
+
+`span()` is what the rest of the code calls. Without a profiled request in
+the current context it returns a shared no-op context manager, so leaving
+spans in hot paths costs one context variable lookup.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from logging_setup import correlation_id
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PROFILES = REGISTRY.counter("bot_profiles_total", "Profiled requests by trigger (header, command, sample)")
+
+SAMPLER = "sampler"
+CPROFILE = "cprofile"
+
+_current = contextvars.ContextVar("profile_trace", default=None)
+_NO_SPAN = contextlib.nullcontext()
+
+
+def span(name):
+    """Time the enclosed block as `name` if the current request is being profiled"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return trace.span(name)
+
+
+class Trace:
+    """Spans recorded for one profiled request"""
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, start - self.started, time.perf_counter() - start))
+
+    def summary(self):
+        """Spans in start order, in milliseconds"""
+        return [
+            {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+            for name, start, duration in sorted(self.spans, key=lambda item: item[1])
+        ]
+
+
+def collapse(frame):
+    """One `root;...;leaf` line for a frame and its callers"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Samples one thread's stack every `interval` seconds, whatever it is doing"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+
+class Profiler:
+    """Decides which requests to profile and records them"""
+
+    def __init__(self, enabled=False, sample_every=0, header="X-Bot-Profile", secret="", commands=(),
+                 directory="/tmp/bot_profiles", interval=0.005, mode=SAMPLER):
+        if mode not in (SAMPLER, CPROFILE):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.header = header
+        self.secret = secret
+        self.commands = frozenset(command.lower() for command in commands)
+        self.directory = directory
+        self.interval = interval
+        self.mode = mode
+        self._requests = itertools.count(1)
+        self._busy = threading.Lock()
+
+    def trigger_for(self, header_value=None, text=None):
+        """Why this request should be profiled ("header", "command", "sample"), or None"""
+        if not self.enabled:
+            return None
+        if header_value and self.secret and hmac.compare_digest(header_value.encode(), self.secret.encode()):
+            return "header"
+        if self.commands and text:
+            words = text.split(None, 1)
+            if words and words[0].lower() in self.commands:
+                return "command"
+        if self.sample_every > 0 and next(self._requests) % self.sample_every == 0:
+            return "sample"
+        return None
+
+    def start(self, header_value=None, text=None):
+        """Begin profiling the current request if it qualifies; returns a session to finish, or None"""
+        trigger = self.trigger_for(header_value, text)
+        if trigger is None or not self._busy.acquire(blocking=False):
+            return None
+        PROFILES.inc(trigger=trigger)
+        return _Session(self, Trace(trigger))
+
+    @contextlib.contextmanager
+    def profile(self, header_value=None, text=None):
+        """Context-manager form of start()/finish()"""
+        session = self.start(header_value, text)
+        try:
+            yield session.trace if session is not None else None
+        finally:
+            if session is not None:
+                session.finish()
+
+    def _write(self, trace, stacks=None, cprofile=None):
+        os.makedirs(self.directory, exist_ok=True)
+        # The endpoint sets the correlation id after profiling starts, so read it at the end
+        # It comes from a request header, so keep it to characters that are safe in a file name
+        correlation = re.sub(r"[^A-Za-z0-9_-]", "_", correlation_id.get() or "none")[:64]
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{correlation}"
+        stem = os.path.join(self.directory, name)
+        if cprofile is not None:
+            path = stem + ".prof"
+            cprofile.dump_stats(path)
+            return path
+        path = stem + ".collapsed"
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class _Session:
+    """A profile in progress; binds its Trace to the current context until finished"""
+
+    def __init__(self, profiler, trace):
+        self.profiler = profiler
+        self.trace = trace
+        self._token = _current.set(trace)
+        self._sampler = None
+        self._cprofile = None
+        if profiler.mode == CPROFILE:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), profiler.interval).start()
+
+    def finish(self):
+        try:
+            if self._cprofile is not None:
+                self._cprofile.disable()
+                path = self.profiler._write(self.trace, cprofile=self._cprofile)
+            else:
+                path = self.profiler._write(self.trace, stacks=self._sampler.stop())
+        except OSError as e:
+            logger.warning("Could not write profile: %s", e)
+            path = None
+        finally:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                # Finished from another context (e.g. a Flask teardown); just unbind
+                _current.set(None)
+            self.profiler._busy.release()
+        logger.info(
+            "Profiled request",
+            extra={
+                "trigger": self.trace.trigger,
+                "duration_ms": round((time.perf_counter() - self.trace.started) * 1000, 3),
+                "spans": self.trace.summary(),
+                "profile_file": path,
+            },
+        )
+        return path
@@ -0,0 +1,263 @@
+"""
+QR code rendering off the request path for the `qr` command
+
+Rendering with qrcode/Pillow is CPU-bound, so QrRenderer runs it on an
+executor (a thread pool by default, or a process pool) instead of the event
+loop. Rendered PNGs are content-addressed: the key is a hash of the payload,
+error-correction level, box size and border, so the same request is rendered
+once and concurrent identical requests share one render.
+
+PNGs are kept in an in-memory LRU bounded by total bytes and written to a
+shared directory, so `/qr/<key>.png` can be answered by whichever gunicorn
+worker receives the image request. Cards reference that URL instead of
+embedding a base64 image in the activity.
+"""
+
+import asyncio
+import functools
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import REGISTRY
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+QR_LOOKUPS = REGISTRY.counter("bot_qr_lookups_total", "QR renders requested, by result (hit, miss, coalesced)")
+QR_RENDER_SECONDS = REGISTRY.histogram("bot_qr_render_seconds", "Time spent rendering a QR code PNG")
+QR_CACHE_BYTES = REGISTRY.gauge("bot_qr_cache_bytes", "Bytes of PNG data held in the in-memory QR cache")
+
+ERROR_CORRECTION_LEVELS = ("L", "M", "Q", "H")
+# Byte-mode capacity of the largest (version 40) symbol at each error-correction level
+MAX_PAYLOAD_BYTES = {"L": 2953, "M": 2331, "Q": 1663, "H": 1273}
+MAX_BOX_SIZE = 40
+KEY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class QrError(ValueError):
+    """Raised for payloads or options that cannot be rendered"""
+
+
+def qr_key(payload, error_correction="M", box_size=10, border=4):
+    """Content address of a rendered QR code"""
+    digest = hashlib.sha256(f"{error_correction}:{box_size}:{border}:".encode() + payload.encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def _too_large(level):
+    return f"QR payload is limited to {MAX_PAYLOAD_BYTES[level]} bytes at error correction {level}"
+
+
+def render_png(payload, error_correction="M", box_size=10, border=4):
+    """Render a QR code to PNG bytes; runs inside the executor"""
+    # Imported here so workers that never render a QR code do not pay for Pillow
+    import qrcode
+    from qrcode.constants import ERROR_CORRECT_H, ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q
+    from qrcode.exceptions import DataOverflowError
+
+    levels = {"L": ERROR_CORRECT_L, "M": ERROR_CORRECT_M, "Q": ERROR_CORRECT_Q, "H": ERROR_CORRECT_H}
+    qr = qrcode.QRCode(error_correction=levels[error_correction], box_size=box_size, border=border)
+    qr.add_data(payload)
+    try:
+        qr.make(fit=True)
+    except (DataOverflowError, ValueError):
+        # Past version 40 qrcode raises DataOverflowError, or ValueError("Invalid version") when fitting;
+        # mixed-mode segments can need more room than the byte-mode table allows for
+        raise QrError(_too_large(error_correction)) from None
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ByteLRUCache:
+    """LRU of byte strings bounded by their total size"""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self._entries[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        QR_CACHE_BYTES.set(self.total_bytes)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PngDirectory:
+    """Write-once PNG files shared by every worker on the host, pruned oldest first"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, prune_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.png")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        # Write to a temporary file and rename so readers never see a partial PNG
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._file(key))
+        except OSError as e:
+            logger.warning("Could not store QR image %s: %s", key, e)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".png"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class QrRenderer:
+    """Renders QR codes on an executor and caches the PNG bytes by content address"""
+
+    def __init__(self, cache_bytes=16 * 1024 * 1024, directory=None, pool="thread", max_workers=2):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"Unknown QR pool type: {pool}")
+        self.cache = ByteLRUCache(cache_bytes)
+        self.directory = directory
+        self.pool = pool
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._in_flight = {}
+
+    def _get_executor(self):
+        # Pools do not survive fork, so each gunicorn worker starts its own on first use
+        if self._executor is None or self._executor_pid != os.getpid():
+            if self.pool == "process":
+                # Imported here because it pulls in multiprocessing, which the thread pool does not need
+                from concurrent.futures.process import ProcessPoolExecutor
+
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qr")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    async def render(self, payload, error_correction="M", box_size=10, border=4):
+        """Key of the rendered PNG, rendering it on the executor if it is not cached"""
+        error_correction = error_correction.upper()
+        if error_correction not in ERROR_CORRECTION_LEVELS:
+            raise QrError(f"Error correction must be one of {', '.join(ERROR_CORRECTION_LEVELS)}")
+        if not payload:
+            raise QrError("Nothing to encode")
+        if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES[error_correction]:
+            raise QrError(_too_large(error_correction))
+        if not 1 <= box_size <= MAX_BOX_SIZE or border < 0:
+            raise QrError("Invalid QR size")
+
+        key = qr_key(payload, error_correction, box_size, border)
+        if self.get(key) is not None:
+            QR_LOOKUPS.inc(result="hit")
+            return key
+
+        loop = asyncio.get_running_loop()
+        future = self._in_flight.get(key)
+        if future is not None and future.get_loop() is loop:
+            QR_LOOKUPS.inc(result="coalesced")
+        else:
+            QR_LOOKUPS.inc(result="miss")
+            future = loop.create_task(self._render(key, payload, error_correction, box_size, border))
+            self._in_flight[key] = future
+            future.add_done_callback(functools.partial(self._finished, key))
+        with span("qr.render"):
+            await asyncio.shield(future)
+        return key
+
+    def _finished(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _render(self, key, payload, error_correction, box_size, border):
+        loop = asyncio.get_running_loop()
+        with QR_RENDER_SECONDS.time():
+            data = await loop.run_in_executor(
+                self._get_executor(), render_png, payload, error_correction, box_size, border
+            )
+        self.cache.put(key, data)
+        if self.directory is not None:
+            await loop.run_in_executor(None, self.directory.put, key, data)
+
+    def get(self, key):
+        """PNG bytes for a key, from memory or the shared directory; None if unknown"""
+        data = self.cache.get(key)
+        if data is None and self.directory is not None and KEY_PATTERN.match(key):
+            data = self.directory.get(key)
+            if data is not None:
+                self.cache.put(key, data)
+        return data
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+
+def image_url(base_url, key):
+    """Public URL of a cached QR image"""
+    return f"{base_url.rstrip('/')}/qr/{key}.png"
@@ -0,0 +1,267 @@
+"""
+Admission control for /api/messages
+
+RateLimiter keeps token buckets per user, per conversation and per tenant,
+taken from the activity. A turn is admitted only if every bucket it maps to
+has a token, and then takes one from each, so a single noisy user, channel
+or tenant cannot take every worker. Over-limit turns get at most one cheap
+canned reply per conversation every `notice_interval` seconds and are
+otherwise dropped.
+
+Bucket state lives in a pluggable backend, in the same shape as the
+de-duplication backends: an in-memory table for a single process, or a
+SQLite file that every gunicorn worker on the host shares. A backend error
+lets the turn through rather than refusing service. Async callers use
+check_async(), which runs a blocking (SQLite) backend in the loop's
+executor so its write transactions never stall the event loop.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+from sqlite_db import ConnectionCache, transaction
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_CHECKED = REGISTRY.counter("bot_rate_limit_checked_total", "Activities checked against the rate limits")
+RATE_LIMITED = REGISTRY.counter("bot_rate_limited_total", "Over-limit activities by scope and action (reply, drop)")
+
+SCOPES = ("user", "conversation", "tenant")
+# Activity types that start a turn worth limiting; lifecycle events always get through
+LIMITED_TYPES = ("message", "invoke")
+
+REPLY = "reply"
+DROP = "drop"
+
+
+def parse_limit(spec):
+    """Parse a "rate:burst" limit (tokens per second, bucket size); empty means unlimited"""
+    if not spec or not spec.strip():
+        return None
+    try:
+        rate, burst = (float(part) for part in spec.split(":"))
+    except ValueError:
+        raise ValueError(f"Rate limit must look like 'rate:burst', got {spec!r}") from None
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"Rate limit needs a positive rate and a burst of at least 1, got {spec!r}")
+    return rate, burst
+
+
+def _refill(tokens, updated_at, rate, burst, now):
+    if tokens is None:
+        return burst
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+def _plan(levels, buckets, cost):
+    """Seconds until every bucket can pay `cost`, and the index of the slowest one"""
+    wait, limiting = 0.0, None
+    for index, (level, (_, rate, _)) in enumerate(zip(levels, buckets)):
+        if level < cost and (cost - level) / rate > wait:
+            wait, limiting = (cost - level) / rate, index
+    return wait, limiting
+
+
+class MemoryBucketBackend:
+    """Token buckets local to one process, bounded by dropping the least recently used"""
+
+    def __init__(self, max_entries=100000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, buckets, cost=1.0):
+        """Take `cost` from every (key, rate, burst) bucket, or from none of them
+
+        Returns (0.0, None) when admitted, else the seconds until the call
+        would succeed and the index of the bucket that is short.
+        """
+        now = self.clock()
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, updated_at = self._buckets.get(key, (None, now))
+                levels.append(_refill(tokens, updated_at, rate, burst, now))
+            wait, limiting = _plan(levels, buckets, cost)
+            if limiting is not None:
+                return wait, limiting
+            for (key, _, _), level in zip(buckets, levels):
+                self._buckets[key] = (level - cost, now)
+                self._buckets.move_to_end(key)
+            # An evicted bucket simply starts full again
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+            return 0.0, None
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SqliteBucketBackend:
+    """Token buckets in a SQLite file so every worker process on the host shares them"""
+
+    PRUNE_EVERY = 1000
+    # Each acquire is a write transaction that may wait on other workers
+    blocking = True
+
+    def __init__(self, path, idle_ttl=3600, clock=time.time):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self._connections = ConnectionCache(path, timeout=5)
+        self._writes = 0
+        self._connections.get().execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def acquire(self, buckets, cost=1.0):
+        """Same contract as MemoryBucketBackend.acquire, atomic across processes"""
+        conn = self._connections.get()
+        keys = [key for key, _, _ in buckets]
+        # IMMEDIATE takes the write lock up front so two workers cannot spend the same token
+        with transaction(conn):
+            now = self.clock()
+            rows = dict(
+                (key, (tokens, updated_at))
+                for key, tokens, updated_at in conn.execute(
+                    "SELECT key, tokens, updated_at FROM rate_buckets WHERE key IN ({})".format(
+                        ",".join("?" * len(keys))
+                    ),
+                    keys,
+                )
+            )
+            levels = [
+                _refill(*rows.get(key, (None, now)), rate, burst, now) for key, rate, burst in buckets
+            ]
+            wait, limiting = _plan(levels, buckets, cost)
+            if limiting is None:
+                conn.executemany(
+                    "INSERT INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                    [(key, level - cost, now) for key, level in zip(keys, levels)],
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    # Idle buckets have refilled; dropping them changes nothing
+                    conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - self.idle_ttl,))
+        return wait, limiting
+
+    def __len__(self):
+        return self._connections.get().execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+
+
+class RateDecision:
+    """Outcome of a rate-limit check"""
+
+    __slots__ = ("allowed", "scope", "retry_after", "notify")
+
+    def __init__(self, allowed, scope=None, retry_after=0.0, notify=False):
+        self.allowed = allowed
+        self.scope = scope
+        self.retry_after = retry_after
+        self.notify = notify
+
+
+ADMITTED = RateDecision(True)
+
+
+class RateLimiter:
+    """Token-bucket admission per user, conversation and tenant"""
+
+    def __init__(self, backend, limits, action=REPLY, notice_interval=30.0):
+        unknown = set(limits) - set(SCOPES)
+        if unknown:
+            raise ValueError(f"Unknown rate limit scopes: {', '.join(sorted(unknown))}")
+        if action not in (REPLY, DROP):
+            raise ValueError(f"Unknown rate limit action: {action}")
+        self.backend = backend
+        self.limits = {scope: limit for scope, limit in limits.items() if limit is not None}
+        self.action = action
+        self.notice_interval = notice_interval
+
+    @staticmethod
+    def keys_for(activity):
+        """The user, conversation and tenant ids of an activity, where present"""
+        sender = getattr(activity, "from_property", None)
+        conversation = getattr(activity, "conversation", None)
+        tenant = getattr(conversation, "tenant_id", None)
+        channel_data = getattr(activity, "channel_data", None)
+        if not tenant and isinstance(channel_data, dict):
+            # Teams sends the tenant in channelData before the adapter copies it over
+            tenant = (channel_data.get("tenant") or {}).get("id")
+        return {
+            "user": getattr(sender, "aad_object_id", None) or getattr(sender, "id", None),
+            "conversation": getattr(conversation, "id", None),
+            "tenant": tenant,
+        }
+
+    def check(self, activity):
+        """Admit the activity or explain why not; takes a token from each of its buckets when admitted"""
+        if not self.limits or getattr(activity, "type", None) not in LIMITED_TYPES:
+            return ADMITTED
+        RATE_LIMIT_CHECKED.inc()
+        ids = self.keys_for(activity)
+        scopes = [scope for scope in SCOPES if scope in self.limits and ids[scope]]
+        buckets = [(f"{scope}:{ids[scope]}",) + self.limits[scope] for scope in scopes]
+        if not buckets:
+            return ADMITTED
+        try:
+            wait, limiting = self.backend.acquire(buckets)
+        except Exception as e:
+            logger.warning("Rate limit backend error, letting activity through: %s", e)
+            return ADMITTED
+        if limiting is None:
+            return ADMITTED
+
+        scope = scopes[limiting]
+        notify = self.action == REPLY and self._may_notify(ids["conversation"])
+        RATE_LIMITED.inc(scope=scope, action=REPLY if notify else DROP)
+        return RateDecision(False, scope, wait, notify)
+
+    async def check_async(self, activity):
+        """check() for coroutines; a blocking backend runs in the loop's executor"""
+        if not getattr(self.backend, "blocking", False):
+            return self.check(activity)
+        return await asyncio.get_running_loop().run_in_executor(None, self.check, activity)
+
+    def _may_notify(self, conversation_id):
+        # The notice has a bucket of its own, so a flood gets one reply, not one per message
+        if not conversation_id:
+            return False
+        try:
+            _, limiting = self.backend.acquire([(f"notice:{conversation_id}", 1.0 / self.notice_interval, 1)])
+        except Exception:
+            return False
+        return limiting is None
+
+
+def notice_text(decision):
+    """Canned reply for an over-limit turn"""
+    seconds = max(1, int(decision.retry_after + 0.999))
+    return f"⏳ You're sending messages faster than I can keep up. Please try again in {seconds} s."
+
+
+def notice_logic(decision):
+    """Adapter callback that sends only the canned reply, without running the bot"""
+
+    async def aux_func(turn_context):
+        await turn_context.send_activity(notice_text(decision))
+
+    return aux_func
+
+
+def create_rate_limiter(backend="memory", limits=None, action=REPLY, notice_interval=30.0, path=None,
+                        max_entries=100000):
+    """Build a rate limiter from configuration values"""
+    if backend == "sqlite":
+        store = SqliteBucketBackend(path or "/tmp/bot_ratelimit.sqlite3")
+    elif backend == "memory":
+        store = MemoryBucketBackend(max_entries=max_entries)
+    else:
+        raise ValueError(f"Unknown rate limit backend: {backend}")
+    return RateLimiter(store, limits or {}, action=action, notice_interval=notice_interval)
@@ -0,0 +1,576 @@
+"""
+Scheduled reminders delivered as proactive messages
+
+`remind me in 10m stretch`, `remind me at 14:30 call Sam`, `remind us every
+weekday at 9:15 standup` and `remind me every 2h drink water` store a
+reminder with the conversation reference of the message that created it.
+Times of day are in the user's time zone, taken from the activity.
+
+Pending reminders live in a SQLite file shared by every worker, indexed by
+due time. Each worker runs a ReminderScheduler, but only the one holding
+the scheduler lease does any work; the others check the lease every few
+seconds and take over once it expires. The leader keeps a heap of the
+reminders due within the next `horizon` seconds, reloaded from the due-time
+index every `refresh` seconds, and sleeps until the earliest of them, so
+neither the number of pending reminders nor the number of workers adds
+timers or storage scans.
+
+Before sending, the leader claims each due reminder with a lease of its
+own, so a reminder is sent by one worker even if leadership moves mid-way.
+A worker that dies after sending but before recording it lets the lease
+expire, and the reminder is sent again: delivery is at least once.
+Reminders due together are sent in one proactive turn per conversation
+(see ProactiveSender), where the outbound pipeline merges them into one
+message.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from botbuilder.core import MessageFactory, TurnContext
+from metrics import REGISTRY
+from outbound import continue_conversation
+from sqlite_db import ConnectionCache, transaction
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_SENT = REGISTRY.counter("bot_reminders_total", "Reminders by outcome (sent, retried, dropped)")
+REMINDER_LAG = REGISTRY.histogram("bot_reminder_lag_seconds", "Delay between a reminder's due time and its delivery")
+
+SCHEDULER_LEASE = "reminders"
+MIN_INTERVAL = 60
+MAX_DELAY = 366 * 24 * 3600
+MAX_TEXT_CHARS = 500
+MAX_PER_USER = 100
+MAX_ATTEMPTS = 5
+ID_ATTEMPTS = 5
+SAVE_FAILED = "Sorry, I couldn't save that reminder; please try again."
+READ_FAILED = "Sorry, I couldn't reach your reminders; please try again."
+
+_UNITS = {
+    "s": 1, "sec": 1, "secs": 1, "second": 1, "seconds": 1,
+    "m": 60, "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+    "h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "day": 86400, "days": 86400,
+    "w": 604800, "week": 604800, "weeks": 604800,
+}
+_DURATION = re.compile(r"(?:\d+\s*(?:" + "|".join(sorted(_UNITS, key=len, reverse=True)) + r")\b\s*(?:and\s+)?)+")
+_DURATION_PART = re.compile(r"(\d+)\s*([a-z]+)")
+_TIME_OF_DAY = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?"
+_COMMANDS = [
+    ("in", re.compile(rf"^in\s+(?P<duration>{_DURATION.pattern})(?:to\s+)?(?P<text>.+)$", re.I | re.S)),
+    ("at", re.compile(rf"^at\s+{_TIME_OF_DAY}\s+(?:to\s+)?(?P<text>.+)$", re.I | re.S)),
+    ("daily", re.compile(rf"^every\s+(?P<days>day|weekday)\s+at\s+{_TIME_OF_DAY}\s+(?:to\s+)?(?P<text>.+)$",
+                         re.I | re.S)),
+    ("every", re.compile(rf"^every\s+(?P<duration>{_DURATION.pattern})(?:to\s+)?(?P<text>.+)$", re.I | re.S)),
+]
+
+
+class ReminderError(ValueError):
+    """Raised for reminder commands that cannot be carried out"""
+
+
+@dataclass(frozen=True)
+class Reminder:
+    """A pending reminder and the conversation it is delivered to"""
+
+    id: str
+    user_id: str
+    conversation_id: str
+    text: str
+    due_at: float
+    recurrence: str = ""
+    reference: dict = None
+    attempts: int = 0
+
+
+def parse_duration(text):
+    """Seconds in `10m`, `1h 30m` or `2 hours and 5 minutes`"""
+    seconds = sum(int(amount) * _UNITS[unit] for amount, unit in _DURATION_PART.findall(text.lower()))
+    if not seconds:
+        raise ReminderError(f"Not a duration: {text}")
+    return seconds
+
+
+def _zone(name):
+    """tzinfo for a zone name or a `+600`-style UTC offset in minutes"""
+    if not name:
+        return timezone.utc
+    if re.fullmatch(r"[+-]\d+", name):
+        return timezone(timedelta(minutes=int(name)))
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+def activity_zone(activity):
+    """The sender's time zone name (or UTC offset) from an activity, empty for UTC"""
+    name = getattr(activity, "local_timezone", None)
+    if name and _zone(name) is not timezone.utc:
+        return name
+    stamp = getattr(activity, "local_timestamp", None)
+    offset = stamp.utcoffset() if isinstance(stamp, datetime) else None
+    if offset:
+        return f"{int(offset.total_seconds() // 60):+d}"
+    return ""
+
+
+def _minute_of_day(hour, minute, meridiem):
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            raise ReminderError("Use a time such as 9:30, 17:00 or 5pm")
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+    if hour > 23 or minute > 59:
+        raise ReminderError("Use a time such as 9:30, 17:00 or 5pm")
+    return hour * 60 + minute
+
+
+def next_due(recurrence, after):
+    """The first time after `after` that a recurrence fires
+
+    Recurrences are `every <seconds>`, `daily <HH:MM> <zone>` and
+    `weekdays <HH:MM> <zone>`.
+    """
+    kind, _, rest = recurrence.partition(" ")
+    if kind == "every":
+        return after + int(rest)
+    clock, _, zone = rest.partition(" ")
+    hour, minute = map(int, clock.split(":"))
+    local = datetime.fromtimestamp(after, _zone(zone))
+    candidate = local.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    while candidate.timestamp() <= after or (kind == "weekdays" and candidate.weekday() >= 5):
+        # Adding days to the wall-clock time keeps 9:15 at 9:15 across DST changes
+        candidate = (candidate.replace(tzinfo=None) + timedelta(days=1)).replace(tzinfo=candidate.tzinfo)
+    return candidate.timestamp()
+
+
+def parse_reminder(text, now, zone=""):
+    """(due_at, recurrence, text) for the words after `remind me`"""
+    text = re.sub(r"^(?:me|us)\s+", "", (text or "").strip(), flags=re.I)
+    for kind, pattern in _COMMANDS:
+        match = pattern.match(text)
+        if match:
+            break
+    else:
+        raise ReminderError(
+            "Usage: remind me in 10m <text>, remind me at 14:30 <text>, "
+            "remind me every 2h <text> or remind me every weekday at 9:15 <text>"
+        )
+    message = match.group("text").strip()
+    if len(message) > MAX_TEXT_CHARS:
+        raise ReminderError(f"Reminders are limited to {MAX_TEXT_CHARS} characters")
+    if kind in ("in", "every"):
+        seconds = parse_duration(match.group("duration"))
+        if seconds > MAX_DELAY:
+            raise ReminderError("Reminders can be at most a year ahead")
+        if kind == "in":
+            return now + seconds, "", message
+        if seconds < MIN_INTERVAL:
+            raise ReminderError(f"Repeating reminders need at least {MIN_INTERVAL} seconds between them")
+        recurrence = f"every {seconds}"
+        return next_due(recurrence, now), recurrence, message
+    minutes = _minute_of_day(*match.group(2, 3, 4)) if kind == "daily" else _minute_of_day(*match.group(1, 2, 3))
+    clock = f"{minutes // 60:02d}:{minutes % 60:02d}"
+    if kind == "at":
+        return next_due(f"daily {clock} {zone}".rstrip(), now), "", message
+    recurrence = f"{'weekdays' if match.group('days').lower() == 'weekday' else 'daily'} {clock} {zone}".rstrip()
+    return next_due(recurrence, now), recurrence, message
+
+
+class SqliteReminderStore:
+    """Reminders indexed by due time, with per-reminder claims and the scheduler lease"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS reminders ("
+        " reminder_id TEXT PRIMARY KEY,"
+        " user_id TEXT NOT NULL,"
+        " conversation_id TEXT NOT NULL,"
+        " text TEXT NOT NULL,"
+        " due_at REAL NOT NULL,"
+        " recurrence TEXT NOT NULL DEFAULT '',"
+        " reference TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " claimed_by TEXT,"
+        " claimed_until REAL NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS reminders_due ON reminders (due_at)",
+        "CREATE INDEX IF NOT EXISTS reminders_user ON reminders (user_id, due_at)",
+        "CREATE TABLE IF NOT EXISTS scheduler_leases ("
+        " name TEXT PRIMARY KEY,"
+        " owner TEXT NOT NULL,"
+        " expires_at REAL NOT NULL)",
+    )
+    COLUMNS = "reminder_id, user_id, conversation_id, text, due_at, recurrence, reference, attempts"
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = ConnectionCache(path)
+        conn = self._connections.get()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    @staticmethod
+    def _reminder(row):
+        return Reminder(row[0], row[1], row[2], row[3], row[4], row[5], json.loads(row[6]) if row[6] else None, row[7])
+
+    def add(self, reminder, max_per_user=MAX_PER_USER):
+        conn = self._connections.get()
+        with transaction(conn):
+            (pending,) = conn.execute(
+                "SELECT COUNT(*) FROM reminders WHERE user_id = ?", (reminder.user_id,)
+            ).fetchone()
+            if pending >= max_per_user:
+                raise ReminderError(f"You can have at most {max_per_user} reminders; cancel some first")
+            conn.execute(
+                f"INSERT INTO reminders ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (reminder.id, reminder.user_id, reminder.conversation_id, reminder.text, reminder.due_at,
+                 reminder.recurrence, json.dumps(reminder.reference) if reminder.reference else None,
+                 reminder.attempts),
+            )
+
+    def list(self, user_id):
+        rows = self._connections.get().execute(
+            f"SELECT {self.COLUMNS} FROM reminders WHERE user_id = ? ORDER BY due_at, rowid", (user_id,)
+        ).fetchall()
+        return [self._reminder(row) for row in rows]
+
+    def cancel(self, reminder_id, user_id):
+        cursor = self._connections.get().execute(
+            "DELETE FROM reminders WHERE reminder_id = ? AND user_id = ?", (reminder_id, user_id)
+        )
+        return cursor.rowcount == 1
+
+    def due_before(self, until, limit):
+        """[(due_at, reminder_id)] due by `until`, earliest first"""
+        return self._connections.get().execute(
+            "SELECT due_at, reminder_id FROM reminders WHERE due_at <= ? ORDER BY due_at LIMIT ?", (until, limit)
+        ).fetchall()
+
+    def claim(self, reminder_ids, owner, now, lease):
+        """Claim the due, unclaimed reminders among `reminder_ids` for `lease` seconds"""
+        if not reminder_ids:
+            return []
+        conn = self._connections.get()
+        marks = ", ".join("?" * len(reminder_ids))
+        with transaction(conn):
+            conn.execute(
+                f"UPDATE reminders SET claimed_by = ?, claimed_until = ? "
+                f"WHERE reminder_id IN ({marks}) AND due_at <= ? AND claimed_until <= ?",
+                (owner, now + lease, *reminder_ids, now, now),
+            )
+            rows = conn.execute(
+                f"SELECT {self.COLUMNS} FROM reminders "
+                f"WHERE reminder_id IN ({marks}) AND claimed_by = ? AND claimed_until = ? ORDER BY due_at, rowid",
+                (*reminder_ids, owner, now + lease),
+            ).fetchall()
+        return [self._reminder(row) for row in rows]
+
+    def finish(self, reminder, owner, due_at=None, attempts=0):
+        """Delete a claimed reminder, or move it to `due_at` and release the claim"""
+        conn = self._connections.get()
+        if due_at is None:
+            conn.execute(
+                "DELETE FROM reminders WHERE reminder_id = ? AND claimed_by = ?", (reminder.id, owner)
+            )
+            return
+        conn.execute(
+            "UPDATE reminders SET due_at = ?, attempts = ?, claimed_by = NULL, claimed_until = 0 "
+            "WHERE reminder_id = ? AND claimed_by = ?",
+            (due_at, attempts, reminder.id, owner),
+        )
+
+    def acquire_lease(self, name, owner, now, ttl):
+        """Take or renew the lease `name`; True while `owner` holds it"""
+        conn = self._connections.get()
+        conn.execute(
+            "INSERT INTO scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at <= ?",
+            (name, owner, now + ttl, now),
+        )
+        row = conn.execute("SELECT owner FROM scheduler_leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name, owner):
+        self._connections.get().execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+def format_reminder(reminder):
+    return f"⏰ **Reminder:** {reminder.text}"
+
+
+class ProactiveSender:
+    """Delivers reminders through the adapter, one proactive turn per conversation"""
+
+    def __init__(self, adapter, app_id="", concurrency=8):
+        self.adapter = adapter
+        self.app_id = app_id
+        self.concurrency = concurrency
+
+    async def __call__(self, reminders):
+        """Send `reminders`; returns {reminder_id: exception} for those that failed"""
+        conversations = defaultdict(list)
+        for reminder in reminders:
+            conversations[reminder.conversation_id].append(reminder)
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(group):
+            async def send(turn_context):
+                await turn_context.send_activities([MessageFactory.text(format_reminder(r)) for r in group])
+
+            async with limit:
+                await continue_conversation(self.adapter, group[0].reference, send, self.app_id)
+
+        groups = list(conversations.values())
+        results = await asyncio.gather(*(deliver(group) for group in groups), return_exceptions=True)
+        return {
+            reminder.id: result
+            for group, result in zip(groups, results) if isinstance(result, Exception)
+            for reminder in group
+        }
+
+
+class ReminderScheduler:
+    """Fires due reminders while this worker holds the scheduler lease"""
+
+    def __init__(
+        self, store, send, clock=time.time, owner=None, lease=30.0, horizon=300.0, refresh=5.0,
+        batch_size=100, retry_delay=60.0,
+    ):
+        self.store = store
+        self.send = send
+        self.clock = clock
+        self.owner = owner or f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease = lease
+        self.horizon = horizon
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.leader = False
+        # Only the scheduler thread touches the heap; add() hands new reminders over through _added
+        self._heap = []
+        self._queued = set()
+        self._added = deque()
+        self._loaded_until = 0.0
+        self._next_refresh = 0.0
+        self._lease_until = 0.0
+        self._wake = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def add(self, user_id, conversation_id, text, due_at, recurrence="", reference=None):
+        """Store a reminder and, if this worker leads and it is due soon, wake the scheduler to index it"""
+        # Ids stay short enough to type after `remind cancel`, so a collision draws a new one
+        for _ in range(ID_ATTEMPTS):
+            reminder = Reminder(uuid.uuid4().hex[:8], user_id, conversation_id, text, due_at, recurrence, reference)
+            try:
+                self.store.add(reminder)
+            except sqlite3.IntegrityError:
+                continue
+            except sqlite3.Error:
+                logger.exception("Could not store reminder")
+                raise ReminderError(SAVE_FAILED) from None
+            break
+        else:
+            logger.error("No free reminder id after %d attempts", ID_ATTEMPTS)
+            raise ReminderError(SAVE_FAILED)
+        if self.leader and due_at <= self._loaded_until:
+            self._added.append((due_at, reminder.id))
+        if self._wake is not None:
+            self._wake()
+        return reminder
+
+    def list(self, user_id):
+        """A user's reminders, soonest first"""
+        try:
+            return self.store.list(user_id)
+        except sqlite3.Error:
+            logger.exception("Could not list reminders")
+            raise ReminderError(READ_FAILED) from None
+
+    def cancel(self, reminder_id, user_id):
+        """Delete one of the user's reminders; False if they have none with that id"""
+        try:
+            return self.store.cancel(reminder_id, user_id)
+        except sqlite3.Error:
+            logger.exception("Could not cancel reminder")
+            raise ReminderError(READ_FAILED) from None
+
+    def _push(self, due_at, reminder_id):
+        if reminder_id not in self._queued:
+            self._queued.add(reminder_id)
+            heapq.heappush(self._heap, (due_at, reminder_id))
+
+    def _load(self, now):
+        """Index the reminders due within the horizon"""
+        until = now + self.horizon
+        page = max(self.batch_size * 10, 1000)
+        rows = self.store.due_before(until, page)
+        for due_at, reminder_id in rows:
+            self._push(due_at, reminder_id)
+        # A full page may leave later reminders out; count as loaded only up to the last one seen
+        self._loaded_until = rows[-1][0] if len(rows) >= page else until
+        self._next_refresh = now + self.refresh
+
+    def _lead(self, now):
+        if now < self._lease_until - self.lease / 2:
+            return True
+        if self.store.acquire_lease(SCHEDULER_LEASE, self.owner, now, self.lease):
+            if not self.leader:
+                logger.info("Reminder scheduler %s took the lease", self.owner)
+                self._next_refresh = now
+            self.leader = True
+            self._lease_until = now + self.lease
+            return True
+        self.leader = False
+        self._heap.clear()
+        self._queued.clear()
+        self._added.clear()
+        self._loaded_until = 0.0
+        return False
+
+    async def tick(self):
+        """Fire every reminder that is due; returns how many were sent"""
+        now = self.clock()
+        if not self._lead(now):
+            return 0
+        while self._added:
+            self._push(*self._added.popleft())
+        if now >= self._next_refresh:
+            self._load(now)
+        sent = 0
+        while self._heap and self._heap[0][0] <= now:
+            ids = []
+            while self._heap and self._heap[0][0] <= now and len(ids) < self.batch_size:
+                _, reminder_id = heapq.heappop(self._heap)
+                self._queued.discard(reminder_id)
+                ids.append(reminder_id)
+            # Cancelled, rescheduled or claimed elsewhere since it was indexed: skipped here
+            batch = self.store.claim(ids, self.owner, now, self.lease)
+            failures = await self.send(batch) if batch else {}
+            sent += self._record(batch, failures, now)
+        return sent
+
+    def _record(self, batch, failures, now):
+        """Delete or reschedule each reminder of a sent batch; returns how many were delivered"""
+        sent = 0
+        for reminder in batch:
+            attempts = 0
+            if reminder.id not in failures:
+                sent += 1
+                REMINDERS_SENT.inc(outcome="sent")
+                REMINDER_LAG.observe(max(0.0, now - reminder.due_at))
+                due_at = next_due(reminder.recurrence, now) if reminder.recurrence else None
+            elif reminder.attempts + 1 < MAX_ATTEMPTS:
+                REMINDERS_SENT.inc(outcome="retried")
+                logger.warning("Reminder %s not delivered, retrying: %s", reminder.id, failures[reminder.id])
+                due_at, attempts = now + self.retry_delay, reminder.attempts + 1
+            else:
+                REMINDERS_SENT.inc(outcome="dropped")
+                logger.error("Reminder %s dropped after %d attempts", reminder.id, MAX_ATTEMPTS)
+                due_at = next_due(reminder.recurrence, now) if reminder.recurrence else None
+            self.store.finish(reminder, self.owner, due_at, attempts)
+            if due_at is not None and due_at <= self._loaded_until:
+                self._push(due_at, reminder.id)
+        return sent
+
+    def next_wakeup(self):
+        """When tick() next has something to do"""
+        wakeup = self._next_refresh if self.leader else self.clock() + self.lease / 2
+        if self._heap:
+            wakeup = min(wakeup, self._heap[0][0])
+        return wakeup
+
+    def start(self):
+        """Start the scheduler thread in this process unless it is running"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return self
+
+        async def run():
+            wake = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._wake = lambda: loop.call_soon_threadsafe(wake.set)
+            while not self._stop.is_set():
+                try:
+                    await self.tick()
+                except Exception as e:
+                    logger.error("Reminder scheduler failed: %s", e, exc_info=True)
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), max(0.01, self.next_wakeup() - self.clock()))
+                except asyncio.TimeoutError:
+                    pass
+            self._wake = None
+
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=asyncio.run, args=(run(),), name="reminders", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread and hand the lease to another worker at once"""
+        self._stop.set()
+        if self._wake is not None:
+            self._wake()
+        if self.leader:
+            self.store.release_lease(SCHEDULER_LEASE, self.owner)
+            self.leader = False
+
+
+def _describe_recurrence(recurrence):
+    kind, _, rest = recurrence.partition(" ")
+    if kind == "every":
+        seconds = int(rest)
+        for unit, size in (("w", 604800), ("d", 86400), ("h", 3600), ("m", 60)):
+            if seconds % size == 0:
+                return f"every {seconds // size}{unit}"
+        return f"every {seconds}s"
+    clock = rest.split(" ")[0]
+    return f"{'every weekday' if kind == 'weekdays' else 'every day'} at {clock}"
+
+
+def describe(reminder, zone=""):
+    """One line for a reminder: id, next time in the user's zone, repetition and text"""
+    when = datetime.fromtimestamp(reminder.due_at, _zone(zone)).strftime("%a %d %b %H:%M")
+    repeat = f" ({_describe_recurrence(reminder.recurrence)})" if reminder.recurrence else ""
+    return f"`{reminder.id}` {when}{repeat}: {reminder.text}"
+
+
+async def handle_remind(turn_context, scheduler, args):
+    """Handle `remind me ...`, `remind list` and `remind cancel <id>`"""
+    activity = turn_context.activity
+    user_id = activity.from_property.id
+    zone = activity_zone(activity)
+    words = (args or "").split()
+    try:
+        if words[:1] == ["list"]:
+            reminders = scheduler.list(user_id)
+            if not reminders:
+                return await turn_context.send_activity("You have no reminders.")
+            lines = ["⏰ **Your reminders**", ""] + [describe(reminder, zone) for reminder in reminders]
+            return await turn_context.send_activity("\n".join(lines))
+        if words[:1] == ["cancel"] and len(words) == 2:
+            if scheduler.cancel(words[1], user_id):
+                return await turn_context.send_activity(f"Cancelled reminder `{words[1]}`.")
+            return await turn_context.send_activity(f"You have no reminder `{words[1]}`.")
+        due_at, recurrence, text = parse_reminder(args, scheduler.clock(), zone)
+        reminder = scheduler.add(
+            user_id, activity.conversation.id, text, due_at, recurrence,
+            TurnContext.get_conversation_reference(activity).serialize(),
+        )
+    except ReminderError as e:
+        return await turn_context.send_activity(str(e))
+    return await turn_context.send_activity(f"Okay, I'll remind you: {describe(reminder, zone)}")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the calculator engine
+
+Compares, on a corpus of typical channel inputs (standup maths, estimates,
+copy-pasted formulas, repeated many times as in a busy channel):
+
+  baseline - parse and evaluate every message from scratch
+             (ast.parse + compile + eval with a restricted namespace)
+  engine   - calculator.evaluate(): whitelisted AST compiled to closures,
+             cached in an LRU keyed on the normalized expression
+
+and, for list aggregates over a 10,000-number range, the statistics module
+on a Python range against the engine's array-backed vectors.
+
+Usage: python scripts/bench_calculator.py [--rounds 200]
+"""
+
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import calculator  # noqa: E402
+
+CORPUS = [
+    "5 + 3",
+    "2 + 3 * 4",
+    "2^3 + sqrt(16)",
+    "sqrt(16)",
+    "sin(45 * pi / 180)",
+    "log(100)",
+    "(8 + 5 + 3 + 13) / 4",
+    "40 * 0.8 * 2",
+    "1200 / 12",
+    "round(37.5 * 1.15)",
+    "(3 + 5 + 8 + 13 + 21) / 5",
+    "2^10",
+    "100 * 1.07^5",
+    "abs(-42) + floor(3.7)",
+    "8 * 5 * 0.75",
+]
+
+LIST_CORPUS = [
+    ("sum(1..10000)", lambda: sum(range(1, 10001))),
+    ("mean(1..10000)", lambda: statistics.mean(range(1, 10001))),
+    ("stdev(1..10000)", lambda: statistics.stdev(range(1, 10001))),
+    ("p95(1..10000)", lambda: statistics.quantiles(range(1, 10001), n=100, method="inclusive")[94]),
+]
+
+_BASELINE_NAMESPACE = {"__builtins__": {}, **calculator.FUNCTIONS, **calculator.CONSTANTS}
+
+
+def baseline_evaluate(text):
+    expression = text.replace("^", "**")
+    return eval(compile(expression, "<calc>", "eval"), _BASELINE_NAMESPACE)
+
+
+def run(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for expression in CORPUS:
+            func(expression)
+    elapsed = time.perf_counter() - start
+    return rounds * len(CORPUS) / elapsed
+
+
+def per_call(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    for expression in CORPUS:
+        assert math.isclose(baseline_evaluate(expression), calculator.evaluate(expression))
+
+    baseline = run(baseline_evaluate, args.rounds)
+    engine = run(calculator.evaluate, args.rounds)
+
+    print(f"baseline: {baseline:10.0f} evals/s")
+    print(f"engine:   {engine:10.0f} evals/s  ({engine / baseline:.1f}x)")
+    print(f"cache:    {calculator.cache_info()}")
+
+    print(f"{'list expression':<18} {'statistics us':>14} {'engine us':>10}")
+    for expression, baseline_func in LIST_CORPUS:
+        assert math.isclose(baseline_func(), calculator.evaluate(expression))
+        baseline_us = per_call(baseline_func, max(1, args.rounds // 10))
+        engine_us = per_call(lambda: calculator.evaluate(expression), max(1, args.rounds // 10))
+        print(f"{expression:<18} {baseline_us:>14.0f} {engine_us:>10.0f}")
+
+    start = time.perf_counter()
+    try:
+        calculator.evaluate("9^9^9")
+    except calculator.CalculatorError as e:
+        print(f"9^9^9 rejected in {(time.perf_counter() - start) * 1e6:.0f}us: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for /api/messages ingestion
+
+For each Teams payload in scripts/payloads, compares the time from raw body
+to something the endpoint can route on:
+
+  baseline - json.loads + Activity().deserialize(), the old path
+  routed   - fast_ingest.parse_activity() and the fields read before the
+             turn (type, id, text, from, conversation, channelId, serviceUrl):
+             what a redelivery or a dropped turn costs now
+  full     - parse_activity() plus materialize(), for a turn that reaches
+             the adapter
+
+Usage: python scripts/bench_ingest.py [--rounds 2000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botbuilder.schema import Activity  # noqa: E402
+import fast_ingest  # noqa: E402
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def baseline(data):
+    activity = Activity().deserialize(json.loads(data))
+    return activity.type, activity.conversation.id
+
+
+def routed(data):
+    activity = fast_ingest.parse_activity(data)
+    return (activity.type, activity.id, activity.text, activity.from_property.id, activity.conversation.id,
+            activity.channel_id, activity.service_url)
+
+
+def full(data):
+    return fast_ingest.materialize(fast_ingest.parse_activity(data))
+
+
+def per_call(func, data, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(data)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"decoder: {fast_ingest.JSON_DECODER}")
+    print(f"{'payload':<22} {'bytes':>6} {'baseline us':>12} {'routed us':>10} {'full us':>8}")
+    for name in sorted(os.listdir(PAYLOADS)):
+        with open(os.path.join(PAYLOADS, name), "rb") as f:
+            data = f.read()
+        assert full(data).serialize() == Activity().deserialize(json.loads(data)).serialize()
+        baseline_us = per_call(baseline, data, args.rounds)
+        routed_us = per_call(routed, data, args.rounds)
+        full_us = per_call(full, data, args.rounds)
+        print(f"{name:<22} {len(data):>6} {baseline_us:>12.1f} {routed_us:>10.1f} {full_us:>8.1f}"
+              f"  ({baseline_us / routed_us:.0f}x routed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark the logging cost of the /api/messages request path
+
+Serves a Flask endpoint that does the same logging work as messages()
+under two configurations and reports requests per second for each:
+
+  legacy - root logger at DEBUG, synchronous StreamHandler + FileHandler,
+           ~15 eager f-string info lines per request (the old app.py)
+  queue  - logging_setup.configure_logging() at INFO with lazy %-style
+           debug trace lines, JSON output written by a listener thread
+
+Usage: python scripts/bench_logging.py [--requests 5000] [--threads 8]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request, Response  # noqa: E402
+from logging_setup import configure_logging, new_correlation_id, shutdown_logging  # noqa: E402
+
+SAMPLE_BODY = {
+    "type": "message",
+    "id": "1234567890",
+    "channelId": "msteams",
+    "serviceUrl": "https://smba.trafficmanager.net/amer/",
+    "from": {"id": "29:user", "name": "Test User"},
+    "conversation": {"id": "a:conversation"},
+    "recipient": {"id": "28:bot", "name": "Bot"},
+    "text": "calc 2 + 3 * 4",
+    "channelData": {"tenant": {"id": "tenant-id"}},
+}
+
+
+def legacy_app(log_file):
+    for handler in list(logging.getLogger().handlers):
+        logging.getLogger().removeHandler(handler)
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(open(os.devnull, "w")), logging.FileHandler(log_file, mode='a')],
+        force=True
+    )
+    logger = logging.getLogger("bench.legacy")
+    app = Flask(__name__)
+
+    @app.route("/api/messages", methods=["POST"])
+    def messages():
+        logger.info("=== MESSAGE ENDPOINT START ===")
+        logger.info(f"Received request: {request.method} {request.url}")
+        logger.info(f"Content-Type: {request.headers.get('Content-Type', 'Not set')}")
+        logger.info(f"Authorization: {request.headers.get('Authorization', 'Not set')[:50]}...")
+        body = request.json
+        logger.info(f"Request body type: {type(body)}")
+        logger.info(f"Request body keys: {list(body.keys()) if isinstance(body, dict) else 'Not a dict'}")
+        logger.info("Testing botbuilder imports...")
+        logger.info("Activity import OK")
+        logger.info("Creating Activity object...")
+        logger.info(f"Activity created: type={body['type']}")
+        logger.info(f"Processing activity: {body['type']}")
+        logger.info("Creating event loop...")
+        logger.info("Processing activity with adapter...")
+        logger.info("Activity processed successfully")
+        logger.info("Message processed successfully")
+        logger.info("=== MESSAGE ENDPOINT END ===")
+        return Response(status=202)
+
+    return app
+
+
+def queue_app(log_file):
+    configure_logging(level="INFO", log_file=log_file, log_format="json")
+    logger = logging.getLogger("bench.queue")
+    app = Flask(__name__)
+
+    @app.route("/api/messages", methods=["POST"])
+    def messages():
+        new_correlation_id(request.headers.get("X-Correlation-ID"))
+        logger.debug("Received request: %s %s", request.method, request.path)
+        body = request.json
+        logger.debug("Processing activity: type=%s id=%s", body["type"], body["id"])
+        logger.debug("Activity %s processed", body["id"])
+        return Response(status=202)
+
+    return app
+
+
+def run(app, total, threads):
+    client = app.test_client()
+    headers = {"Authorization": "Bearer " + "x" * 800}
+
+    def one(_):
+        client.post("/api/messages", json=SAMPLE_BODY, headers=headers)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(total)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Silence stderr output from both pipelines; file output is what we measure
+        stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+        try:
+            legacy_rps = run(legacy_app(os.path.join(tmp, "legacy.log")), args.requests, args.threads)
+            queue_rps = run(queue_app(os.path.join(tmp, "queue.log")), args.requests, args.threads)
+            shutdown_logging()
+        finally:
+            sys.stderr = stderr
+
+    print(f"legacy logging: {legacy_rps:8.0f} req/s")
+    print(f"queue logging:  {queue_rps:8.0f} req/s  ({queue_rps / legacy_rps:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
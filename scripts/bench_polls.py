@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Load test for poll voting across worker processes
+
+Forks `--workers` processes that share one poll file, as gunicorn workers
+do, and has each cast `--votes` votes on the same poll as fast as it can:
+
+  direct  - every vote is its own transaction (batch size 1)
+  batched - votes are queued and written in batches to the worker's shard,
+            as PollEngine does by default
+
+Meanwhile this process runs a PollAggregator every `--interval` seconds
+with an updater that only counts card updates. Each mode checks that no
+vote was lost and reports votes per second and how many times the card was
+updated (once per interval with changes, not once per vote).
+
+Usage: python scripts/bench_polls.py [--workers 4] [--votes 20000] [--interval 0.5]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polls import PollAggregator, PollEngine, SqlitePollStore  # noqa: E402
+
+OPTIONS = ["Pizza", "Sushi", "Tacos", "Salad"]
+MODES = {"direct": 1, "batched": 500}
+
+
+class CountingUpdater:
+    def __init__(self):
+        self.updates = 0
+
+    async def __call__(self, poll, counts):
+        self.updates += 1
+
+
+def vote(path, poll_id, worker, votes, batch_size):
+    engine = PollEngine(SqlitePollStore(path), batch_size=batch_size, flush_interval=0.05)
+    for n in range(votes):
+        engine.vote(poll_id, f"w{worker}-u{n}", n % len(OPTIONS))
+    engine.flush()
+
+
+async def run(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "polls.sqlite3")
+        engine = PollEngine(SqlitePollStore(path))
+        poll = engine.create("bench", "Lunch?", OPTIONS, "bench")
+        engine.store.set_message(poll.id, "card", {})
+        updater = CountingUpdater()
+        aggregator = PollAggregator(engine, updater)
+
+        start = time.perf_counter()
+        pids = []
+        for worker in range(args.workers):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    vote(path, poll.id, worker, args.votes, MODES[mode])
+                except BaseException:
+                    code = 1
+                os._exit(code)
+            pids.append(pid)
+        running = set(pids)
+        next_pass = start + args.interval
+        while running:
+            await asyncio.sleep(0.005)
+            if time.perf_counter() >= next_pass:
+                await aggregator.aggregate()
+                next_pass += args.interval
+            for pid in list(running):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    running.discard(pid)
+                    if os.waitstatus_to_exitcode(status) != 0:
+                        sys.exit(f"{mode}: worker {pid} failed")
+        elapsed = time.perf_counter() - start
+        await aggregator.aggregate()
+
+        total = sum(engine.store.counts(poll.id, len(OPTIONS)))
+        expected = args.workers * args.votes
+        if total != expected:
+            sys.exit(f"{mode}: lost votes, counted {total} of {expected}")
+        print(f"{mode:<8} {expected / elapsed:>10.0f} votes/s {updater.updates:>6} card updates  ({elapsed:.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--votes", type=int, default=20000, help="votes per worker")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between card updates")
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x {args.votes} votes")
+    for mode in MODES:
+        asyncio.run(run(mode, args))
+
+
+if __name__ == "__main__":
+    main()
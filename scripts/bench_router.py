@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for command dispatch
+
+Compares, for a growing number of registered commands:
+
+  chain  - the old on_message_activity style: lower() the text and try each
+           command with startswith() in turn, then the math check
+  router - command_router.CommandRouter.resolve(): one dict lookup on the
+           first token
+
+Each run resolves a message for the last registered command (worst case for
+the chain) and a plain-text message that falls through to the welcome
+default. The router's cost should stay flat as the command count grows.
+
+Usage: python scripts/bench_router.py [--iterations 100000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calculator import is_math_expression  # noqa: E402
+from command_router import CommandRouter  # noqa: E402
+
+SIZES = [15, 50, 200, 1000]
+
+
+def handler(turn_context, args):
+    return None
+
+
+def build(size):
+    names = [f"cmd{i}" for i in range(size)]
+    router = CommandRouter()
+    for name in names:
+        router.command(name)(handler)
+    router.fallback(is_math_expression)(handler)
+    router.default(handler)
+
+    def chain(text):
+        lowered = text.lower().strip()
+        for name in names:
+            if lowered.startswith(name + " ") or lowered == name:
+                return name
+        if is_math_expression(lowered):
+            return "math"
+        return "default"
+
+    return names, router, chain
+
+
+def per_call(func, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(text)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'commands':>8}  {'message':<10} {'chain ns':>10} {'router ns':>10}")
+    for size in SIZES:
+        names, router, chain = build(size)
+        for label, text in [("last", f"{names[-1]} some args"), ("welcome", "hello there bot")]:
+            chain_ns = per_call(chain, text, args.iterations)
+            router_ns = per_call(router.resolve, text, args.iterations)
+            print(f"{size:>8}  {label:<10} {chain_ns:>10.0f} {router_ns:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark worker boot: cold start versus forking from a warm master
+
+Reports, over several runs, the time from starting a worker until it has
+answered its first health check (`GET /api/health`):
+
+  cold - a fresh interpreter imports the app and answers the request, as a
+         gunicorn worker does without --preload (and each time a recycled
+         worker is replaced)
+  warm - the app is imported once here, bot_runtime.preload() runs, and
+         each run forks a child that answers the request, as workers do
+         with preload_app
+
+Usage: python scripts/bench_startup.py [--runs 10] [--module app]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIRST_REQUEST = {
+    "app": "import app; assert app.app.test_client().get('/api/health').status_code == 200",
+    "aio_app": (
+        "import asyncio, aio_app\n"
+        "from aiohttp.test_utils import TestClient, TestServer\n"
+        "async def main():\n"
+        "    async with TestClient(TestServer(aio_app.create_app())) as client:\n"
+        "        assert (await client.get('/api/health')).status == 200\n"
+        "asyncio.run(main())\n"
+    ),
+}
+
+
+def cold(module):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", FIRST_REQUEST[module]], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def warm(module):
+    # The import lines of FIRST_REQUEST already ran in this process, so only the request is left
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            exec(FIRST_REQUEST[module], {})
+        except BaseException:
+            code = 1
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        sys.exit("forked worker failed")
+    return time.perf_counter() - start
+
+
+def report(name, times):
+    times = sorted(times)
+    print(
+        f"{name:<5} median {statistics.median(times) * 1000:8.1f} ms"
+        f"   min {times[0] * 1000:8.1f} ms   max {times[-1] * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", choices=sorted(FIRST_REQUEST), default="app")
+    args = parser.parse_args()
+    os.chdir(ROOT)
+
+    cold_times = [cold(args.module) for _ in range(args.runs)]
+
+    started = time.perf_counter()
+    __import__(args.module)
+    from bot_runtime import preload
+
+    preload()
+    print(f"master import + preload: {(time.perf_counter() - started) * 1000:.1f} ms (paid once)")
+    warm_times = [warm(args.module) for _ in range(args.runs)]
+
+    report("cold", cold_times)
+    report("warm", warm_times)
+
+
+if __name__ == "__main__":
+    main()
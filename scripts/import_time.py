@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Import-time report for the bot's entry modules
+
+Imports a module in a fresh interpreter under `python -X importtime` and
+lists the slowest imports, by cumulative time (the module and everything it
+pulled in) and by self time. Also lists which of the lazily imported
+feature dependencies (qrcode, Pillow, multiprocessing) were loaded at
+import, which should be none of them.
+
+Usage: python scripts/import_time.py [--module app] [--top 20]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY = ("qrcode", "PIL", "multiprocessing", "concurrent.futures.process")
+
+
+def measure(module):
+    """(name, self_us, cumulative_us, depth) for every module imported by `import module`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(own), int(cumulative), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="module to import (app, aio_app, bot_runtime, ...)")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    total = next(cumulative for name, _, cumulative, _ in rows if name == args.module)
+    print(f"import {args.module}: {total / 1000:.1f} ms, {len(rows)} modules\n")
+
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    # Top-level packages only, so botbuilder is one line rather than forty
+    shallow = [row for row in rows if row[3] <= 2]
+    for name, own, cumulative, _ in sorted(shallow, key=lambda row: -row[2])[:args.top]:
+        print(f"{cumulative / 1000:14.1f} {own / 1000:8.1f}  {name}")
+
+    print(f"\n{'self ms':>14}  module (slowest on their own)")
+    for name, own, _, _ in sorted(rows, key=lambda row: -row[1])[:args.top]:
+        print(f"{own / 1000:14.1f}  {name}")
+
+    loaded = sorted({name for name, _, _, _ in rows if name.split(".")[0] in LAZY or name in LAZY})
+    print(f"\nlazy dependencies loaded at import: {', '.join(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
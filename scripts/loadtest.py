@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Local load test for the /api/messages pipeline
+
+Starts the bot with wsgi.py (gunicorn; Flask `sync` workers or the aiohttp
+mode), points it at an in-process stub that plays both the Bot Connector
+(reply endpoint) and the weather provider, and sends realistic Teams message
+activities at a fixed rate with a configurable command mix. Nothing leaves
+the machine: activities carry the stub's serviceUrl and bot credentials are
+blanked so the adapter skips authentication.
+
+Reports throughput, p50/p95/p99 latency of the HTTP acknowledgement and of
+the bot's reply arriving at the connector stub, status codes, and per-worker
+RSS (peak over the run). Results are written as JSON, tagged with the git
+commit, so runs can be compared across commits with --compare.
+
+--sweep runs the same load against several gunicorn worker models and sizes
+(see gunicorn_config.py) and recommends the one with the lowest p95 reply
+latency among those that served every request, breaking ties on memory.
+
+Usage:
+    python scripts/loadtest.py --mode flask --rate 50 --duration 20
+    python scripts/loadtest.py --mode aiohttp --ack-mode queue --output aio.json
+    python scripts/loadtest.py --mode aiohttp --compare flask.json
+    python scripts/loadtest.py --sweep auto,sync:3,gthread:1x8,gthread:2x4,aiohttp:1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from aiohttp import ClientSession, ClientTimeout, web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "calc=35,task=20,weather=20,qr=10,poll=10,help=5"
+
+# Messages per command, picked at random so caches see a realistic repeat rate
+COMMANDS = {
+    "calc": ["calc 2^3 + sqrt(16)", "calc (8 + 5 + 3 + 13) / 4", "2 + 3 * 4", "calc 1200 / 12",
+             "calc sin(45 * pi / 180)"],
+    "task": ["task add Review the release notes", "task list", "task add Book the team lunch",
+             "task list"],
+    "weather": ["weather Sydney", "weather Melbourne", "forecast Sydney", "weather London",
+                "forecast Singapore"],
+    "qr": ["qr https://example.com/standup", "qr https://example.com/retro",
+           "qr Meeting room 4.02"],
+    "poll": ['poll "Lunch?" "Pizza" "Sushi" "Tacos"', 'poll "Retro day?" "Thursday" "Friday"'],
+    "help": ["help", "menu"],
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"Unknown command in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_sweep(text):
+    """Parse "auto,sync:3,gthread:2x8,aiohttp:1" into worker configurations"""
+    configs = []
+    for part in text.split(","):
+        label = part.strip()
+        worker_class, _, size = label.partition(":")
+        if worker_class not in ("auto", "sync", "gthread", "aiohttp"):
+            raise argparse.ArgumentTypeError(f"Unknown worker class in sweep: {worker_class}")
+        workers, _, threads = size.partition("x")
+        if not all(value.isdigit() for value in (workers, threads) if value):
+            raise argparse.ArgumentTypeError(f"Expected class:workers[xthreads], got {label}")
+        configs.append({"label": label, "worker_class": worker_class, "workers": workers, "threads": threads})
+    return configs
+
+
+def worker_env(args, config):
+    """Environment selecting one sweep configuration; unset values are left to gunicorn_config"""
+    mode = "aiohttp" if config["worker_class"] == "aiohttp" else args.mode
+    return {
+        "BOT_SERVER_MODE": mode,
+        "BOT_WORKER_CLASS": config["worker_class"] if mode == "flask" else "auto",
+        "BOT_WORKERS": config["workers"],
+        "BOT_THREADS": config["threads"],
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_activity(text, service_url, user_index):
+    """A message activity shaped like the ones Teams sends to the bot"""
+    user = f"29:load-user-{user_index}"
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "localTimestamp": datetime.now().astimezone().isoformat(),
+        "serviceUrl": service_url,
+        "channelId": "msteams",
+        "from": {"id": user, "name": f"Load User {user_index}", "aadObjectId": str(uuid.UUID(int=user_index))},
+        "conversation": {
+            "conversationType": "personal",
+            "tenantId": "00000000-0000-0000-0000-00000000feed",
+            "id": f"a:load-conversation-{user_index}",
+        },
+        "recipient": {"id": "28:load-test-bot", "name": "Productivity Bot"},
+        "textFormat": "plain",
+        "locale": "en-US",
+        "text": text,
+        "entities": [{"locale": "en-US", "country": "US", "platform": "Web", "timezone": "UTC",
+                      "type": "clientInfo"}],
+        "channelData": {"tenant": {"id": "00000000-0000-0000-0000-00000000feed"}},
+    }
+
+
+class Stub:
+    """Bot Connector reply endpoint and weather provider in one local server"""
+
+    def __init__(self):
+        self.replies = {}
+
+    async def reply(self, request):
+        body = await request.json()
+        reply_to = body.get("replyToId") or request.match_info.get("activity_id")
+        if reply_to:
+            self.replies.setdefault(reply_to, time.perf_counter())
+        return web.json_response({"id": uuid.uuid4().hex})
+
+    async def weather(self, request):
+        city = request.query.get("q", "")
+        return web.json_response({
+            "name": city,
+            "weather": [{"main": "Clear", "description": "clear sky"}],
+            "main": {"temp": 22.4, "feels_like": 21.9, "humidity": 48},
+            "wind": {"speed": 3.1},
+            "list": [{"dt": 1700000000 + i * 10800, "main": {"temp": 20 + i % 5}} for i in range(40)],
+        })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v3/conversations/{conversation_id}/activities", self.reply)
+        app.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.reply)
+        app.router.add_put("/v3/conversations/{conversation_id}/activities/{activity_id}", self.reply)
+        app.router.add_get("/weather", self.weather)
+        app.router.add_get("/forecast", self.weather)
+        return app
+
+
+def start_bot(args, port, stub_url, overrides=None):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "BOT_SERVER_MODE": args.mode,
+        "BOT_ACK_MODE": args.ack_mode,
+        # Lets gunicorn_config size the workers for the mix being sent
+        "BOT_COMMAND_MIX": ",".join(f"{name}={weight:g}" for name, weight in args.mix.items()),
+        # Load users send far faster than people do, so measure the bot rather than its admission control
+        "BOT_RATE_LIMIT_ENABLED": "true" if args.rate_limit else "false",
+        "MicrosoftAppId": "",
+        "MicrosoftAppPassword": "",
+        "WEATHER_API_URL": stub_url,
+        "BOT_PUBLIC_URL": f"http://127.0.0.1:{port}",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": "",
+    })
+    env.update(overrides or {})
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "wsgi.py")],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def wait_until_up(session, url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Bot process exited with code {process.returncode}")
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Bot did not start in time")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+async def run(args, overrides=None):
+    stub = Stub()
+    runner = web.AppRunner(stub.app(), access_log=None)
+    await runner.setup()
+    stub_port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", stub_port).start()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+
+    bot_port = free_port()
+    process = start_bot(args, bot_port, stub_url, overrides)
+    base_url = f"http://127.0.0.1:{bot_port}"
+    rss_peak = {}
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as session:
+            await wait_until_up(session, base_url + "/", process)
+            results = await drive(args, session, base_url, stub, stub_url + "/", process.pid, rss_peak)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await runner.cleanup()
+
+    results["workers"] = [{"pid": pid, "peak_rss_mb": round(kb / 1024, 1)} for pid, kb in sorted(rss_peak.items())]
+    return results
+
+
+async def drive(args, session, base_url, stub, service_url, master_pid, rss_peak):
+    mix = args.mix
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rng = random.Random(args.seed)
+    limiter = asyncio.Semaphore(args.max_in_flight)
+    sent = {}
+    ack_latency = {name: [] for name in names}
+    statuses = {}
+    errors = 0
+
+    async def send(index, command):
+        nonlocal errors
+        activity = make_activity(rng.choice(COMMANDS[command]), service_url, index % args.users)
+        async with limiter:
+            start = time.perf_counter()
+            sent[activity["id"]] = (command, start)
+            try:
+                async with session.post(base_url + "/api/messages", json=activity) as resp:
+                    await resp.read()
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            except Exception:
+                errors += 1
+                return
+            ack_latency[command].append(time.perf_counter() - start)
+
+    async def sample_rss():
+        while True:
+            for pid in worker_pids(master_pid):
+                kb = rss_kb(pid)
+                if kb is not None:
+                    rss_peak[pid] = max(rss_peak.get(pid, 0), kb)
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.ensure_future(sample_rss())
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    tasks = []
+    for index in range(total):
+        # Open loop: requests go out on schedule whether or not earlier ones finished
+        delay = started + index / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(index, rng.choices(names, weights)[0])))
+    await asyncio.gather(*tasks)
+    send_elapsed = time.perf_counter() - started
+
+    # Give queued turns time to reply before collecting end-to-end latency
+    grace_deadline = time.perf_counter() + args.grace
+    while len(stub.replies) < len(sent) and time.perf_counter() < grace_deadline:
+        await asyncio.sleep(0.1)
+    sampler.cancel()
+
+    reply_latency = {name: [] for name in names}
+    for activity_id, (command, start) in sent.items():
+        replied = stub.replies.get(activity_id)
+        if replied is not None:
+            reply_latency[command].append(replied - start)
+
+    all_ack = [value for values in ack_latency.values() for value in values]
+    all_reply = [value for values in reply_latency.values() for value in values]
+    return {
+        "requests": total,
+        "completed": len(all_ack),
+        "errors": errors,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "replies": len(all_reply),
+        "elapsed_s": round(send_elapsed, 3),
+        "throughput_rps": round(len(all_ack) / send_elapsed, 2),
+        "ack": summarize(all_ack),
+        "reply": summarize(all_reply),
+        "by_command": {
+            name: {"ack": summarize(ack_latency[name]), "reply": summarize(reply_latency[name])}
+            for name in names
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    results = report["results"]
+    config = report["config"]
+    print(f"mode={config['mode']} ack={config['ack_mode']} rate={config['rate']}/s "
+          f"duration={config['duration']}s commit={report['commit']}")
+    print(f"throughput: {results['throughput_rps']} req/s  completed={results['completed']}/"
+          f"{results['requests']}  errors={results['errors']}  statuses={results['statuses']}")
+    for label in ("ack", "reply"):
+        stats = results[label]
+        print(f"{label:>6}: n={stats['count']:<6} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+              f"p99={stats['p99_ms']}ms max={stats['max_ms']}ms")
+    for name, stats in results["by_command"].items():
+        print(f"  {name:<8} ack p95={stats['ack']['p95_ms']}ms  reply p95={stats['reply']['p95_ms']}ms")
+    for worker in results["workers"]:
+        print(f"  worker {worker['pid']}: peak RSS {worker['peak_rss_mb']} MB")
+
+
+def print_comparison(report, baseline):
+    print(f"\ncompared with {baseline['commit']} ({baseline['config']['mode']}/{baseline['config']['ack_mode']}):")
+    rows = [("throughput_rps", None)] + [(key, label) for label in ("ack", "reply")
+                                         for key in ("p50_ms", "p95_ms", "p99_ms")]
+    for key, label in rows:
+        new = report["results"][label][key] if label else report["results"][key]
+        old = baseline["results"][label][key] if label else baseline["results"][key]
+        if new is None or old is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {(label + ' ' if label else '') + key:<16} {old:>10} -> {new:<10} {change}")
+
+
+def recommend(rows):
+    """The sweep row with the lowest p95 reply latency among those that served every request"""
+    eligible = [
+        row for row in rows
+        if row["results"]["errors"] == 0
+        and row["results"]["completed"] == row["results"]["requests"]
+        and set(row["results"]["statuses"]) <= {"200", "202"}
+    ]
+
+    def key(row):
+        results = row["results"]
+        p95 = results["reply"]["p95_ms"] if results["reply"]["p95_ms"] is not None else results["ack"]["p95_ms"]
+        return (p95 if p95 is not None else float("inf"), sum(w["peak_rss_mb"] for w in results["workers"]))
+
+    return min(eligible, key=key) if eligible else None
+
+
+def print_sweep(rows, best):
+    print(f"\n{'config':<14} {'rps':>8} {'ack p95':>9} {'reply p95':>10} {'reply p99':>10} "
+          f"{'errors':>7} {'workers':>8} {'RSS MB':>8}")
+    for row in rows:
+        results = row["results"]
+        marker = "  <- best" if row is best else ""
+        print(f"{row['label']:<14} {results['throughput_rps']:>8} {str(results['ack']['p95_ms']):>9} "
+              f"{str(results['reply']['p95_ms']):>10} {str(results['reply']['p99_ms']):>10} "
+              f"{results['errors']:>7} {len(results['workers']):>8} "
+              f"{round(sum(w['peak_rss_mb'] for w in results['workers']), 1):>8}{marker}")
+    if best is None:
+        print("\nno configuration served every request; lower --rate or try larger configurations")
+        return
+    settings = {key: value for key, value in best["env"].items() if value and value != "auto"}
+    print(f"\nrecommended: {best['label']}  ({' '.join(f'{k}={v}' for k, v in settings.items()) or 'defaults'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["flask", "aiohttp"], default="flask")
+    parser.add_argument("--ack-mode", choices=["sync", "queue"], default="sync")
+    parser.add_argument("--rate", type=float, default=50, help="requests per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of sending")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"command weights (default {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=200, help="distinct users/conversations")
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--grace", type=float, default=10, help="seconds to wait for outstanding replies")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the bot's rate limiter on")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's stderr")
+    parser.add_argument("--sweep", type=parse_sweep,
+                        help="compare worker configurations, e.g. auto,sync:3,gthread:2x8,aiohttp:1")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "config": {
+            "mode": args.mode, "ack_mode": args.ack_mode, "rate": args.rate, "duration": args.duration,
+            "mix": args.mix, "users": args.users, "max_in_flight": args.max_in_flight, "seed": args.seed,
+        },
+    }
+    if args.sweep:
+        rows = []
+        for config in args.sweep:
+            env = worker_env(args, config)
+            print(f"running {config['label']}...", flush=True)
+            rows.append({"label": config["label"], "env": env, "results": asyncio.run(run(args, env))})
+        best = recommend(rows)
+        report["sweep"] = rows
+        report["recommended"] = best["label"] if best else None
+        print_sweep(rows, best)
+    else:
+        report["results"] = asyncio.run(run(args))
+        print_report(report)
+    if args.compare and not args.sweep:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Shared SQLite plumbing for the file-backed stores
+
+Every worker on a host opens the same database files (dedup, rate limits,
+tasks, conversation state, polls, reminders), so connections use WAL with
+synchronous=NORMAL: readers never block the single writer, and a commit does
+not wait for an fsync. sqlite3 connections may not be shared between threads,
+and must not cross a fork (gunicorn preload), so ConnectionCache keeps one
+per thread and opens a new one when it finds itself in a different process.
+transaction() runs a block in BEGIN IMMEDIATE (or BEGIN) and rolls back on
+any exception.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+def connect(path, timeout=10):
+    """Autocommit connection to `path` in WAL mode; transactions are opened explicitly"""
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class ConnectionCache:
+    """One connection per thread and process to a SQLite file"""
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        """This thread's connection, reopened after a fork"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect(self.path, self.timeout)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+@contextmanager
+def transaction(conn, immediate=True):
+    """Commit the enclosed block, or roll it back if it raises
+
+    BEGIN IMMEDIATE takes the write lock up front, so a read-modify-write
+    never fails half way with SQLITE_BUSY; plain BEGIN suits read-mostly work.
+    """
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
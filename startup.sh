@@ -15,6 +15,7 @@ else
     source venv/bin/activate
 fi
 
-# Start the application with Gunicorn
+# Start the application with Gunicorn through wsgi.py, which sizes the workers
+# (see gunicorn_config.py) and preloads the app so workers fork warm
 echo "Starting application with Gunicorn..."
-exec gunicorn --bind 0.0.0.0:$PORT --workers 2 --timeout 120 --access-logfile - --error-logfile - app:app
+exec python wsgi.py
@@ -0,0 +1,467 @@
+"""
+Task storage for the `task add/list/complete/delete` commands
+
+TaskStore is the interface the bot talks to. MemoryTaskStore keeps tasks in
+the process (tests, single-worker development). SqliteTaskStore keeps them in
+a WAL-mode SQLite file shared by every gunicorn worker on the host, so task
+lists survive worker recycling and look the same from every worker. Other
+backends (e.g. a Redis-compatible one) only need to implement TaskStore.
+
+All lookups go through a per-user index, so the cost of `task list` depends on
+how many tasks that user has, not on how many users there are. page_tasks()
+goes further: it walks the index from an opaque cursor, filtered by status
+and text, and stops after one page (or `max_scan` examined tasks), so a page
+costs the same for a user with ten tasks and one with ten thousand.
+"""
+
+import atexit
+import base64
+import binascii
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field, replace
+from datetime import datetime, timezone
+from sqlite_db import ConnectionCache, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+@dataclass(frozen=True)
+class Task:
+    """A single task owned by one user"""
+
+    id: str
+    user_id: str
+    description: str
+    completed: bool = False
+    created_at: str = ""
+    completed_at: str = None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+ALL = "all"
+OPEN = "open"
+COMPLETED = "completed"
+STATUSES = (ALL, OPEN, COMPLETED)
+
+
+class InvalidCursorError(ValueError):
+    """Raised for a page cursor this store did not issue"""
+
+
+@dataclass(frozen=True)
+class TaskPage:
+    """One page of a user's tasks, and the cursor of the next page (None on the last one)"""
+
+    tasks: list = field(default_factory=list)
+    next_cursor: str = None
+    status: str = ALL
+    search: str = ""
+
+
+def encode_cursor(after, status, search):
+    """Opaque cursor: the position to resume after, and the filters it was issued for"""
+    raw = json.dumps({"a": after, "s": status, "q": search}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(after, status, search) from a cursor made by encode_cursor"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        after, status, search = int(data["a"]), data["s"], str(data["q"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursorError("Invalid task list cursor") from None
+    if status not in STATUSES:
+        raise InvalidCursorError("Invalid task list cursor")
+    return after, status, search
+
+
+class TaskStore:
+    """Interface for task backends"""
+
+    def add_task(self, user_id, description):
+        """Create a task and return it"""
+        raise NotImplementedError
+
+    def list_tasks(self, user_id):
+        """All tasks of one user, oldest first"""
+        raise NotImplementedError
+
+    def get_task(self, user_id, task_id):
+        """One task, or None if the user has no task with that id"""
+        for task in self.list_tasks(user_id):
+            if task.id == task_id:
+                return task
+        return None
+
+    def complete_task(self, user_id, task_id):
+        """Mark a task completed; returns the updated task or None"""
+        raise NotImplementedError
+
+    def delete_task(self, user_id, task_id):
+        """Delete a task; returns True if it existed"""
+        raise NotImplementedError
+
+    def scan_tasks(self, user_id, after=0, completed=None):
+        """Yield (position, task) for one user in creation order, starting after `after`
+
+        `completed` restricts the scan to open (False) or completed (True) tasks.
+        """
+        raise NotImplementedError
+
+    def page_tasks(self, user_id, status=ALL, search="", cursor=None, limit=10, max_scan=500):
+        """One TaskPage of a user's tasks matching the filters
+
+        With a cursor the filters it was issued for are used. At most `limit`
+        tasks are returned and at most `max(limit, max_scan)` examined, so a
+        search that matches rarely returns a short page with a cursor to
+        continue from rather than walking the whole list.
+        """
+        after = 0
+        if cursor:
+            after, status, search = decode_cursor(cursor)
+        if status not in STATUSES:
+            raise ValueError(f"Unknown task status filter: {status}")
+        needle = search.casefold()
+        completed = None if status == ALL else status == COMPLETED
+        tasks, scanned, position = [], 0, after
+        for position, task in self.scan_tasks(user_id, after, completed):
+            scanned += 1
+            if not needle or needle in task.description.casefold():
+                tasks.append(task)
+            if len(tasks) == limit or scanned >= max(limit, max_scan):
+                break
+        else:
+            return TaskPage(tasks, None, status, search)
+        # Only worth a cursor if something follows
+        if next(iter(self.scan_tasks(user_id, position, completed)), None) is None:
+            return TaskPage(tasks, None, status, search)
+        return TaskPage(tasks, encode_cursor(position, status, search), status, search)
+
+    def flush(self):
+        """Persist any buffered writes"""
+
+    def close(self):
+        """Flush and release resources"""
+        self.flush()
+
+    @staticmethod
+    def new_task_id():
+        return uuid.uuid4().hex[:8]
+
+
+class MemoryTaskStore(TaskStore):
+    """Tasks held in this process only"""
+
+    def __init__(self):
+        self._tasks = {}
+        self._positions = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def add_task(self, user_id, description):
+        task = Task(self.new_task_id(), user_id, description, created_at=_now())
+        with self._lock:
+            self._tasks.setdefault(user_id, OrderedDict())[task.id] = task
+            self._seq += 1
+            self._positions[task.id] = self._seq
+        return task
+
+    def scan_tasks(self, user_id, after=0, completed=None):
+        with self._lock:
+            tasks = list(self._tasks.get(user_id, {}).values())
+        for task in tasks:
+            position = self._positions[task.id]
+            if position > after and (completed is None or task.completed == completed):
+                yield position, task
+
+    def list_tasks(self, user_id):
+        with self._lock:
+            return list(self._tasks.get(user_id, {}).values())
+
+    def get_task(self, user_id, task_id):
+        with self._lock:
+            return self._tasks.get(user_id, {}).get(task_id)
+
+    def complete_task(self, user_id, task_id):
+        with self._lock:
+            tasks = self._tasks.get(user_id, {})
+            task = tasks.get(task_id)
+            if task is None:
+                return None
+            if not task.completed:
+                task = tasks[task_id] = replace(task, completed=True, completed_at=_now())
+            return task
+
+    def delete_task(self, user_id, task_id):
+        with self._lock:
+            if self._tasks.get(user_id, {}).pop(task_id, None) is None:
+                return False
+            del self._positions[task_id]
+            return True
+
+
+class SqliteTaskStore(TaskStore):
+    """Tasks in a WAL-mode SQLite file with batched writes and a read-through cache
+
+    Writes update the local cache at once and are queued; the queue is written
+    in one transaction when it holds `batch_size` operations or after
+    `flush_interval` seconds. A task's seq, which orders listings and pages,
+    comes from a counter row bumped in that transaction, so it follows the
+    order tasks reach the file whichever worker wrote them. Each user row carries a version that is bumped by
+    every flush, so a worker serves a user's tasks from its cache only while no
+    other worker has written to that user since.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tasks ("
+        " user_id TEXT NOT NULL,"
+        " task_id TEXT NOT NULL,"
+        " description TEXT NOT NULL,"
+        " completed INTEGER NOT NULL DEFAULT 0,"
+        " created_at TEXT NOT NULL,"
+        " completed_at TEXT,"
+        " seq INTEGER NOT NULL,"
+        " PRIMARY KEY (user_id, task_id))",
+        "CREATE INDEX IF NOT EXISTS tasks_by_user ON tasks (user_id, seq)",
+        "CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (user_id, completed, seq)",
+        "CREATE TABLE IF NOT EXISTS task_users ("
+        " user_id TEXT PRIMARY KEY,"
+        " version INTEGER NOT NULL DEFAULT 0)",
+        # seq is handed out here when a row is written, so every worker draws from one sequence;
+        # a file from before the counter starts it past the seqs already used
+        "CREATE TABLE IF NOT EXISTS task_counters ("
+        " name TEXT PRIMARY KEY,"
+        " value INTEGER NOT NULL)",
+        "INSERT INTO task_counters (name, value) SELECT 'seq', COALESCE(MAX(seq), 0) FROM tasks WHERE 1 "
+        "ON CONFLICT(name) DO NOTHING",
+    )
+
+    def __init__(self, path, batch_size=64, flush_interval=0.05, cache_users=1024, scan_batch=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.scan_batch = scan_batch
+        self.flush_interval = flush_interval
+        self.cache_users = cache_users
+        self._connections = ConnectionCache(path)
+        self._lock = threading.RLock()
+        self._pending = []
+        self._pending_since = None
+        # user_id -> (version, OrderedDict task_id -> Task)
+        self._cache = OrderedDict()
+        self._flusher = None
+        self._closed = False
+
+        conn = self._connections.get()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        atexit.register(self.close)
+
+    # -- reads -------------------------------------------------------------
+
+    def list_tasks(self, user_id):
+        with self._lock:
+            return list(self._user_tasks(user_id).values())
+
+    def get_task(self, user_id, task_id):
+        with self._lock:
+            return self._user_tasks(user_id).get(task_id)
+
+    def scan_tasks(self, user_id, after=0, completed=None):
+        # Straight from the index in keyset batches, never the whole list; queued writes go first
+        self.flush()
+        conn = self._connections.get()
+        status = "" if completed is None else " AND completed = ?"
+        while True:
+            params = (user_id, after) + (() if completed is None else (int(completed),)) + (self.scan_batch,)
+            rows = conn.execute(
+                "SELECT seq, task_id, description, completed, created_at, completed_at "
+                f"FROM tasks WHERE user_id = ? AND seq > ?{status} ORDER BY seq LIMIT ?",
+                params
+            ).fetchall()
+            for row in rows:
+                yield row[0], Task(row[1], user_id, row[2], bool(row[3]), row[4], row[5])
+            if len(rows) < self.scan_batch:
+                return
+            after = rows[-1][0]
+
+    def _db_version(self, conn, user_id):
+        row = conn.execute("SELECT version FROM task_users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _user_tasks(self, user_id):
+        conn = self._connections.get()
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            version, tasks = cached
+            if self._has_pending(user_id) or self._db_version(conn, user_id) == version:
+                self._cache.move_to_end(user_id)
+                return tasks
+
+        # Another worker wrote to this user (or it is not cached): reload from the index
+        self.flush()
+        with transaction(conn, immediate=False):
+            version = self._db_version(conn, user_id)
+            rows = conn.execute(
+                "SELECT task_id, description, completed, created_at, completed_at "
+                "FROM tasks WHERE user_id = ? ORDER BY seq",
+                (user_id,)
+            ).fetchall()
+        tasks = OrderedDict(
+            (row[0], Task(row[0], user_id, row[1], bool(row[2]), row[3], row[4])) for row in rows
+        )
+        self._cache_put(user_id, version, tasks)
+        return tasks
+
+    def _cache_put(self, user_id, version, tasks):
+        self._cache[user_id] = (version, tasks)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_users:
+            evicted, _ = self._cache.popitem(last=False)
+            if self._has_pending(evicted):
+                self.flush()
+
+    def _has_pending(self, user_id):
+        return any(op[1] == user_id for op in self._pending)
+
+    # -- writes ------------------------------------------------------------
+
+    def add_task(self, user_id, description):
+        task = Task(self.new_task_id(), user_id, description, created_at=_now())
+        with self._lock:
+            tasks = self._user_tasks(user_id)
+            tasks[task.id] = task
+            self._enqueue(("insert", user_id, task))
+        return task
+
+    def complete_task(self, user_id, task_id):
+        with self._lock:
+            tasks = self._user_tasks(user_id)
+            task = tasks.get(task_id)
+            if task is None:
+                return None
+            if not task.completed:
+                task = tasks[task_id] = replace(task, completed=True, completed_at=_now())
+                self._enqueue(("complete", user_id, task))
+            return task
+
+    def delete_task(self, user_id, task_id):
+        with self._lock:
+            task = self._user_tasks(user_id).pop(task_id, None)
+            if task is None:
+                return False
+            self._enqueue(("delete", user_id, task))
+            return True
+
+    def _enqueue(self, op):
+        self._pending.append(op)
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._closed or (self._flusher is not None and self._flusher.is_alive()):
+            return
+
+        def run():
+            while not self._closed:
+                time.sleep(self.flush_interval)
+                try:
+                    with self._lock:
+                        if self._pending and time.monotonic() - self._pending_since >= self.flush_interval:
+                            self.flush()
+                except Exception as e:
+                    logger.error("Task store background flush failed: %s", e, exc_info=True)
+
+        self._flusher = threading.Thread(target=run, name="task-store-flush", daemon=True)
+        self._flusher.start()
+
+    def flush(self):
+        """Write all queued operations in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            ops, self._pending, self._pending_since = self._pending, [], None
+            try:
+                versions = self._write_batch(self._connections.get(), ops)
+            except Exception:
+                # Keep the operations so the next flush retries them
+                self._pending = ops + self._pending
+                self._pending_since = time.monotonic()
+                raise
+
+            for user_id, new_version in versions.items():
+                cached = self._cache.get(user_id)
+                if cached is None:
+                    continue
+                if new_version == cached[0] + 1:
+                    self._cache[user_id] = (new_version, cached[1])
+                else:
+                    # Another worker wrote in between; reload on next read
+                    del self._cache[user_id]
+
+    def _write_batch(self, conn, ops):
+        versions = {}
+        with transaction(conn):
+            for kind, user_id, task in ops:
+                if kind == "insert":
+                    (seq,) = conn.execute(
+                        "UPDATE task_counters SET value = value + 1 WHERE name = 'seq' RETURNING value"
+                    ).fetchone()
+                    conn.execute(
+                        "INSERT INTO tasks (user_id, task_id, description, completed, created_at, "
+                        "completed_at, seq) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, task.id, task.description, int(task.completed),
+                         task.created_at, task.completed_at, seq)
+                    )
+                elif kind == "complete":
+                    conn.execute(
+                        "UPDATE tasks SET completed = 1, completed_at = ? WHERE user_id = ? AND task_id = ?",
+                        (task.completed_at, user_id, task.id)
+                    )
+                else:
+                    conn.execute(
+                        "DELETE FROM tasks WHERE user_id = ? AND task_id = ?", (user_id, task.id)
+                    )
+                versions[user_id] = None
+
+            for user_id in versions:
+                versions[user_id] = conn.execute(
+                    "INSERT INTO task_users (user_id, version) VALUES (?, 1) "
+                    "ON CONFLICT(user_id) DO UPDATE SET version = version + 1 "
+                    "RETURNING version",
+                    (user_id,)
+                ).fetchall()[0][0]
+        return versions
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+
+
+def create_task_store(url):
+    """Build a task store from a URL: memory:// or sqlite:///path/to/file"""
+    if url.startswith("memory://"):
+        return MemoryTaskStore()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if not path:
+            raise ValueError("sqlite:// task store URL needs a file path")
+        return SqliteTaskStore(path)
+    raise ValueError(f"Unsupported task store URL: {url}")
@@ -0,0 +1,135 @@
+"""
+Paged rendering of `task list`
+
+`task list [open|done|all] [search text]` shows one page of the user's
+tasks as an Adaptive Card whose "Next page" button carries the cursor of the
+following page. Teams sends the button back as a message activity with the
+button's data in `activity.value` and no text, so the bot hands that value
+to task_list_activity() as well. Channels without cards get render_text(),
+which prints the same cursor as a `task list next <cursor>` command:
+
+    async def handle_task_list(self, turn_context, args):
+        await turn_context.send_activity(
+            task_list_activity(get_task_store(), user_id, args, turn_context.activity.value)
+        )
+
+Each reply holds at most one page, so its size no longer grows with the
+backlog, and the store only reads that page (see TaskStore.page_tasks).
+"""
+
+from botbuilder.core import CardFactory, MessageFactory
+from task_store import ALL, COMPLETED, OPEN, InvalidCursorError
+
+NEXT_PAGE_ACTION = "task_list_page"
+NEXT_PAGE_WORD = "next"
+MAX_PAGE_SIZE = 50
+MAX_DESCRIPTION_CHARS = 200
+
+STATUS_WORDS = {
+    "all": ALL,
+    "open": OPEN,
+    "todo": OPEN,
+    "pending": OPEN,
+    "done": COMPLETED,
+    "completed": COMPLETED,
+}
+STATUS_TITLES = {ALL: "Your tasks", OPEN: "Open tasks", COMPLETED: "Completed tasks"}
+
+
+def parse_list_args(args):
+    """(status, search) from the text after `task list`"""
+    words = (args or "").split()
+    status = ALL
+    if words and words[0].lower() in STATUS_WORDS:
+        status = STATUS_WORDS[words.pop(0).lower()]
+    return status, " ".join(words)
+
+
+def next_page_cursor(value):
+    """The cursor of a "Next page" button press, or None for any other activity value"""
+    if isinstance(value, dict) and value.get("action") == NEXT_PAGE_ACTION:
+        return value.get("cursor") or None
+    return None
+
+
+def text_page_cursor(args):
+    """The cursor of `task list next <cursor>`, the text form of the "Next page" button"""
+    words = (args or "").split()
+    if len(words) == 2 and words[0].lower() == NEXT_PAGE_WORD:
+        return words[1]
+    return None
+
+
+def _describe(task):
+    description = task.description
+    if len(description) > MAX_DESCRIPTION_CHARS:
+        description = description[:MAX_DESCRIPTION_CHARS - 1] + "…"
+    return description
+
+
+def _title(page):
+    title = STATUS_TITLES[page.status]
+    if page.search:
+        title += f' matching "{page.search}"'
+    return title
+
+
+def render_text(page):
+    """Plain-text page, for channels without Adaptive Cards"""
+    if not page.tasks:
+        return f"📝 **{_title(page)}**\n\nNothing here."
+    lines = [f"📝 **{_title(page)}**", ""]
+    for task in page.tasks:
+        mark = "✅" if task.completed else "⬜"
+        lines.append(f"{mark} {_describe(task)} (`{task.id}`)")
+    if page.next_cursor:
+        lines += ["", f"More tasks follow; send `task list {NEXT_PAGE_WORD} {page.next_cursor}` for the next page."]
+    return "\n".join(lines)
+
+
+def render_card(page):
+    """Adaptive Card content for one page, with a "Next page" action if more follow"""
+    body = [{"type": "TextBlock", "text": f"📝 {_title(page)}", "weight": "Bolder", "size": "Medium"}]
+    if not page.tasks:
+        body.append({"type": "TextBlock", "text": "Nothing here.", "isSubtle": True})
+    for task in page.tasks:
+        body.append({
+            "type": "ColumnSet",
+            "columns": [
+                {"type": "Column", "width": "auto", "items": [
+                    {"type": "TextBlock", "text": "✅" if task.completed else "⬜"},
+                ]},
+                {"type": "Column", "width": "stretch", "items": [
+                    {"type": "TextBlock", "text": _describe(task), "wrap": True, "isSubtle": task.completed},
+                ]},
+                {"type": "Column", "width": "auto", "items": [
+                    {"type": "TextBlock", "text": task.id, "fontType": "Monospace", "isSubtle": True},
+                ]},
+            ],
+        })
+    card = {
+        "type": "AdaptiveCard",
+        "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+        "version": "1.4",
+        "body": body,
+    }
+    if page.next_cursor:
+        card["actions"] = [{
+            "type": "Action.Submit",
+            "title": "Next page",
+            "data": {"action": NEXT_PAGE_ACTION, "cursor": page.next_cursor},
+        }]
+    return card
+
+
+def task_list_activity(store, user_id, args="", value=None, page_size=10):
+    """Reply activity for `task list`, `task list next <cursor>` or a "Next page" press: one page as an Adaptive Card"""
+    cursor = next_page_cursor(value) or text_page_cursor(args)
+    status, search = parse_list_args(args)
+    limit = max(1, min(page_size, MAX_PAGE_SIZE))
+    try:
+        page = store.page_tasks(user_id, status=status, search=search, cursor=cursor, limit=limit)
+    except InvalidCursorError:
+        # A cursor this store did not issue, or a search for "next <word>"; start over
+        page = store.page_tasks(user_id, status=status, search=search, limit=limit)
+    return MessageFactory.attachment(CardFactory.adaptive_card(render_card(page)))
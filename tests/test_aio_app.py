@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Test module for the aiohttp serving mode
+"""
+
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from aio_app import create_app
+
+
+class RecordingBot:
+    """Minimal bot that records every turn it receives"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.texts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def on_turn(self, turn_context):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.texts.append(turn_context.activity.text)
+        self.in_flight -= 1
+
+
+def make_activity(text, activity_id="1"):
+    return {
+        "type": "message",
+        "id": activity_id,
+        "channelId": "msteams",
+        "serviceUrl": "https://smba.example.com/",
+        "from": {"id": "user-1", "name": "Test User"},
+        "recipient": {"id": "bot-1", "name": "Bot"},
+        "conversation": {"id": "conv-1"},
+        "text": text
+    }
+
+
+class TestAioApp:
+    """Test cases for the aiohttp application"""
+
+    @pytest.fixture
+    def bot(self):
+        return RecordingBot()
+
+    @pytest.fixture
+    def adapter(self):
+        return BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+
+    @pytest.mark.asyncio
+    async def test_health_endpoints(self, adapter, bot):
+        """Test that both health endpoints keep the Flask contract"""
+        async with TestClient(TestServer(create_app(adapter, bot))) as client:
+            resp = await client.get("/")
+            assert resp.status == 200
+            data = await resp.json()
+            assert data["service"] == "teams-productivity-bot"
+
+            resp = await client.get("/api/health")
+            assert resp.status == 200
+            data = await resp.json()
+            assert "imports" in data
+
+    @pytest.mark.asyncio
+    async def test_rejects_non_json(self, adapter, bot):
+        """Test content type validation"""
+        async with TestClient(TestServer(create_app(adapter, bot))) as client:
+            resp = await client.post("/api/messages", data="hello")
+            assert resp.status == 415
+
+    @pytest.mark.asyncio
+    async def test_message_runs_turn(self, adapter, bot):
+        """Test that a message activity reaches the bot and returns 202"""
+        async with TestClient(TestServer(create_app(adapter, bot))) as client:
+            resp = await client.post("/api/messages", json=make_activity("calc 1+1"))
+            assert resp.status == 202
+            assert bot.texts == ["calc 1+1"]
+
+    @pytest.mark.asyncio
+    async def test_turns_run_concurrently(self, adapter):
+        """Test that slow turns overlap on the shared event loop"""
+        bot = RecordingBot(delay=0.05)
+        async with TestClient(TestServer(create_app(adapter, bot))) as client:
+            responses = await asyncio.gather(*[
+                client.post("/api/messages", json=make_activity(f"msg {i}", str(i)))
+                for i in range(10)
+            ])
+            assert all(resp.status == 202 for resp in responses)
+            assert bot.max_in_flight > 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
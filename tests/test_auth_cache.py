@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Test module for the inbound auth caches
+"""
+
+import asyncio
+import json
+import os
+import time
+import jwt
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from botbuilder.core import BotFrameworkAdapterSettings
+from botbuilder.schema import Activity
+from botframework.connector.auth import ChannelValidation, ClaimsIdentity, JwtTokenExtractor
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from auth_cache import (
+    TOKEN_CACHE_LOOKUPS,
+    CachedOpenIdMetadata,
+    CachingBotFrameworkAdapter,
+    VerifiedTokenCache,
+    install_signing_key_cache,
+)
+from tests.test_aio_app import make_activity
+
+APP_ID = "test-app-id"
+ISSUER = "https://api.botframework.com"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+class MetadataServer:
+    """Local OpenID metadata and JWKS endpoints serving generated RSA keys"""
+
+    def __init__(self):
+        self.private_keys = {}
+        self.published = []
+        self.fetches = 0
+
+    def add_key(self, kid, publish=True):
+        self.private_keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        if publish:
+            self.publish(kid)
+
+    def publish(self, kid):
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.private_keys[kid].public_key()))
+        jwk.update({"kid": kid, "endorsements": ["msteams"]})
+        self.published.append(jwk)
+
+    def token(self, kid, service_url="https://smba.example.com/", expires_in=3600):
+        now = int(time.time())
+        claims = {"iss": ISSUER, "aud": APP_ID, "serviceurl": service_url, "nbf": now - 10, "exp": now + expires_in}
+        return "Bearer " + jwt.encode(claims, self.private_keys[kid], algorithm="RS256", headers={"kid": kid})
+
+    async def openid(self, request):
+        return web.json_response({"jwks_uri": str(request.url.with_path("/keys"))})
+
+    async def keys(self, request):
+        self.fetches += 1
+        return web.json_response({"keys": self.published})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/openid", self.openid)
+        app.router.add_get("/keys", self.keys)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.url = str(self.server.make_url("/openid"))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+
+def activity(service_url="https://smba.example.com/"):
+    data = make_activity("hello")
+    data["serviceUrl"] = service_url
+    return Activity().deserialize(data)
+
+
+class TestAuthCache:
+    """Test cases for the verified-token and signing-key caches"""
+
+    @pytest.fixture
+    def sdk_metadata(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(JwtTokenExtractor, "metadataCache", {})
+        install_signing_key_cache(str(tmp_path))
+
+    @pytest.mark.asyncio
+    async def test_repeated_token_skips_validation(self, monkeypatch, sdk_metadata):
+        """Test that a verified token is reused, but only for the same service URL"""
+        async with MetadataServer() as server:
+            server.add_key("key-1")
+            monkeypatch.setattr(ChannelValidation, "open_id_metadata_endpoint", server.url)
+            adapter = CachingBotFrameworkAdapter(BotFrameworkAdapterSettings(APP_ID, "secret"))
+            token = server.token("key-1")
+            hits = TOKEN_CACHE_LOOKUPS.value(result="hit")
+
+            first = await adapter._authenticate_request(activity(), token)
+            second = await adapter._authenticate_request(activity(), token)
+            assert first is second
+            assert first.get_claim_value("aud") == APP_ID
+            assert TOKEN_CACHE_LOOKUPS.value(result="hit") == hits + 1
+            assert server.fetches == 1
+
+            with pytest.raises(PermissionError):
+                await adapter._authenticate_request(activity("https://evil.example.com/"), token)
+            with pytest.raises(PermissionError):
+                await adapter._authenticate_request(activity(), "")
+
+    @pytest.mark.asyncio
+    async def test_rotated_and_unknown_keys(self, monkeypatch, sdk_metadata):
+        """Test that a new kid triggers one refresh and an unknown kid is rejected"""
+        async with MetadataServer() as server:
+            server.add_key("key-1")
+            server.add_key("key-2", publish=False)
+            server.add_key("rogue", publish=False)
+            monkeypatch.setattr(ChannelValidation, "open_id_metadata_endpoint", server.url)
+            adapter = CachingBotFrameworkAdapter(BotFrameworkAdapterSettings(APP_ID, "secret"))
+            await adapter._authenticate_request(activity(), server.token("key-1"))
+
+            server.publish("key-2")
+            metadata = JwtTokenExtractor.metadataCache.get(server.url)
+            metadata.last_attempt = 0
+            await adapter._authenticate_request(activity(), server.token("key-2"))
+            assert server.fetches == 2
+
+            with pytest.raises(PermissionError):
+                await adapter._authenticate_request(activity(), server.token("rogue"))
+            with pytest.raises(PermissionError):
+                await adapter._authenticate_request(activity(), server.token("rogue"))
+            # Unknown kids do not hammer the provider
+            assert server.fetches == 2
+
+    @pytest.mark.asyncio
+    async def test_signing_keys_are_shared_on_disk(self, tmp_path):
+        """Test that a new worker starts from the keys another worker fetched"""
+        async with MetadataServer() as server:
+            server.add_key("key-1")
+            first = CachedOpenIdMetadata(server.url, cache_dir=str(tmp_path))
+            await first.get("key-1")
+            second = CachedOpenIdMetadata(server.url, cache_dir=str(tmp_path))
+            assert (await second.get("key-1")).endorsements == ["msteams"]
+            assert server.fetches == 1
+
+    @pytest.mark.asyncio
+    async def test_keys_on_disk_must_be_private(self, tmp_path):
+        """Test that key files or directories others can write are never trusted"""
+        async with MetadataServer() as server:
+            server.add_key("key-1")
+            first = CachedOpenIdMetadata(server.url, cache_dir=str(tmp_path / "auth"))
+            await first.get("key-1")
+            assert (tmp_path / "auth").stat().st_mode & 0o777 == 0o700
+
+            # A key set another user could have written is refetched instead of adopted
+            os.chmod(first._path, 0o666)
+            second = CachedOpenIdMetadata(server.url, cache_dir=str(tmp_path / "auth"))
+            await second.get("key-1")
+            assert server.fetches == 2
+
+            (tmp_path / "shared").mkdir(mode=0o777)
+            os.chmod(tmp_path / "shared", 0o777)
+            assert CachedOpenIdMetadata(server.url, cache_dir=str(tmp_path / "shared"))._path is None
+
+    @pytest.mark.asyncio
+    async def test_refresh_ahead(self, tmp_path):
+        """Test that ageing keys are served while a background refresh replaces them"""
+        clock = FakeClock()
+        async with MetadataServer() as server:
+            server.add_key("key-1")
+            metadata = CachedOpenIdMetadata(
+                server.url, cache_dir=str(tmp_path), refresh_after=60, max_age=600, min_refresh_interval=30,
+                clock=clock
+            )
+            await metadata.get("key-1")
+            fetched_at = metadata.fetched_at
+
+            clock.now += 120
+            assert await metadata.get("key-1") is not None
+            await asyncio.to_thread(metadata._background.join, 5)
+            assert server.fetches == 2
+            assert metadata.fetched_at > fetched_at
+
+    def test_token_cache_expiry_and_bounds(self):
+        """Test that entries expire with the token and the cache stays bounded"""
+        clock = FakeClock()
+        cache = VerifiedTokenCache(max_entries=2, clock=clock)
+        cache.put("a", ClaimsIdentity({"exp": clock.now + 10}, True))
+        cache.put("no-exp", ClaimsIdentity({}, True))
+        assert cache.get("a") is not None
+        assert cache.get("no-exp") is None
+
+        clock.now += 11
+        assert cache.get("a") is None
+
+        for key in ("b", "c", "d"):
+            cache.put(key, ClaimsIdentity({"exp": clock.now + 100}, True))
+        assert len(cache) == 2 and cache.get("b") is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test module for batch ingestion
+"""
+
+import json
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from aio_app import create_app
+from batch_ingest import BatchError, BatchTooLargeError, parse_batch
+from rate_limit import DROP, MemoryBucketBackend, RateLimiter
+from tests.test_aio_app import RecordingBot, make_activity
+
+
+class CountingAdapter(BotFrameworkAdapter):
+    """Adapter that counts token validations"""
+
+    def __init__(self, app_id="", password=""):
+        super().__init__(BotFrameworkAdapterSettings(app_id, password))
+        self.auth_calls = 0
+
+    async def _authenticate_request(self, request, auth_header):
+        self.auth_calls += 1
+        return await super()._authenticate_request(request, auth_header)
+
+
+def conversation_activity(text, activity_id, conversation):
+    activity = make_activity(text, activity_id)
+    activity["conversation"] = {"id": conversation}
+    return activity
+
+
+class TestBatchIngest:
+    """Test cases for /api/messages/batch"""
+
+    @pytest.mark.asyncio
+    async def test_json_array_batch(self):
+        """Test that a batch authenticates once and keeps each conversation in order"""
+        adapter = CountingAdapter()
+        bot = RecordingBot(delay=0.01)
+        batch = [
+            conversation_activity(f"{conversation}-{n}", f"{conversation}-{n}", conversation)
+            for n in range(5) for conversation in ("a", "b", "c")
+        ]
+        async with TestClient(TestServer(create_app(adapter, bot))) as client:
+            resp = await client.post("/api/messages/batch", json=batch)
+            assert resp.status == 200
+            data = await resp.json()
+
+        assert data["summary"] == {"processed": 15}
+        assert [result["id"] for result in data["results"]] == [activity["id"] for activity in batch]
+        assert adapter.auth_calls == 1
+        for conversation in ("a", "b", "c"):
+            seen = [text for text in bot.texts if text.startswith(conversation)]
+            assert seen == [f"{conversation}-{n}" for n in range(5)]
+        assert 1 < bot.max_in_flight <= 3
+
+    @pytest.mark.asyncio
+    async def test_ndjson_with_bad_lines(self):
+        """Test that unparsable lines are reported without rejecting the batch"""
+        bot = RecordingBot()
+        lines = [json.dumps(make_activity("one", "1")), "{not json", "", json.dumps(make_activity("two", "2")), "[]"]
+        async with TestClient(TestServer(create_app(CountingAdapter(), bot))) as client:
+            resp = await client.post(
+                "/api/messages/batch", data="\n".join(lines), headers={"Content-Type": "application/x-ndjson"}
+            )
+            data = await resp.json()
+
+        assert [result["status"] for result in data["results"]] == ["processed", "invalid", "processed", "invalid"]
+        assert bot.texts == ["one", "two"]
+
+    @pytest.mark.asyncio
+    async def test_duplicates_and_unauthorized(self):
+        """Test per-activity duplicate and unauthorized statuses"""
+        async with TestClient(TestServer(create_app(CountingAdapter(), RecordingBot()))) as client:
+            resp = await client.post("/api/messages/batch", json=[make_activity("x", "dup"), make_activity("x", "dup")])
+            statuses = [result["status"] for result in (await resp.json())["results"]]
+            assert statuses == ["processed", "duplicate"]
+
+        adapter = CountingAdapter("app-id", "app-password")
+        async with TestClient(TestServer(create_app(adapter, RecordingBot()))) as client:
+            resp = await client.post("/api/messages/batch", json=[make_activity("x", "1"), make_activity("y", "2")])
+            data = await resp.json()
+            assert data["summary"] == {"unauthorized": 2}
+            assert adapter.auth_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_batches_are_rate_limited(self):
+        """Test that each batched activity spends the sender's tokens, as a single POST does"""
+        bot = RecordingBot()
+        limiter = RateLimiter(MemoryBucketBackend(), {"user": (0.01, 2)}, action=DROP)
+        batch = [make_activity(f"m{n}", str(n)) for n in range(4)]
+        async with TestClient(TestServer(create_app(CountingAdapter(), bot, rate_limiter=limiter))) as client:
+            data = await (await client.post("/api/messages/batch", json=batch)).json()
+
+        assert [result["status"] for result in data["results"]] == ["processed", "processed"] + ["rate_limited"] * 2
+        assert data["results"][2]["error"] == "Over the user rate limit"
+        assert bot.texts == ["m0", "m1"]
+
+    @pytest.mark.asyncio
+    async def test_body_size_is_capped_before_reading(self, monkeypatch):
+        """Test 413 for a declared or streamed body over BOT_BATCH_MAX_BYTES"""
+        monkeypatch.setattr("aio_app.BATCH_MAX_BYTES", 2048)
+        bot = RecordingBot()
+        batch = [make_activity("x" * 100, str(n)) for n in range(20)]
+        async with TestClient(TestServer(create_app(CountingAdapter(), bot))) as client:
+            assert (await client.post("/api/messages/batch", json=batch)).status == 413
+
+            async def chunked():
+                # No Content-Length, so the cap applies while reading
+                for activity in batch:
+                    yield (json.dumps(activity) + "\n").encode()
+
+            resp = await client.post(
+                "/api/messages/batch", data=chunked(), headers={"Content-Type": "application/x-ndjson"}
+            )
+            assert resp.status == 413
+            assert (await client.post("/api/messages/batch", json=batch[:2])).status == 200
+        assert bot.texts == ["x" * 100] * 2
+
+    @pytest.mark.asyncio
+    async def test_rejected_bodies(self):
+        """Test content type, malformed and oversized batches"""
+        async with TestClient(TestServer(create_app(CountingAdapter(), RecordingBot()))) as client:
+            assert (await client.post("/api/messages/batch", data="[]", headers={"Content-Type": "text/plain"})).status == 415
+            assert (await client.post("/api/messages/batch", json={"type": "message"})).status == 400
+            assert (await client.post("/api/messages/batch", json=[])).status == 400
+            oversized = [make_activity("x", str(n)) for n in range(501)]
+            assert (await client.post("/api/messages/batch", json=oversized)).status == 413
+
+    def test_parse_batch(self):
+        """Test the body parser directly"""
+        assert parse_batch(b'[{"type": "message"}]', "application/json") == [{"type": "message"}]
+        with pytest.raises(BatchTooLargeError):
+            parse_batch('{"a": 1}\n{"a": 2}\n', "application/x-ndjson", max_activities=1)
+        with pytest.raises(BatchError):
+            parse_batch(b"\xff", "application/json")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
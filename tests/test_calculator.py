@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test module for the calculator engine
+"""
+
+import time
+import pytest
+from calculator import (
+    MAX_EXPRESSION_LENGTH,
+    CalculatorError,
+    cache_info,
+    evaluate,
+    evaluate_batch,
+    format_batch,
+    format_result,
+    is_math_expression,
+    normalize_expression,
+)
+
+
+class TestCalculator:
+    """Test cases for the compiled calculator"""
+
+    @pytest.mark.parametrize("expression, expected", [
+        ("5 + 3", "8"),
+        ("2 + 3 * 4", "14"),
+        ("2^3 + sqrt(16)", "12"),
+        ("sqrt(16)", "4"),
+        ("log(100)", "2"),
+        ("ln(e)", "1"),
+        ("sin(45 * pi / 180)", "0.7071067812"),
+        ("10 / 4", "2.5"),
+        ("-2^2", "-4"),
+        ("abs(-3) + round(2.6)", "6"),
+    ])
+    def test_expressions(self, expression, expected):
+        """Test the results the bot shows for common inputs"""
+        assert format_result(evaluate(expression)) == expected
+
+    @pytest.mark.parametrize("expression", [
+        "invalid_expression!@#",
+        "__import__('os')",
+        "().__class__",
+        "open('x')",
+        "[1, 2]",
+        "1/0",
+        "sqrt(-1)",
+        "x + 1",
+    ])
+    def test_rejected_expressions(self, expression):
+        """Test that unsafe or invalid input raises CalculatorError"""
+        with pytest.raises(CalculatorError):
+            evaluate(expression)
+
+    def test_limits_stop_expensive_expressions_quickly(self):
+        """Test that huge powers and factorials are refused without being computed"""
+        for expression in ["9^9^9", "10^100000", "factorial(10^6)", "+".join(["1"] * 300)]:
+            start = time.perf_counter()
+            with pytest.raises(CalculatorError):
+                evaluate(expression)
+            assert time.perf_counter() - start < 0.1
+
+    @pytest.mark.parametrize("expression", [
+        "-" * 3000 + "1",
+        "-" * 9000 + "1",
+        "[" + "-" * 3000 + "1]",
+        "mean(" + "-" * 9000 + "1)",
+    ])
+    def test_deep_or_long_expressions_are_refused(self, expression):
+        """Test that parser recursion and memory errors surface as CalculatorError"""
+        with pytest.raises(CalculatorError):
+            evaluate(expression)
+
+    def test_pasted_lists_may_be_long(self):
+        """Test that only list and statistics input gets the longer length limit"""
+        values = ", ".join(str(n % 97) for n in range(1500))
+        assert len(values) > MAX_EXPRESSION_LENGTH
+        assert evaluate(f"sum([{values}])") == sum(n % 97 for n in range(1500))
+        with pytest.raises(CalculatorError, match=f"limited to {MAX_EXPRESSION_LENGTH} characters"):
+            evaluate("1+" * 300 + "1")
+
+    def test_normalized_expressions_share_a_cache_entry(self):
+        """Test that spacing and operator spelling do not defeat the cache"""
+        assert normalize_expression(" 2 ^ 3  ×  4 ") == normalize_expression("2 ** 3 * 4")
+        evaluate("7 * 6 + 1")
+        hits = cache_info().hits
+        evaluate("7*6+1")
+        assert cache_info().hits == hits + 1
+
+    @pytest.mark.parametrize("expression, expected", [
+        ("mean(3, 5, 8, 13)", "7.25"),
+        ("sum(1..10000)", "50005000"),
+        ("sum(1 .. 10^5)", "5000050000"),
+        ("p95([12, 15, 20, 35, 80, 120])", "110"),
+        ("median([5, 1, 3, 2])", "2.5"),
+        ("percentile(1..4, 25)", "1.75"),
+        ("stdev([2, 4, 4, 4, 5, 5, 7, 9])", "2.138089935"),
+        ("sum([1, 2, 3] * 2 + 1)", "15"),
+        ("max(sqrt([4, 9]), 2)", "3"),
+        ("count(1..10, 20..30)", "21"),
+        ("sum(range(0, 1, 0.25))", "2.5"),
+        ("sum(-3..-1)", "-6"),
+    ])
+    def test_list_expressions(self, expression, expected):
+        """Test lists, ranges, element-wise operators and aggregates"""
+        assert format_result(evaluate(expression)) == expected
+
+    def test_list_limits(self):
+        """Test that huge ranges and unreduced lists are refused before using memory"""
+        for expression in ["[1, 2] * 3", "sum(1..10^9)", "sum(1..10^5 * 2 + (1..10^5))", "mean([])",
+                           "[1, 2] + [1, 2, 3]", "+".join(["count(1..10^5)"] * 11)]:
+            start = time.perf_counter()
+            with pytest.raises(CalculatorError):
+                evaluate(expression, time_limit=1)
+            assert time.perf_counter() - start < 0.5
+        # A pasted list counts as one term per number, up to its own limit
+        assert format_result(evaluate(f"sum([{', '.join(['1'] * 1000)}])")) == "1000"
+
+    def test_batch(self):
+        """Test that each line gets its own result, or its own error, in one reply"""
+        results = evaluate_batch("2 + 2\n\nmean(1..10)\n1/0\n")
+        assert [line for line, _ in results] == ["2 + 2", "mean(1..10)", "1/0"]
+        assert format_batch(results) == "2 + 2 = 4\nmean(1..10) = 5.5\n1/0 → ⚠️ Division by zero"
+        with pytest.raises(CalculatorError):
+            evaluate_batch("\n".join(["1"] * 21))
+
+    @pytest.mark.parametrize("text, expected", [
+        ("2 + 3 * 4", True),
+        ("sqrt(16)", True),
+        ("2^3", True),
+        ("42", False),
+        ("hello", False),
+        ("task add 2 + 2 things", False),
+        ("weather Sydney", False),
+    ])
+    def test_math_detection(self, text, expected):
+        """Test auto-detection of plain math messages"""
+        assert is_math_expression(text) is expected
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
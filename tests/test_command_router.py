@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test module for the command router
+"""
+
+import pytest
+from calculator import is_math_expression
+from command_router import CommandRouter
+
+
+def build_router():
+    router = CommandRouter()
+    router.category("Calculator", emoji="🧮")
+    router.category("Weather", emoji="🌤️")
+
+    class Bot:
+        def __init__(self):
+            self.calls = []
+
+        @router.command("calc", aliases=["calculate"], category="Calculator",
+                        usage="calc <expression>", summary="Evaluate an expression",
+                        examples=["calc 2^3 + sqrt(16)"])
+        async def handle_calc(self, turn_context, args):
+            self.calls.append(("calc", args))
+
+        @router.command("weather", category="Weather", usage="weather <city>",
+                        summary="Current conditions")
+        async def handle_weather(self, turn_context, args):
+            self.calls.append(("weather", args))
+
+        @router.command("secret", hidden=True)
+        async def handle_secret(self, turn_context, args):
+            self.calls.append(("secret", args))
+
+        @router.fallback(is_math_expression, name="math")
+        async def handle_math(self, turn_context, args):
+            self.calls.append(("math", args))
+
+        @router.default
+        async def handle_welcome(self, turn_context, args):
+            self.calls.append(("welcome", args))
+
+    return router, Bot()
+
+
+class TestCommandRouter:
+    """Test cases for CommandRouter"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("text, expected", [
+        ("calc 2 + 2", ("calc", "2 + 2")),
+        ("CALCULATE  5*3 ", ("calc", "5*3")),
+        ("weather Sydney", ("weather", "Sydney")),
+        ("calc\nmean(1..10)\n2 + 2", ("calc", "mean(1..10)\n2 + 2")),
+        ("calc\t5*3", ("calc", "5*3")),
+        ("secret", ("secret", "")),
+        ("2 + 3 * 4", ("math", "2 + 3 * 4")),
+        ("hello there", ("welcome", "hello there")),
+        ("", ("welcome", "")),
+        (None, ("welcome", "")),
+    ])
+    async def test_dispatch(self, text, expected):
+        """Test first-token lookup, aliases, the math fallback and the default"""
+        router, bot = build_router()
+        route = await router.dispatch(bot, None, text)
+        assert bot.calls == [expected]
+        assert route.name == {"welcome": "default"}.get(expected[0], expected[0])
+
+    def test_commands_take_precedence_over_fallbacks(self):
+        """Test that a registered command wins even when its text also looks like math"""
+        router, _ = build_router()
+        router.command("pi")(lambda turn_context, args: None)
+        assert router.resolve("pi * 2").name == "pi"
+
+    def test_duplicate_names_are_rejected(self):
+        """Test that an alias cannot shadow an existing command"""
+        router, _ = build_router()
+        with pytest.raises(ValueError):
+            router.command("forecast", aliases=["fc", "Weather"])(lambda turn_context, args: None)
+        # The refused command left none of its names behind
+        assert router.get("forecast") is None and router.get("fc") is None
+
+    def test_no_default(self):
+        """Test that resolve returns None when nothing handles the text"""
+        assert CommandRouter().resolve("anything") is None
+
+    def test_help_and_menu_are_generated(self):
+        """Test that help and menu list visible commands grouped by category"""
+        router, _ = build_router()
+        help_text = router.help_text()
+        assert "Command Guide" in help_text
+        assert "**🧮 CALCULATOR**" in help_text
+        assert "`calc <expression>` - Evaluate an expression" in help_text
+        assert "e.g. `calc 2^3 + sqrt(16)`" in help_text
+        assert help_text.index("CALCULATOR") < help_text.index("WEATHER")
+        assert "secret" not in help_text
+
+        menu = router.menu_text()
+        assert "🌤️ **WEATHER**: `weather`" in menu
+        assert "secret" not in menu
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
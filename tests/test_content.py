@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test module for the content corpora, per-user rotation and password generator
+"""
+
+import os
+import pytest
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
+from botbuilder.schema import Activity
+import bot_runtime
+from content import (
+    POLICIES,
+    ContentError,
+    Corpus,
+    PasswordGenerator,
+    Rotation,
+    parse_password_args,
+    password_reply,
+)
+from conversation_state import MemoryStateStorage, StateCache
+from tests.test_aio_app import make_activity
+
+
+class TestContent:
+    """Test cases for Corpus, Rotation and PasswordGenerator"""
+
+    @pytest.fixture
+    def corpus(self, tmp_path):
+        path = tmp_path / "sayings.txt"
+        path.write_bytes("first\r\n\nsecond — Ann\n  \nthird ✓\nfourth\nfifth".encode())
+        return Corpus(str(path))
+
+    def test_corpus(self, corpus, tmp_path):
+        """Test that the entries are the non-empty lines, decoded on access"""
+        assert [corpus[i] for i in range(len(corpus))] == ["first", "second — Ann", "third ✓", "fourth", "fifth"]
+        assert corpus[-1] == "fifth" and corpus.name == "sayings"
+        with pytest.raises(IndexError):
+            corpus[5]
+        (tmp_path / "empty.txt").write_text("\n\n")
+        with pytest.raises(ContentError):
+            Corpus(str(tmp_path / "empty.txt"))
+        shipped = Corpus(os.path.join(bot_runtime.CONTENT_DIR, "jokes.txt"))
+        assert len(shipped) > 20
+
+    def test_rotation_does_not_repeat(self, corpus):
+        """Test that each user sees every entry once per cycle, never twice in a row"""
+        rotation = Rotation(corpus)
+        orders = {}
+        for user in ("ann", "bob"):
+            state = {}
+            seen = [rotation.next(user, state) for _ in range(len(corpus) * 4)]
+            assert state == {"content.sayings": len(corpus) * 4}
+            for cycle in range(4):
+                assert sorted(seen[cycle * 5:(cycle + 1) * 5]) == sorted(corpus[i] for i in range(5))
+            assert all(a != b for a, b in zip(seen, seen[1:]))
+            orders[user] = seen
+        assert orders["ann"] != orders["bob"]
+        # Any worker continues the same order from the stored position
+        assert Rotation(corpus).next("ann", {"content.sayings": 7}) == orders["ann"][7]
+
+    def test_passwords(self):
+        """Test lengths, policies and the uniform use of the alphabet"""
+        generator = PasswordGenerator(buffer_size=64)
+        for name, policy in POLICIES.items():
+            password = generator.generate(policy=name)
+            assert len(password) == policy.default_length
+            assert all(any(c in chars for c in password) for chars in policy.classes)
+            assert set(password) <= set(policy.alphabet)
+        assert not set(generator.generate(100, "readable")) & set("0O1lI")
+
+        counts = {}
+        for c in generator.choices("abc", 30000):
+            counts[c] = counts.get(c, 0) + 1
+        assert all(9400 < n < 10600 for n in counts.values())
+
+        for length, policy in [(3, "strong"), (500, "strong"), (2, "pin")]:
+            with pytest.raises(ContentError):
+                generator.generate(length, policy)
+        assert parse_password_args("pin 8") == (8, "pin") and parse_password_args("") == (None, "strong")
+        with pytest.raises(ContentError):
+            parse_password_args("very long")
+        assert "Password Generated** (12 characters" in password_reply(generator, "12")
+
+    def test_forked_children_do_not_share_random_bytes(self):
+        """Test that a child refills the buffer instead of reusing its parent's bytes"""
+        generator = PasswordGenerator()
+        generator.generate()
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write_end, generator.generate(64, "hex").encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        child = os.read(read_end, 64).decode()
+        os.close(read_end)
+        os.close(write_end)
+        assert child != generator.generate(64, "hex")
+
+    def test_content_reply_keeps_the_position_in_user_state(self, monkeypatch):
+        """Test that jokes rotate through the user's state across turns"""
+        cache = StateCache(MemoryStateStorage(), flush_interval=0)
+        monkeypatch.setattr(bot_runtime, "_state_cache", cache)
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        replies = []
+        for _ in range(3):
+            context = TurnContext(adapter, Activity().deserialize(make_activity("joke")))
+            replies.append(bot_runtime.content_reply("jokes", context))
+            cache.user(context).save()
+        assert len(set(replies)) == 3 and all("joke" in reply.lower() for reply in replies)
+        assert cache.view("user/msteams/user-1")["content.jokes"] == 3
+        cache.close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test module for the conversation state cache and its storage backends
+"""
+
+import pytest
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
+from botbuilder.schema import Activity
+from conversation_state import (
+    STATE_CONFLICTS,
+    FileStateStorage,
+    MemoryStateStorage,
+    SqliteStateStorage,
+    StateCache,
+    StateConflictError,
+    StateMiddleware,
+    create_state_storage,
+)
+from tests.test_aio_app import make_activity
+
+
+class RecordingStorage(MemoryStateStorage):
+    """Memory storage that records which fields were read and written"""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = []
+        self.writes = []
+
+    def read(self, key, fields):
+        self.reads.extend(fields)
+        return super().read(key, fields)
+
+    def write(self, key, changes):
+        self.writes.append(sorted(changes))
+        return super().write(key, changes)
+
+
+class TestConversationState:
+    """Test cases for StateCache, StateView, StateMiddleware and the backends"""
+
+    @pytest.fixture(params=["memory", "sqlite", "file"])
+    def storage(self, request, tmp_path):
+        if request.param == "memory":
+            return MemoryStateStorage()
+        if request.param == "sqlite":
+            return SqliteStateStorage(str(tmp_path / "state.sqlite3"))
+        return FileStateStorage(str(tmp_path / "state"))
+
+    def test_backend_etags(self, storage):
+        """Test writes, deletes and ETag checks on every backend"""
+        assert storage.write("k", {"a": ("[1]", None, "e1"), "b": ('"x"', None, "e2")}) == []
+        assert storage.read("k", ["a", "b", "c"]) == {"a": ("[1]", "e1"), "b": ('"x"', "e2")}
+        # A stale ETag and a create over an existing field are refused; the rest is written
+        assert storage.write("k", {"a": ("[2]", "old", "e3"), "b": ('"y"', None, "e4"), "c": ("3", None, "e5")}) \
+            == ["a", "b"]
+        assert storage.etags("k", ["a", "b", "c"]) == {"a": "e1", "b": "e2", "c": "e5"}
+        assert storage.write("k", {"a": (None, "e1", None), "b": ('"z"', "*", "e6")}) == []
+        assert storage.read("k", ["a", "b"]) == {"b": ('"z"', "e6")}
+
+    def test_only_touched_and_changed_fields(self):
+        """Test lazy reads, in-place mutation tracking and writes of changed fields only"""
+        storage = RecordingStorage()
+        cache = StateCache(storage, flush_interval=0)
+        view = cache.view("user/msteams/u1")
+        view["tasks"] = ["a"]
+        view["profile"] = {"name": "Ann"}
+        view.save()
+        assert storage.writes == [["profile", "tasks"]]
+
+        storage.reads.clear()
+        view = cache.view("user/msteams/u1")
+        view.get("tasks").append("b")
+        assert view.get("profile") == {"name": "Ann"}
+        view.save()
+        assert storage.writes[-1] == ["tasks"]
+        # Served from the cache after an ETag check, never re-read from storage
+        assert storage.reads == []
+
+        view = cache.view("user/msteams/u1")
+        assert view["tasks"] == ["a", "b"]
+        view.save()
+        assert len(storage.writes) == 2
+        cache.close()
+
+    def test_write_behind_coalesces(self):
+        """Test that queued saves of a field reach storage once, as the latest value"""
+        storage = RecordingStorage()
+        cache = StateCache(storage, flush_interval=60)
+        for n in range(5):
+            view = cache.view("conversation/msteams/c1")
+            view["counter"] = view.get("counter", 0) + 1
+            view.save()
+        assert storage.writes == []
+        assert cache.flush() == {}
+        assert storage.writes == [["counter"]]
+        assert storage.read("conversation/msteams/c1", ["counter"])["counter"][0] == "5"
+        cache.close()
+
+    def test_concurrent_workers_do_not_overwrite(self, storage):
+        """Test two workers' caches over shared storage: the stale write is refused, not applied"""
+        first, second = StateCache(storage, flush_interval=60), StateCache(storage, flush_interval=0)
+        seed = first.view("k")
+        seed["poll"] = {"votes": 0}
+        seed["notes"] = []
+        seed.save()
+        first.flush()
+
+        a, b = first.view("k"), second.view("k")
+        a["poll"]["votes"] += 1
+        a.get("notes")
+        b["poll"]["votes"] += 10
+        b.get("notes").append("from b")
+        b.save()
+
+        conflicts = STATE_CONFLICTS.value()
+        a["notes"] = ["from a"]
+        a.save()
+        assert {key: sorted(fields) for key, fields in first.flush().items()} == {"k": ["notes", "poll"]}
+        assert STATE_CONFLICTS.value() == conflicts + 2
+        assert first.view("k")["poll"] == {"votes": 10}
+        assert first.view("k")["notes"] == ["from b"]
+
+        c = second.view("k")
+        c["poll"]["votes"] += 1
+        d = first.view("k")
+        d["poll"]["votes"] += 1
+        d.save()
+        first.flush()
+        with pytest.raises(StateConflictError):
+            c.save()
+        first.close()
+        second.close()
+
+    @pytest.mark.asyncio
+    async def test_middleware_saves_after_the_turn(self, tmp_path):
+        """Test that views opened during a turn are saved when the bot is done"""
+        cache = StateCache(create_state_storage(f"sqlite://{tmp_path}/state.sqlite3"), flush_interval=0)
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        context = TurnContext(adapter, Activity().deserialize(make_activity("remember this")))
+
+        async def logic():
+            assert cache.conversation(context) is cache.conversation(context)
+            cache.conversation(context)["last"] = context.activity.text
+            cache.user(context).setdefault("seen", 0)
+
+        await StateMiddleware().on_turn(context, logic)
+        assert cache.storage.read("conversation/msteams/conv-1", ["last"])["last"][0] == '"remember this"'
+        assert cache.storage.read("user/msteams/user-1", ["seen"])["seen"][0] == "0"
+        cache.close()
+
+        with pytest.raises(ValueError):
+            cache.view("k").get("../escape")
+        with pytest.raises(ValueError):
+            create_state_storage("redis://localhost")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
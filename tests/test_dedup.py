@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test module for activity de-duplication
+"""
+
+import threading
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from botbuilder.schema import Activity
+from aio_app import create_app
+from dedup import (
+    ActivityDeduplicator,
+    MemoryDedupBackend,
+    SqliteDedupBackend,
+    DEDUP_DUPLICATES,
+)
+from tests.test_aio_app import RecordingBot, make_activity
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDedup:
+    """Test cases for ActivityDeduplicator and its backends"""
+
+    def test_memory_backend_ttl(self):
+        """Test that entries expire after the TTL"""
+        clock = FakeClock()
+        backend = MemoryDedupBackend(max_entries=10, clock=clock)
+
+        assert backend.add_if_absent("a", ttl=60)
+        assert not backend.add_if_absent("a", ttl=60)
+        clock.now += 61
+        assert backend.add_if_absent("a", ttl=60)
+
+    def test_memory_backend_is_bounded(self):
+        """Test that the least recently used key is evicted at capacity"""
+        backend = MemoryDedupBackend(max_entries=3)
+        for key in ["a", "b", "c", "d"]:
+            backend.add_if_absent(key, ttl=60)
+
+        assert len(backend) == 3
+        assert backend.add_if_absent("a", ttl=60)
+
+    def test_sqlite_backend_is_shared(self, tmp_path):
+        """Test that two workers pointing at the same file see each other's keys"""
+        path = str(tmp_path / "dedup.sqlite3")
+        worker_a = SqliteDedupBackend(path)
+        worker_b = SqliteDedupBackend(path)
+
+        assert worker_a.add_if_absent("conv:1", ttl=60)
+        assert not worker_b.add_if_absent("conv:1", ttl=60)
+        worker_b.discard("conv:1")
+        assert worker_a.add_if_absent("conv:1", ttl=60)
+
+    def test_key_uses_conversation_and_activity_id(self):
+        """Test that the same activity id in another conversation is not a duplicate"""
+        dedup = ActivityDeduplicator(MemoryDedupBackend())
+        first = Activity().deserialize(make_activity("hi", "42"))
+        other = Activity().deserialize({**make_activity("hi", "42"), "conversation": {"id": "conv-2"}})
+        no_id = Activity().deserialize({**make_activity("hi"), "id": None})
+
+        assert not dedup.is_duplicate(first)
+        assert dedup.is_duplicate(first)
+        assert not dedup.is_duplicate(other)
+        assert not dedup.is_duplicate(no_id)
+        assert not dedup.is_duplicate(no_id)
+
+    @pytest.mark.asyncio
+    async def test_endpoint_short_circuits_redelivery(self):
+        """Test that a redelivered activity is acknowledged without a second turn"""
+        bot = RecordingBot()
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        app = create_app(adapter, bot, deduplicator=ActivityDeduplicator(MemoryDedupBackend()))
+        duplicates_before = DEDUP_DUPLICATES.value(type="message")
+
+        async with TestClient(TestServer(app)) as client:
+            for _ in range(3):
+                resp = await client.post("/api/messages", json=make_activity("task add Buy milk", "7"))
+                assert resp.status == 202
+
+        assert bot.texts == ["task add Buy milk"]
+        assert DEDUP_DUPLICATES.value(type="message") - duplicates_before == 2
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("ack_mode", ["sync", "queue"])
+    async def test_unauthenticated_requests_are_not_recorded(self, ack_mode):
+        """Test that a request failing auth cannot mark its activity as already seen"""
+        backend = MemoryDedupBackend()
+        recorded_during_auth = []
+
+        class RejectingAdapter(BotFrameworkAdapter):
+            async def _authenticate_request(self, request, auth_header):
+                recorded_during_auth.append(len(backend))
+                raise PermissionError("Unauthorized Access. Request is not authorized")
+
+        adapter = RejectingAdapter(BotFrameworkAdapterSettings("app-id", "app-password"))
+        app = create_app(adapter, RecordingBot(), ack_mode=ack_mode, deduplicator=ActivityDeduplicator(backend))
+
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post("/api/messages", json=make_activity("task add Buy milk", "7"))
+            assert resp.status != 202
+
+        assert recorded_during_auth == [0]
+        assert len(backend) == 0
+
+    @pytest.mark.asyncio
+    async def test_sqlite_backend_runs_off_the_event_loop(self, tmp_path, monkeypatch):
+        """Test that async callers record and forget through the executor"""
+        dedup = ActivityDeduplicator(SqliteDedupBackend(str(tmp_path / "dedup.sqlite3")))
+        activity = Activity().deserialize(make_activity("hi", "42"))
+        threads = []
+        add_if_absent = dedup.backend.add_if_absent
+        monkeypatch.setattr(
+            dedup.backend, "add_if_absent",
+            lambda *args: threads.append(threading.current_thread()) or add_if_absent(*args)
+        )
+
+        assert not await dedup.is_duplicate_async(activity)
+        assert await dedup.is_duplicate_async(activity)
+        await dedup.forget_async(activity)
+        assert not await dedup.is_duplicate_async(activity)
+        assert threading.main_thread() not in threads
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test module for the /api/messages fast ingestion path
+"""
+
+import json
+import os
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from botbuilder.schema import Activity
+import fast_ingest
+from aio_app import create_app
+from dedup import ActivityDeduplicator, MemoryDedupBackend
+from fast_ingest import (
+    ACTIVITIES_MATERIALIZED,
+    BodyTooLargeError,
+    IngestError,
+    LazyActivity,
+    check_content_length,
+    materialize,
+    parse_activity,
+)
+from rate_limit import DROP, MemoryBucketBackend, RateLimiter
+from tests.test_aio_app import RecordingBot, make_activity
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "payloads")
+
+
+def sample(name):
+    with open(os.path.join(PAYLOADS, name), "rb") as f:
+        return f.read()
+
+
+class TestFastIngest:
+    """Test cases for parse_activity, LazyActivity and the endpoint wiring"""
+
+    def test_routing_fields_come_from_the_body(self):
+        """Test that routing, de-duplication and rate limiting never build the full Activity"""
+        activity = parse_activity(sample("channel_message.json"))
+        assert isinstance(activity, LazyActivity)
+        assert (activity.type, activity.id, activity.channel_id) == ("message", "1759457691201", "msteams")
+        assert activity.text.startswith("<at>Productivity Bot</at> calc")
+        assert activity.service_url == "https://smba.trafficmanager.net/amer/"
+        assert activity.from_property.aad_object_id == "9a1b6d0c-3bbe-4d53-a9c1-5b3f3f2c8a11"
+        assert activity.conversation.conversation_type == "channel"
+        assert activity.recipient.role is None
+        assert ActivityDeduplicator.key_for(activity).endswith(":1759457691201")
+        assert RateLimiter.keys_for(activity)["tenant"] == "72f988bf-86f1-41af-91ab-2d7cd011db47"
+        assert not activity.materialized
+
+    @pytest.mark.parametrize("name", sorted(os.listdir(PAYLOADS)))
+    def test_materialized_activity_matches_deserialize(self, name):
+        """Test that the lazily built Activity is the one the old path built, for every sample"""
+        activity = parse_activity(sample(name))
+        expected = Activity().deserialize(json.loads(sample(name)))
+        assert not activity.materialized
+        # Any attribute beyond the routing fields builds the full Activity
+        assert activity.entities == expected.entities
+        assert activity.materialized
+        assert materialize(activity).serialize() == expected.serialize()
+        assert materialize(activity) is activity.activity
+        assert materialize(expected) is expected
+
+    def test_rejected_bodies(self, monkeypatch):
+        """Test the size limit, invalid JSON and the stdlib fallback"""
+        with pytest.raises(BodyTooLargeError):
+            check_content_length(300000, 262144)
+        check_content_length(None, 262144)
+        with pytest.raises(BodyTooLargeError):
+            parse_activity(b"{" + b" " * 100 + b"}", max_bytes=64)
+        for body in (b"", b"{", b"[]", b"{}", b"\xff\xfe"):
+            with pytest.raises(IngestError):
+                parse_activity(body)
+
+        monkeypatch.setattr(fast_ingest, "orjson", None)
+        assert parse_activity(sample("personal_message.json")).text == "task add Review the Q4 roadmap"
+
+    @pytest.mark.asyncio
+    async def test_endpoint(self, monkeypatch):
+        """Test 413/400 answers, and that redeliveries and dropped turns are never deserialized"""
+        monkeypatch.setattr("aio_app.MAX_BODY_BYTES", 4096)
+        bot = RecordingBot()
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        limiter = RateLimiter(MemoryBucketBackend(), {"user": (0.01, 2)}, action=DROP)
+        app = create_app(adapter, bot, deduplicator=ActivityDeduplicator(MemoryDedupBackend()), rate_limiter=limiter)
+        async with TestClient(TestServer(app)) as client:
+            oversized = make_activity("x" * 5000)
+            resp = await client.post("/api/messages", json=oversized)
+            assert resp.status == 413
+
+            async def chunked():
+                # No Content-Length, so the limit applies while reading
+                for _ in range(5):
+                    yield b" " * 1000
+                yield json.dumps(make_activity("hi")).encode()
+
+            resp = await client.post("/api/messages", data=chunked(), headers={"Content-Type": "application/json"})
+            assert resp.status == 413
+            resp = await client.post("/api/messages", data=b"{not json", headers={"Content-Type": "application/json"})
+            assert resp.status == 400
+
+            materialized = ACTIVITIES_MATERIALIZED.value()
+            for n in range(3):
+                resp = await client.post("/api/messages", json=make_activity("calc 1+1", "7"))
+                assert resp.status == 202
+            for n in range(3):
+                resp = await client.post("/api/messages", json=make_activity(f"calc {n}", f"8-{n}"))
+                assert resp.status == 202
+
+        assert bot.texts == ["calc 1+1", "calc 0"]
+        # Two redeliveries and two dropped turns never reached the adapter
+        assert ACTIVITIES_MATERIALIZED.value() - materialized == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
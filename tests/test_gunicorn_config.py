@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test module for gunicorn worker model selection and sizing
+"""
+
+import pytest
+import gunicorn_config
+from gunicorn_config import AIOHTTP_WORKER, SYNC_WORKER, THREAD_WORKER, cpu_count, parse_command_mix, resolve
+
+GB = 1024 * 1024 * 1024
+
+
+class TestGunicornConfig:
+    """Test cases for resolve() and the host measurements it uses"""
+
+    def test_worker_class_follows_the_command_mix(self):
+        """Test gthread for a waiting-heavy mix and sync for a CPU-bound one"""
+        options, reasons = resolve({}, cpus=4, memory=8 * GB)
+        assert (options["worker_class"], options["workers"], options["threads"]) == (THREAD_WORKER, 4, 5)
+        assert "worker_connections" not in options
+        assert "60%" in reasons["worker_class"]
+
+        options, _ = resolve({"BOT_COMMAND_MIX": "qr=3,calc=1"}, cpus=4, memory=8 * GB)
+        assert (options["worker_class"], options["workers"], options["threads"]) == (SYNC_WORKER, 9, 1)
+
+        options, _ = resolve({"BOT_COMMAND_MIX": "weather=1"}, cpus=2, memory=8 * GB)
+        assert options["threads"] == 20
+
+    def test_memory_caps_workers(self):
+        """Test that workers are limited to what fits in the available memory"""
+        env = {"BOT_COMMAND_MIX": "qr=1", "BOT_WORKER_MEMORY_MB": "200"}
+        options, reasons = resolve(env, cpus=8, memory=1 * GB)
+        assert options["workers"] == 3
+        assert "capped by memory" in reasons["workers"]
+        options, _ = resolve(env, cpus=8, memory=0)
+        assert options["workers"] == 1
+
+    def test_aiohttp_mode_and_overrides(self):
+        """Test the aiohttp worker, pinned values and inconsistent settings"""
+        options, _ = resolve({"BOT_SERVER_MODE": "aiohttp", "PORT": "9000"}, cpus=2, memory=8 * GB)
+        assert (options["worker_class"], options["workers"]) == (AIOHTTP_WORKER, 2)
+        assert options["worker_connections"] == 1000 and options["bind"] == "0.0.0.0:9000"
+
+        env = {"BOT_WORKER_CLASS": "sync", "BOT_WORKERS": "3", "BOT_WORKER_TIMEOUT": "60"}
+        options, reasons = resolve(env, cpus=16, memory=8 * GB)
+        assert (options["worker_class"], options["workers"], options["timeout"]) == (SYNC_WORKER, 3, 60)
+        assert reasons["workers"] == "BOT_WORKERS"
+
+        with pytest.raises(ValueError):
+            resolve({"BOT_SERVER_MODE": "aiohttp", "BOT_WORKER_CLASS": "gthread"}, cpus=1, memory=GB)
+        with pytest.raises(ValueError):
+            resolve({"BOT_WORKER_CLASS": "aiohttp"}, cpus=1, memory=GB)
+        with pytest.raises(ValueError):
+            parse_command_mix("calc=1,dance=2")
+
+    def test_cpu_count_respects_cgroup_quota(self, monkeypatch):
+        """Test that a container's CPU quota wins over the host's core count"""
+        files = {"/sys/fs/cgroup/cpu.max": "150000 100000"}
+        monkeypatch.setattr(gunicorn_config, "_read", files.get)
+        monkeypatch.setattr(gunicorn_config.os, "sched_getaffinity", lambda pid: set(range(16)))
+        assert cpu_count() == 2
+        files["/sys/fs/cgroup/cpu.max"] = "max 100000"
+        assert cpu_count() == 16
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test module for the queue-based structured logging pipeline
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import pytest
+import logging_setup
+from logging_setup import (
+    configure_logging,
+    shutdown_logging,
+    new_correlation_id,
+    parse_sample_rates,
+    SamplingFilter,
+)
+
+
+class TestLoggingSetup:
+    """Test cases for configure_logging and its filters"""
+
+    @pytest.fixture
+    def log_file(self, tmp_path):
+        path = tmp_path / "bot.log"
+        yield path
+        shutdown_logging()
+
+    def read_lines(self, path):
+        shutdown_logging()  # flush the listener queue
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    def test_json_lines_carry_correlation_id(self, log_file):
+        """Test that records are written as JSON with the request correlation id"""
+        configure_logging(level="INFO", log_file=str(log_file), log_format="json", sample_rates={})
+        new_correlation_id("req-123")
+        logging.getLogger("test").info("turn for %s", "user-1", extra={"command": "calc"})
+        logging.getLogger("test").debug("not written at INFO")
+
+        lines = self.read_lines(log_file)
+        assert len(lines) == 1
+        assert lines[0]["msg"] == "turn for user-1"
+        assert lines[0]["correlation_id"] == "req-123"
+        assert lines[0]["command"] == "calc"
+
+    def test_file_is_rotated_by_size(self, log_file):
+        """Test that a per-process log file does not grow past max_bytes"""
+        template = str(log_file.parent / "bot-{pid}.log")
+        configure_logging(level="INFO", log_file=template, max_bytes=2000, backup_count=2, sample_rates={})
+        for i in range(200):
+            logging.getLogger("test").info("line %d", i)
+        shutdown_logging()
+
+        path = log_file.parent / f"bot-{os.getpid()}.log"
+        assert path.stat().st_size <= 2000
+        assert (log_file.parent / f"bot-{os.getpid()}.log.1").exists()
+
+    def test_forked_workers_do_not_share_a_rotated_file(self, log_file):
+        """Test that a forked child logs to its own file, and a fixed file is left to external rotation"""
+        configure_logging(level="INFO", log_file=str(log_file), sample_rates={})
+        assert isinstance(logging_setup._listener.handlers[-1], logging.handlers.WatchedFileHandler)
+
+        template = str(log_file.parent / "bot-{pid}.log")
+        configure_logging(level="INFO", log_file=template, sample_rates={})
+        pid = os.fork()
+        if pid == 0:
+            logging.getLogger("test").info("from the worker")
+            shutdown_logging()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        logging.getLogger("test").info("from the master")
+
+        assert [line["msg"] for line in self.read_lines(log_file.parent / f"bot-{pid}.log")] == ["from the worker"]
+        assert [line["msg"] for line in self.read_lines(log_file.parent / f"bot-{os.getpid()}.log")] == [
+            "from the master"
+        ]
+
+    def test_sampling_is_decided_per_request(self):
+        """Test that a sampled request keeps all lines and warnings are never dropped"""
+        sampler = SamplingFilter(parse_sample_rates("INFO=0.5"))
+        kept = 0
+        for i in range(200):
+            records = [logging.makeLogRecord({"levelno": logging.INFO, "correlation_id": f"req-{i}"})
+                       for _ in range(3)]
+            decisions = {sampler.filter(record) for record in records}
+            assert len(decisions) == 1
+            kept += decisions.pop()
+        assert 50 < kept < 150
+
+        warning = logging.makeLogRecord({"levelno": logging.WARNING, "correlation_id": "req-x"})
+        assert SamplingFilter({"WARNING": 0.0}).filter(warning)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Test module for metrics export and multiprocess aggregation
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+import bot_runtime
+from aio_app import create_app
+from command_router import COMMAND_LATENCY, CommandRouter
+from metrics import LoopLagMonitor, MetricsRegistry, MultiprocessDirectory, render_prometheus
+from tests.test_aio_app import RecordingBot
+
+
+def build_registry():
+    registry = MetricsRegistry()
+    return (
+        registry,
+        registry.counter("jobs_total", "Jobs done"),
+        registry.gauge("busy", "Busy workers", multiprocess_mode="max"),
+        registry.histogram("job_seconds", "Job latency", buckets=(0.1, 1.0)),
+    )
+
+
+def worker(path, jobs, busy, done):
+    """A forked 'gunicorn worker' that records into its own registry and publishes it"""
+    registry, counter, gauge, _ = build_registry()
+    counter.inc(jobs, kind="a")
+    gauge.set(busy)
+    MultiprocessDirectory(path, registry=registry).publish()
+    if done is not None:
+        done.wait(10)
+
+
+class TestMetrics:
+    """Test cases for render_prometheus, MultiprocessDirectory and LoopLagMonitor"""
+
+    def test_render_prometheus(self):
+        """Test the text format, including cumulative histogram buckets and label escaping"""
+        registry, counter, gauge, histogram = build_registry()
+        counter.inc(3, kind='say "hi"')
+        gauge.set(2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        text = render_prometheus(registry.export())
+        assert "# TYPE jobs_total counter" in text
+        assert 'jobs_total{kind="say \\"hi\\""} 3' in text
+        assert "busy 2" in text
+        assert 'job_seconds_bucket{le="0.1"} 1' in text
+        assert 'job_seconds_bucket{le="1.0"} 2' in text
+        assert 'job_seconds_bucket{le="+Inf"} 3' in text
+        assert "job_seconds_count 3" in text
+        assert text.endswith("\n")
+
+    def test_workers_aggregate_and_exited_workers_are_archived(self, tmp_path):
+        """Test summed counters, max-combined gauges, and counts surviving a worker's exit"""
+        path = str(tmp_path)
+        context = multiprocessing.get_context("fork")
+        exited = context.Process(target=worker, args=(path, 4, 9, None))
+        exited.start()
+        exited.join()
+        done = context.Event()
+        live = context.Process(target=worker, args=(path, 2, 5, done))
+        live.start()
+        try:
+            deadline = time.time() + 10
+            while not os.path.exists(os.path.join(path, f"{live.pid}.json")) and time.time() < deadline:
+                time.sleep(0.01)
+
+            registry, counter, gauge, _ = build_registry()
+            counter.inc(1, kind="a")
+            gauge.set(3)
+            directory = MultiprocessDirectory(path, registry=registry)
+
+            for _ in range(2):
+                text = render_prometheus(directory.collect())
+                assert 'jobs_total{kind="a"} 7' in text
+                # The exited worker's gauge is gone; the live ones combine by max
+                assert "busy 5" in text
+            assert not os.path.exists(os.path.join(path, f"{exited.pid}.json"))
+            assert os.path.exists(os.path.join(path, MultiprocessDirectory.ARCHIVE))
+        finally:
+            done.set()
+            live.join()
+
+    @pytest.mark.asyncio
+    async def test_loop_lag(self):
+        """Test that a blocked loop shows up as lag"""
+        registry = MetricsRegistry()
+        monitor = LoopLagMonitor("test", interval=0.01, registry=registry).start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        assert monitor.histogram.count(loop="test") >= 2
+        assert monitor.histogram.samples()[(("loop", "test"),)]["sum"] >= 0.15
+        exposition = render_prometheus(registry.export())
+        assert 'bot_event_loop_lag_seconds_bucket{loop="test",le="0.25"}' in exposition
+        assert "bot_event_loop_last_lag_seconds{" in exposition
+
+    @pytest.mark.asyncio
+    async def test_metrics_endpoint_and_command_latency(self, monkeypatch, tmp_path):
+        """Test /metrics over the aiohttp app and per-command histograms"""
+        monkeypatch.setattr(bot_runtime, "_metrics_directory", MultiprocessDirectory(str(tmp_path)))
+        router = CommandRouter()
+
+        @router.command("calc")
+        async def handle_calc(turn_context, args):
+            pass
+
+        before = COMMAND_LATENCY.count(command="calc")
+        await router.dispatch(None, None, "calc 1+1")
+        assert COMMAND_LATENCY.count(command="calc") == before + 1
+
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        async with TestClient(TestServer(create_app(adapter, RecordingBot()))) as client:
+            await client.get("/")
+            resp = await client.get("/metrics")
+            assert resp.status == 200
+            assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            text = await resp.text()
+        assert 'bot_http_requests_total{method="GET",route="/",status="200"}' in text
+        assert 'bot_command_seconds_count{command="calc"}' in text
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
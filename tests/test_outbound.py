@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test module for the outbound reply pipeline
+"""
+
+import asyncio
+from email.utils import formatdate
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from botbuilder.core import BotFrameworkAdapterSettings, CardFactory, MessageFactory
+from botbuilder.schema import Activity, HeroCard
+from outbound import (
+    OUTBOUND_ACTIVITIES,
+    OUTBOUND_RETRIES,
+    ConnectorSender,
+    OutboundAdapter,
+    OutboundError,
+    parse_retry_after,
+)
+from tests.test_aio_app import make_activity
+
+
+class FakeConnector:
+    """Local Bot Connector that records posted activities and can answer with scripted errors"""
+
+    def __init__(self):
+        self.posts = []
+        self.ports = []
+        self.responses = []
+
+    async def handle(self, request):
+        self.ports.append(request.transport.get_extra_info("peername")[1])
+        if self.responses:
+            status, headers = self.responses.pop(0)
+            return web.Response(status=status, headers=headers, text="busy")
+        body = await request.json()
+        self.posts.append((request.path, body))
+        return web.json_response({"id": f"sent-{len(self.posts)}"})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/v3/conversations/{conversation}/activities", self.handle)
+        app.router.add_post("/v3/conversations/{conversation}/activities/{reply_to}", self.handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.url = str(self.server.make_url("/"))
+        self.sender = ConnectorSender(backoff_base=0.01, rng=lambda: 0.5)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.sender.close()
+        await self.server.close()
+
+    def activity(self, text="hello", activity_id="1"):
+        data = make_activity(text, activity_id)
+        data["serviceUrl"] = self.url
+        return Activity().deserialize(data)
+
+
+class TestOutbound:
+    """Test cases for ConnectorSender, Outbox and OutboundAdapter"""
+
+    @pytest.mark.asyncio
+    async def test_turn_replies_are_coalesced_in_order(self):
+        """Test that consecutive text replies merge and anything else keeps its place"""
+        async with FakeConnector() as connector:
+            adapter = OutboundAdapter(BotFrameworkAdapterSettings("", ""), connector.sender)
+            coalesced = OUTBOUND_ACTIVITIES.value(result="coalesced")
+
+            async def logic(turn_context):
+                for text in ("one", "two", "three"):
+                    await turn_context.send_activity(text)
+                await turn_context.send_activity(MessageFactory.attachment(CardFactory.hero_card(HeroCard(title="Card"))))
+                await turn_context.send_activity("four")
+
+            await adapter.process_activity(connector.activity(activity_id="in-1"), "", logic)
+
+            assert [body.get("text") for _, body in connector.posts] == ["one\n\ntwo\n\nthree", None, "four"]
+            assert connector.posts[1][1]["attachments"][0]["content"]["title"] == "Card"
+            assert {path for path, _ in connector.posts} == {"/v3/conversations/conv-1/activities/in-1"}
+            assert OUTBOUND_ACTIVITIES.value(result="coalesced") == coalesced + 2
+            # One pooled connection served the whole turn
+            assert len(set(connector.ports)) == 1
+
+    @pytest.mark.asyncio
+    async def test_window_flushes_during_a_long_turn(self):
+        """Test that a reply goes out after the window even while the turn is still busy"""
+        async with FakeConnector() as connector:
+            adapter = OutboundAdapter(BotFrameworkAdapterSettings("", ""), connector.sender, window=0.01)
+            seen_mid_turn = []
+
+            async def logic(turn_context):
+                await turn_context.send_activity("working on it")
+                await asyncio.sleep(0.2)
+                seen_mid_turn.append(len(connector.posts))
+                await turn_context.send_activity("done")
+
+            await adapter.process_activity(connector.activity(), "", logic)
+            assert seen_mid_turn == [1]
+            assert [body["text"] for _, body in connector.posts] == ["working on it", "done"]
+
+    @pytest.mark.asyncio
+    async def test_connection_reused_across_event_loops(self):
+        """Test that turns on separate loops, as in the Flask sync mode, share the pool"""
+        async with FakeConnector() as connector:
+            await connector.sender.send(connector.activity("first"))
+            await asyncio.to_thread(asyncio.run, connector.sender.send(connector.activity("second")))
+            assert len(connector.posts) == 2
+            assert len(set(connector.ports)) == 1
+
+    @pytest.mark.asyncio
+    async def test_retries_honour_retry_after(self):
+        """Test that 429 and 5xx are retried and other errors are not"""
+        async with FakeConnector() as connector:
+            retries = OUTBOUND_RETRIES.value(reason="429")
+            connector.responses = [(429, {"Retry-After": "0"}), (503, {})]
+            response = await connector.sender.send(connector.activity())
+            assert response.id == "sent-1"
+            assert OUTBOUND_RETRIES.value(reason="429") == retries + 1
+
+            connector.responses = [(400, {})]
+            with pytest.raises(OutboundError) as exc_info:
+                await connector.sender.send(connector.activity())
+            assert exc_info.value.status == 400
+
+            # Asked to come back later than we are willing to wait
+            connector.responses = [(429, {"Retry-After": "3600"})]
+            with pytest.raises(OutboundError):
+                await connector.sender.send(connector.activity())
+            assert len(connector.posts) == 1 and not connector.responses
+
+    @pytest.mark.asyncio
+    async def test_failed_delivery_fails_the_turn(self):
+        """Test that a buffered reply the connector rejects surfaces when the turn ends"""
+        async with FakeConnector() as connector:
+            connector.responses = [(403, {})]
+            adapter = OutboundAdapter(BotFrameworkAdapterSettings("", ""), connector.sender)
+
+            async def logic(turn_context):
+                await turn_context.send_activity("not allowed")
+
+            with pytest.raises(OutboundError):
+                await adapter.process_activity(connector.activity(), "", logic)
+
+    def test_parse_retry_after(self):
+        """Test delta-seconds, HTTP dates and junk"""
+        assert parse_retry_after("2") == 2.0
+        assert parse_retry_after("-1") == 0.0
+        assert 55 < parse_retry_after(formatdate(1060, usegmt=True), now=lambda: 1000) <= 60
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+    def test_backoff(self):
+        """Test jittered exponential backoff"""
+        sender = ConnectorSender(backoff_base=1, backoff_max=4, max_retry_after=10, rng=lambda: 1.0)
+        assert [sender.backoff(attempt) for attempt in range(4)] == [1, 2, 4, 4]
+        assert sender.backoff(0, retry_after=3) == 4
+        assert sender.backoff(0, retry_after=11) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test module for poll storage, vote aggregation and card updates
+"""
+
+import multiprocessing
+import pytest
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
+from botbuilder.schema import Activity, ResourceResponse
+from polls import (
+    ACCEPTED,
+    CLOSED,
+    INVALID,
+    UNKNOWN,
+    CardUpdater,
+    PollAggregator,
+    PollEngine,
+    PollError,
+    SqlitePollStore,
+    handle_poll_action,
+    parse_poll,
+    post_poll,
+    render_card,
+)
+from tests.test_aio_app import make_activity
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingUpdater:
+    """Card updater that records which poll versions it rendered"""
+
+    def __init__(self):
+        self.rendered = []
+
+    async def __call__(self, poll, counts):
+        self.rendered.append((poll.id, poll.version, counts))
+
+
+class RecordingAdapter(BotFrameworkAdapter):
+    """Adapter that records sent and updated activities instead of calling the Bot Connector"""
+
+    def __init__(self):
+        super().__init__(BotFrameworkAdapterSettings("", ""))
+        self.sent = []
+        self.updated = []
+
+    async def send_activities(self, context, activities):
+        self.sent.extend(activities)
+        return [ResourceResponse(id=f"card-{len(self.sent)}") for _ in activities]
+
+    async def update_activity(self, context, activity):
+        self.updated.append(activity)
+
+
+def _vote_in_worker(path, poll_id, worker, voters):
+    engine = PollEngine(SqlitePollStore(path), shards=4, batch_size=50)
+    for n in range(voters):
+        engine.vote(poll_id, f"w{worker}-u{n}", n % 3)
+    engine.flush()
+
+
+class TestPolls:
+    """Test cases for PollEngine, SqlitePollStore, PollAggregator and the poll card"""
+
+    @pytest.fixture
+    def clock(self):
+        return Clock()
+
+    @pytest.fixture
+    def engine(self, tmp_path, clock):
+        return PollEngine(SqlitePollStore(str(tmp_path / "polls.sqlite3")), shards=4, flush_interval=60, clock=clock)
+
+    def test_parse_poll(self):
+        """Test the plain and quoted forms and the option limits"""
+        assert parse_poll("Lunch? Pizza, Sushi , Tacos") == ("Lunch?", ["Pizza", "Sushi", "Tacos"])
+        assert parse_poll('"Ship it, today?" "Yes, now" "No"') == ("Ship it, today?", ["Yes, now", "No"])
+        for text in ("Lunch? Pizza", "Lunch? a, A", "Lunch? " + ",".join("abcdefghijk"), '"Lunch? Pizza'):
+            with pytest.raises(PollError):
+                parse_poll(text)
+
+    def test_votes_are_counted_once_per_user(self, engine):
+        """Test batched votes, changed votes and refused votes"""
+        poll = engine.create("conv-1", "Lunch?", ["Pizza", "Sushi"], "user-1")
+        assert engine.vote(poll.id, "a", 0) == ACCEPTED
+        assert engine.vote(poll.id, "b", 0) == ACCEPTED
+        assert engine.vote(poll.id, "b", 0) == ACCEPTED
+        assert engine.store.counts(poll.id, 2) == [0, 0]
+        engine.flush()
+        assert engine.store.counts(poll.id, 2) == [2, 0]
+        assert engine.vote(poll.id, "a", 1) == ACCEPTED
+        engine.flush()
+        assert engine.store.counts(poll.id, 2) == [1, 1]
+        assert engine.vote(poll.id, "a", 5) == INVALID
+        assert engine.vote("nope", "a", 0) == UNKNOWN
+
+    def test_open_polls_are_bounded(self, engine):
+        """Test that the worker's map of open polls keeps only the most recently voted ones"""
+        engine.max_open = 2
+        polls = [engine.create("conv-1", f"Q{n}?", ["a", "b"], "user-1") for n in range(3)]
+        for poll in polls[:2]:
+            engine.vote(poll.id, "a", 0)
+        engine.vote(polls[0].id, "b", 0)
+        engine.vote(polls[2].id, "a", 0)
+        assert list(engine._open) == [polls[0].id, polls[2].id]
+        assert engine.vote(polls[1].id, "b", 1) == ACCEPTED
+        engine.flush()
+        assert engine.store.counts(polls[1].id, 2) == [1, 1]
+
+    def test_workers_do_not_lose_votes(self, tmp_path):
+        """Test votes from several processes on the same poll file"""
+        path = str(tmp_path / "polls.sqlite3")
+        poll = PollEngine(SqlitePollStore(path)).create("conv-1", "Lunch?", ["a", "b", "c"], "user-1")
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=_vote_in_worker, args=(path, poll.id, w, 300)) for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+        assert SqlitePollStore(path).counts(poll.id, 3) == [400, 400, 400]
+
+    @pytest.mark.asyncio
+    async def test_each_version_is_rendered_once(self, tmp_path, clock):
+        """Test that two workers' aggregators update a changed card once, and unchanged cards never"""
+        path = str(tmp_path / "polls.sqlite3")
+        first = PollEngine(SqlitePollStore(path), clock=clock)
+        second = PollEngine(SqlitePollStore(path), clock=clock)
+        updates = RecordingUpdater()
+        aggregators = [PollAggregator(first, updates), PollAggregator(second, updates)]
+
+        poll = first.create("conv-1", "Lunch?", ["Pizza", "Sushi"], "user-1")
+        first.store.set_message(poll.id, "card-1", {})
+        for n in range(20):
+            (first if n % 2 else second).vote(poll.id, f"u{n}", n % 2)
+        first.flush()
+        second.flush()
+        assert [await aggregator.aggregate() for aggregator in aggregators] == [1, 0]
+        assert updates.rendered == [(poll.id, 3, [10, 10])]
+        assert [await aggregator.aggregate() for aggregator in aggregators] == [0, 0]
+
+    @pytest.mark.asyncio
+    async def test_close_and_expiry(self, engine, clock):
+        """Test closing by the creator only, expiry, and the final card"""
+        updates = RecordingUpdater()
+        aggregator = PollAggregator(engine, updates)
+        poll = engine.create("conv-1", "Lunch?", ["Pizza", "Sushi"], "user-1", duration=60)
+        engine.store.set_message(poll.id, "card-1", {})
+        engine.vote(poll.id, "a", 1)
+        with pytest.raises(PollError):
+            engine.close(poll.id, "a")
+        assert engine.close(poll.id, "user-1")
+        assert poll.id not in engine._open
+        assert engine.vote(poll.id, "b", 0) == CLOSED
+        await aggregator.aggregate()
+        final = engine.store.get(poll.id)
+        assert updates.rendered[-1][2] == [0, 1]
+        assert "actions" not in render_card(final, [0, 1], clock.now)
+
+        later = engine.create("conv-1", "Dinner?", ["Soup", "Salad"], "user-1", duration=60)
+        engine.store.set_message(later.id, "card-2", {})
+        assert "actions" in render_card(later, [0, 0], clock.now)
+        engine.vote(later.id, "a", 0)
+        clock.now += 61
+        assert engine.vote(later.id, "b", 0) == CLOSED
+        assert later.id not in engine._open
+        await aggregator.aggregate()
+        assert engine.store.get(later.id).closed_at == later.expires_at
+        assert updates.rendered[-1] == (later.id, 3, [1, 0])
+
+    @pytest.mark.asyncio
+    async def test_card_posted_and_updated_in_place(self, engine):
+        """Test the poll command, a button press and the in-place update through the adapter"""
+        adapter = RecordingAdapter()
+        context = TurnContext(adapter, Activity().deserialize(make_activity("poll Lunch? Pizza, Sushi")))
+        poll = await post_poll(context, engine, "Lunch? Pizza, Sushi")
+        assert engine.store.get(poll.id).activity_id == "card-1"
+
+        press = make_activity("")
+        press["value"] = {"action": "poll_vote", "poll": poll.id, "option": 1}
+        assert await handle_poll_action(TurnContext(adapter, Activity().deserialize(press)), engine)
+        assert len(adapter.sent) == 1
+        assert await PollAggregator(engine, CardUpdater(adapter)).aggregate() == 1
+        updated = adapter.updated[0]
+        assert updated.id == "card-1" and updated.conversation.id == "conv-1"
+        assert "1 (100%)" in str(updated.attachments[0].content)
+
+        press["value"] = {"action": "poll_close", "poll": poll.id}
+        press["from"] = {"id": "someone-else"}
+        assert await handle_poll_action(TurnContext(adapter, Activity().deserialize(press)), engine)
+        assert "Only the person" in adapter.sent[-1].text
+        assert not await handle_poll_action(context, engine)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test module for opt-in request profiling
+"""
+
+import logging
+import pstats
+import time
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+import aio_app
+from logging_setup import new_correlation_id
+from profiling import CPROFILE, Profiler, span
+from tests.test_aio_app import RecordingBot, make_activity
+
+
+def slow_step():
+    time.sleep(0.05)
+
+
+class TestProfiling:
+    """Test cases for Profiler, its sessions and spans"""
+
+    def test_disabled_costs_nothing(self):
+        """Test that spans are a shared no-op and nothing is profiled when disabled"""
+        assert span("a") is span("b")
+        profiler = Profiler(enabled=False, sample_every=1)
+        assert profiler.start("1", "calc 1+1") is None
+
+    def test_triggers(self):
+        """Test the header secret, command and 1-in-N triggers"""
+        profiler = Profiler(enabled=True, sample_every=3, secret="s3cret", commands=["calc", "QR"])
+        assert profiler.trigger_for(header_value="s3cret") == "header"
+        assert profiler.trigger_for(text="qr https://example.com") == "command"
+        assert [profiler.trigger_for(text="weather Paris") for _ in range(6)] == [None, None, "sample"] * 2
+        assert profiler.trigger_for(header_value="s3cre") is None
+        # Without a secret the header never triggers
+        assert Profiler(enabled=True).trigger_for(header_value="1") is None
+
+    def test_sampler_writes_collapsed_stacks(self, tmp_path):
+        """Test that a profiled block yields a flamegraph-ready file and its spans"""
+        profiler = Profiler(enabled=True, secret="1", directory=str(tmp_path), interval=0.002)
+        new_correlation_id("../corr 1")
+        session = profiler.start(header_value="1")
+        # Only one request per worker is profiled at a time
+        assert profiler.start(header_value="1") is None
+        with span("step"):
+            slow_step()
+        path = session.finish()
+
+        assert path.startswith(str(tmp_path)) and path.endswith("-___corr_1.collapsed")
+        lines = open(path).read().splitlines()
+        assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+        assert any("slow_step (test_profiling.py" in line for line in lines)
+        assert [item["name"] for item in session.trace.summary()] == ["step"]
+        assert session.trace.summary()[0]["duration_ms"] >= 45
+        assert span("after") is span("other")
+        assert profiler.start(header_value="1") is not None
+
+    def test_cprofile_mode(self, tmp_path):
+        """Test the cProfile alternative"""
+        profiler = Profiler(enabled=True, secret="1", directory=str(tmp_path), mode=CPROFILE)
+        with profiler.profile(header_value="1") as trace:
+            slow_step()
+        assert trace is not None
+        dump = next(tmp_path.glob("*.prof"))
+        assert any(func[2] == "slow_step" for func in pstats.Stats(str(dump)).stats)
+
+    @pytest.mark.asyncio
+    async def test_endpoint_spans(self, monkeypatch, tmp_path, caplog):
+        """Test that a request with the header is profiled with the message-path spans"""
+        monkeypatch.setattr(aio_app, "PROFILER", Profiler(enabled=True, secret="1", directory=str(tmp_path)))
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        with caplog.at_level(logging.INFO, logger="profiling"):
+            async with TestClient(TestServer(aio_app.create_app(adapter, RecordingBot()))) as client:
+                resp = await client.post(
+                    "/api/messages", json=make_activity("hello"),
+                    headers={"X-Bot-Profile": "1", "X-Correlation-ID": "profiled-turn"},
+                )
+                assert resp.status == 202
+                await client.post("/api/messages", json=make_activity("not profiled", "2"))
+
+        records = [record for record in caplog.records if record.getMessage() == "Profiled request"]
+        assert len(records) == 1
+        assert [item["name"] for item in records[0].spans] == ["auth", "deserialize", "turn"]
+        assert list(tmp_path.glob("*-profiled-turn.collapsed"))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
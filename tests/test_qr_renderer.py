@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test module for the QR renderer
+"""
+
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+import bot_runtime
+from aio_app import create_app
+from qr_renderer import QR_LOOKUPS, ByteLRUCache, PngDirectory, QrError, QrRenderer, qr_key, render_png
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class TestQrRenderer:
+    """Test cases for QrRenderer and its caches"""
+
+    @pytest.mark.asyncio
+    async def test_render_is_cached_by_content(self):
+        """Test that identical requests render once and different options get their own key"""
+        renderer = QrRenderer()
+        try:
+            hits = QR_LOOKUPS.value(result="hit")
+            key = await renderer.render("https://example.com")
+            assert renderer.get(key).startswith(PNG_SIGNATURE)
+            assert await renderer.render("https://example.com") == key
+            assert QR_LOOKUPS.value(result="hit") == hits + 1
+            assert await renderer.render("https://example.com", error_correction="h") != key
+            assert key == qr_key("https://example.com")
+        finally:
+            renderer.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_renders_are_coalesced(self):
+        """Test that simultaneous identical requests share one render"""
+        renderer = QrRenderer()
+        try:
+            misses = QR_LOOKUPS.value(result="miss")
+            keys = await asyncio.gather(*[renderer.render("same payload") for _ in range(10)])
+            assert len(set(keys)) == 1
+            assert QR_LOOKUPS.value(result="miss") == misses + 1
+        finally:
+            renderer.shutdown()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("payload, options", [
+        ("", {}),
+        ("x" * 3000, {}),
+        ("x" * 2332, {}),
+        ("x" * 2400, {"error_correction": "M"}),
+        ("x" * 1664, {"error_correction": "Q"}),
+        ("ok", {"error_correction": "Z"}),
+        ("ok", {"box_size": 0}),
+    ])
+    async def test_invalid_requests(self, payload, options):
+        """Test that empty, oversized or badly configured requests raise QrError"""
+        with pytest.raises(QrError):
+            await QrRenderer().render(payload, **options)
+
+    @pytest.mark.asyncio
+    async def test_payload_limit_follows_error_correction(self):
+        """Test the largest payload each level holds, and that a qrcode overflow surfaces as QrError"""
+        renderer = QrRenderer()
+        try:
+            assert await renderer.render("x" * 2331)
+            assert await renderer.render("x" * 2953, error_correction="L")
+        finally:
+            renderer.shutdown()
+        # qrcode's own overflow is reported with the level's limit, not as DataOverflowError
+        with pytest.raises(QrError, match="2331 bytes"):
+            render_png("x" * 2400, "M")
+
+    def test_lru_is_bounded_by_bytes(self):
+        """Test that the least recently used images are evicted once the byte budget is exceeded"""
+        cache = ByteLRUCache(max_bytes=100)
+        cache.put("a", b"x" * 40)
+        cache.put("b", b"x" * 40)
+        cache.get("a")
+        cache.put("c", b"x" * 40)
+        assert "a" in cache and "c" in cache and "b" not in cache
+        assert cache.total_bytes == 80
+        cache.put("huge", b"x" * 101)
+        assert "huge" not in cache
+
+    @pytest.mark.asyncio
+    async def test_directory_shares_images_between_workers(self, tmp_path):
+        """Test that an image rendered by one worker can be served by another"""
+        first = QrRenderer(directory=PngDirectory(str(tmp_path)))
+        second = QrRenderer(directory=PngDirectory(str(tmp_path)))
+        try:
+            key = await first.render("shared")
+            assert second.get(key) == first.get(key)
+            assert second.get("0" * 32) is None
+        finally:
+            first.shutdown()
+
+    def test_directory_prunes_oldest_files(self, tmp_path):
+        """Test that the directory is pruned back under its byte budget"""
+        directory = PngDirectory(str(tmp_path), max_bytes=100, prune_every=1)
+        for key in ("a" * 32, "b" * 32, "c" * 32):
+            directory.put(key, b"x" * 40)
+        assert directory.get("a" * 32) is None
+        assert directory.get("c" * 32) is not None
+
+    @pytest.mark.asyncio
+    async def test_qr_route(self, monkeypatch, tmp_path):
+        """Test that /qr/<key>.png serves cached images and 404s unknown keys"""
+        renderer = QrRenderer(directory=PngDirectory(str(tmp_path)))
+        monkeypatch.setattr(bot_runtime, "_qr_renderer", renderer)
+        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+        try:
+            key = await renderer.render("https://example.com/route")
+            async with TestClient(TestServer(create_app(adapter, None))) as client:
+                resp = await client.get(f"/qr/{key}.png")
+                assert resp.status == 200
+                assert resp.headers["Content-Type"] == "image/png"
+                assert (await resp.read()).startswith(PNG_SIGNATURE)
+
+                assert (await client.get(f"/qr/{'0' * 32}.png")).status == 404
+                assert (await client.get("/qr/not-a-key.png")).status == 404
+        finally:
+            renderer.shutdown()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test module for rate limiting and fair turn scheduling
+"""
+
+import asyncio
+import threading
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapterSettings
+from botbuilder.schema import Activity
+from aio_app import create_app
+from outbound import OutboundAdapter
+from rate_limit import (
+    DROP,
+    RATE_LIMITED,
+    MemoryBucketBackend,
+    RateLimiter,
+    SqliteBucketBackend,
+    parse_limit,
+)
+from turn_queue import FairQueue
+from tests.test_aio_app import RecordingBot, make_activity
+from tests.test_outbound import FakeConnector
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def activity(user="user-1", conversation="conv-1", tenant=None, activity_type="message"):
+    data = make_activity("hello")
+    data["type"] = activity_type
+    data["from"]["id"] = user
+    data["conversation"]["id"] = conversation
+    if tenant:
+        data["channelData"] = {"tenant": {"id": tenant}}
+    return Activity().deserialize(data)
+
+
+class TestRateLimit:
+    """Test cases for the token buckets, RateLimiter and FairQueue"""
+
+    def test_buckets_refill_and_are_all_or_nothing(self):
+        """Test burst, refill, and that a refused call spends no tokens"""
+        clock = FakeClock()
+        backend = MemoryBucketBackend(clock=clock)
+        assert backend.acquire([("a", 1.0, 2)]) == (0.0, None)
+        assert backend.acquire([("a", 1.0, 2)]) == (0.0, None)
+        wait, limiting = backend.acquire([("b", 1.0, 5), ("a", 1.0, 2)])
+        assert limiting == 1 and wait == pytest.approx(1.0)
+
+        clock.now += 1
+        assert backend.acquire([("a", 1.0, 2)]) == (0.0, None)
+        # "b" was not charged by the refused call above
+        for _ in range(5):
+            assert backend.acquire([("b", 1.0, 5)])[1] is None
+
+    def test_sqlite_buckets_are_shared(self, tmp_path):
+        """Test that two workers on the same file spend the same tokens"""
+        clock = FakeClock()
+        path = str(tmp_path / "buckets.sqlite3")
+        first = SqliteBucketBackend(path, clock=clock)
+        second = SqliteBucketBackend(path, clock=clock)
+        assert first.acquire([("user:1", 0.5, 2)])[1] is None
+        assert second.acquire([("user:1", 0.5, 2)])[1] is None
+        wait, limiting = first.acquire([("user:1", 0.5, 2)])
+        assert limiting == 0 and wait == pytest.approx(2.0)
+        clock.now += 2
+        assert second.acquire([("user:1", 0.5, 2)])[1] is None
+        assert len(first) == 1
+
+    @pytest.mark.asyncio
+    async def test_sqlite_checks_run_off_the_event_loop(self, tmp_path):
+        """Test that check_async runs a SQLite backend in the executor and a memory backend inline"""
+        for backend, inline in ((SqliteBucketBackend(str(tmp_path / "buckets.sqlite3")), False),
+                                (MemoryBucketBackend(), True)):
+            limiter = RateLimiter(backend, {"user": (1.0, 1)})
+            threads = []
+            acquire = backend.acquire
+            backend.acquire = lambda buckets: threads.append(threading.get_ident()) or acquire(buckets)
+            assert (await limiter.check_async(activity())).allowed
+            assert not (await limiter.check_async(activity())).allowed
+            assert (threading.get_ident() in threads) is inline
+
+    def test_limiter_scopes_and_notices(self):
+        """Test which scope refuses, the one-notice-per-interval rule and unlimited activity types"""
+        limiter = RateLimiter(
+            MemoryBucketBackend(),
+            {"user": parse_limit("1:2"), "conversation": None, "tenant": parse_limit("1:3")},
+        )
+        assert limiter.keys_for(activity(tenant="t-1"))["tenant"] == "t-1"
+        assert limiter.check(activity(user="a", tenant="t-1")).allowed
+        assert limiter.check(activity(user="a", tenant="t-1")).allowed
+        refused = limiter.check(activity(user="a", tenant="t-1"))
+        assert (refused.allowed, refused.scope, refused.notify) == (False, "user", True)
+        assert limiter.check(activity(user="b", tenant="t-1")).allowed
+        refused = limiter.check(activity(user="c", tenant="t-1"))
+        assert (refused.scope, refused.notify) == ("tenant", False)
+        assert limiter.check(activity(user="a", tenant="t-1", activity_type="conversationUpdate")).allowed
+
+        dropped = RATE_LIMITED.value(scope="user", action=DROP)
+        silent = RateLimiter(MemoryBucketBackend(), {"user": (1.0, 1)}, action=DROP)
+        silent.check(activity())
+        assert not silent.check(activity()).notify
+        assert RATE_LIMITED.value(scope="user", action=DROP) == dropped + 1
+
+        with pytest.raises(ValueError):
+            parse_limit("fast")
+
+    @pytest.mark.asyncio
+    async def test_over_limit_turns_get_one_canned_reply(self):
+        """Test the endpoint: the bot sees admitted turns, the user gets one notice"""
+        async with FakeConnector() as connector:
+            bot = RecordingBot()
+            adapter = OutboundAdapter(BotFrameworkAdapterSettings("", ""), connector.sender)
+            limiter = RateLimiter(MemoryBucketBackend(), {"user": (0.01, 2)})
+            async with TestClient(TestServer(create_app(adapter, bot, rate_limiter=limiter))) as client:
+                for n in range(5):
+                    body = make_activity(f"calc {n}", str(n))
+                    body["serviceUrl"] = connector.url
+                    resp = await client.post("/api/messages", json=body)
+                    assert resp.status == 202
+
+            assert bot.texts == ["calc 0", "calc 1"]
+            assert len(connector.posts) == 1
+            assert "faster than I can keep up" in connector.posts[0][1]["text"]
+
+    @pytest.mark.asyncio
+    async def test_fair_queue_round_robin(self):
+        """Test that a busy key cannot hold the queue or starve other keys"""
+        queue = FairQueue(maxsize=10, max_per_key=4)
+        for n in range(4):
+            queue.put_nowait("noisy", f"noisy-{n}")
+        with pytest.raises(asyncio.QueueFull):
+            queue.put_nowait("noisy", "noisy-4")
+        queue.put_nowait("quiet", "quiet-0")
+        queue.put_nowait("other", "other-0")
+
+        served = [await queue.get() for _ in range(6)]
+        assert served == ["noisy-0", "quiet-0", "other-0", "noisy-1", "noisy-2", "noisy-3"]
+        for _ in served:
+            queue.task_done()
+        await asyncio.wait_for(queue.join(), 1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
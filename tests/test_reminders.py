@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Test module for reminder parsing, storage and the lease-holding scheduler
+"""
+
+import sqlite3
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+import pytest
+from botbuilder.core import TurnContext
+from botbuilder.schema import Activity
+from reminders import (
+    MAX_ATTEMPTS,
+    ProactiveSender,
+    ReminderError,
+    ReminderScheduler,
+    SqliteReminderStore,
+    handle_remind,
+    next_due,
+    parse_reminder,
+)
+from tests.test_aio_app import make_activity
+from tests.test_polls import Clock, RecordingAdapter
+
+SYDNEY = ZoneInfo("Australia/Sydney")
+
+
+def at(*args, tz=timezone.utc):
+    return datetime(*args, tzinfo=tz).timestamp()
+
+
+class RecordingSender:
+    """Reminder sender that records each batch and can fail chosen reminders"""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = set()
+
+    async def __call__(self, reminders):
+        self.batches.append([reminder.text for reminder in reminders])
+        return {r.id: RuntimeError("connector down") for r in reminders if r.text in self.failing}
+
+    @property
+    def sent(self):
+        return [text for batch in self.batches for text in batch]
+
+
+class TestReminders:
+    """Test cases for parse_reminder, SqliteReminderStore and ReminderScheduler"""
+
+    @pytest.fixture
+    def clock(self):
+        clock = Clock()
+        clock.now = at(2025, 10, 3, 12, 0)  # a Friday
+        return clock
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return SqliteReminderStore(str(tmp_path / "reminders.sqlite3"))
+
+    def test_parse_reminder(self, clock):
+        """Test delays, times of day in the user's zone and repeating reminders"""
+        now = clock.now
+        assert parse_reminder("me in 10m stretch", now) == (now + 600, "", "stretch")
+        assert parse_reminder("in 1h 30m to call Sam", now) == (now + 5400, "", "call Sam")
+        assert parse_reminder("me at 5pm leave", now) == (at(2025, 10, 3, 17, 0), "", "leave")
+        assert parse_reminder("me at 9:00 coffee", now) == (at(2025, 10, 4, 9, 0), "", "coffee")
+        assert parse_reminder("me every 2h drink water", now) == (now + 7200, "every 7200", "drink water")
+
+        due, recurrence, text = parse_reminder("us every weekday at 9:15 standup", now, "Australia/Sydney")
+        assert (recurrence, text) == ("weekdays 09:15 Australia/Sydney", "standup")
+        # Friday 22:00 in Sydney: the next weekday is Monday, after the switch to daylight saving time
+        assert due == at(2025, 10, 6, 9, 15, tz=SYDNEY)
+        assert next_due(recurrence, due) == at(2025, 10, 7, 9, 15, tz=SYDNEY)
+        assert next_due("daily 09:15 +600", due) == at(2025, 10, 5, 23, 15)
+
+        for text in ("me soon", "me every 10s spam", "me at 25:00 x", "me in 400 days x"):
+            with pytest.raises(ReminderError):
+                parse_reminder(text, now)
+
+    @pytest.mark.asyncio
+    async def test_due_reminders_fire_once(self, store, clock):
+        """Test one-shot and repeating reminders against a fake clock"""
+        sender = RecordingSender()
+        scheduler = ReminderScheduler(store, sender, clock=clock, owner="w1")
+        scheduler.add("u1", "c1", "tea", clock.now + 60)
+        scheduler.add("u1", "c1", "water", clock.now + 60, "every 3600")
+        scheduler.add("u2", "c2", "later", clock.now + 7200)
+        assert await scheduler.tick() == 0
+        assert scheduler.next_wakeup() == clock.now + 5
+
+        clock.now += 61
+        assert await scheduler.tick() == 2
+        assert sender.batches == [["tea", "water"]]
+        assert await scheduler.tick() == 0
+        assert [r.text for r in store.list("u1")] == ["water"]
+        assert store.list("u1")[0].due_at == clock.now + 3600
+
+        clock.now += 7200
+        assert await scheduler.tick() == 2
+        assert sorted(sender.sent) == ["later", "tea", "water", "water"]
+
+        # A request thread only hands a new reminder over; the scheduler's tick indexes it
+        soon = scheduler.add("u1", "c1", "soon", clock.now + 1)
+        assert soon.id not in scheduler._queued
+        assert list(scheduler._added) == [(soon.due_at, soon.id)]
+        clock.now += 1
+        assert await scheduler.tick() == 1
+        assert not scheduler._added
+
+    @pytest.mark.asyncio
+    async def test_one_worker_holds_the_lease(self, store, clock):
+        """Test that only the lease holder fires reminders, and a standby takes over"""
+        first_sender, second_sender = RecordingSender(), RecordingSender()
+        first = ReminderScheduler(store, first_sender, clock=clock, owner="w1", lease=30)
+        second = ReminderScheduler(store, second_sender, clock=clock, owner="w2", lease=30)
+        for n in range(250):
+            second.add(f"u{n % 7}", f"c{n % 7}", f"r{n}", clock.now + n % 5)
+        clock.now += 10
+        assert await first.tick() == 250
+        assert await second.tick() == 0
+        assert (first.leader, second.leader) == (True, False)
+        assert [len(batch) for batch in first_sender.batches] == [100, 100, 50]
+
+        second.add("u1", "c1", "after failover", clock.now + 40)
+        clock.now += 45
+        assert await second.tick() == 1
+        assert second_sender.sent == ["after failover"]
+        assert await first.tick() == 0 and not first.leader
+
+        second.stop()
+        first.add("u1", "c1", "after release", clock.now)
+        assert await first.tick() == 1
+
+    def test_claims_are_exclusive(self, store, clock):
+        """Test that a claimed reminder cannot be claimed again until its lease expires"""
+        scheduler = ReminderScheduler(store, RecordingSender(), clock=clock, owner="w1")
+        reminder = scheduler.add("u1", "c1", "tea", clock.now)
+        assert len(store.claim([reminder.id], "w1", clock.now, 30)) == 1
+        assert store.claim([reminder.id], "w2", clock.now + 1, 30) == []
+        assert len(store.claim([reminder.id], "w2", clock.now + 31, 30)) == 1
+
+    def test_storage_errors_become_reminder_errors(self, store, clock, monkeypatch):
+        """Test that an id collision draws a new id and a failed write is a user-facing ReminderError"""
+        scheduler = ReminderScheduler(store, RecordingSender(), clock=clock, owner="w1")
+        taken = scheduler.add("u1", "c1", "tea", clock.now)
+        ids = iter([taken.id, taken.id, "fresh0id"])
+        monkeypatch.setattr("reminders.uuid.uuid4", lambda: SimpleNamespace(hex=next(ids)))
+        assert scheduler.add("u1", "c1", "coffee", clock.now).id == "fresh0id"
+
+        monkeypatch.setattr("reminders.uuid.uuid4", lambda: SimpleNamespace(hex=taken.id))
+        with pytest.raises(ReminderError, match="couldn't save"):
+            scheduler.add("u1", "c1", "cake", clock.now)
+
+        def locked(reminder):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(store, "add", locked)
+        with pytest.raises(ReminderError, match="couldn't save"):
+            scheduler.add("u1", "c1", "cake", clock.now)
+        assert [r.text for r in store.list("u1")] == ["tea", "coffee"]
+
+    @pytest.mark.asyncio
+    async def test_commands_report_storage_errors(self, store, clock, monkeypatch):
+        """Test that list and cancel answer the user when the database fails"""
+        adapter = RecordingAdapter()
+        scheduler = ReminderScheduler(store, RecordingSender(), clock=clock, owner="w1")
+
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(store, "list", locked)
+        monkeypatch.setattr(store, "cancel", locked)
+        for text in ("list", "cancel abc12345"):
+            context = TurnContext(adapter, Activity().deserialize(make_activity(f"remind {text}")))
+            await handle_remind(context, scheduler, text)
+            assert "couldn't reach your reminders" in adapter.sent[-1].text
+
+    @pytest.mark.asyncio
+    async def test_failed_sends_are_retried(self, store, clock):
+        """Test retries after a failed delivery, up to MAX_ATTEMPTS"""
+        sender = RecordingSender()
+        sender.failing.add("tea")
+        scheduler = ReminderScheduler(store, sender, clock=clock, owner="w1", retry_delay=60)
+        scheduler.add("u1", "c1", "tea", clock.now)
+        for attempt in range(MAX_ATTEMPTS):
+            assert await scheduler.tick() == 0
+            clock.now += 60
+        assert sender.sent == ["tea"] * MAX_ATTEMPTS
+        assert store.list("u1") == []
+
+    @pytest.mark.asyncio
+    async def test_proactive_sends_and_commands(self, store, clock):
+        """Test the remind command and one proactive turn per conversation"""
+        adapter = RecordingAdapter()
+        scheduler = ReminderScheduler(store, ProactiveSender(adapter), clock=clock, owner="w1")
+
+        async def say(text):
+            activity = make_activity(f"remind {text}")
+            context = TurnContext(adapter, Activity().deserialize(activity))
+            await handle_remind(context, scheduler, text)
+            return adapter.sent[-1].text
+
+        assert "stretch" in await say("me in 10m stretch")
+        assert "drink" in await say("me in 10m drink")
+        assert "Usage" in await say("me whenever")
+        reminder_id = store.list("user-1")[0].id
+        assert reminder_id in await say("list")
+        assert "Cancelled" in await say(f"cancel {reminder_id}")
+        assert "no reminder" in await say(f"cancel {reminder_id}")
+
+        await say("me in 10m water")
+        sent = len(adapter.sent)
+        clock.now += 600
+        assert await scheduler.tick() == 2
+        delivered = adapter.sent[sent:]
+        assert [a.text for a in delivered] == ["⏰ **Reminder:** drink", "⏰ **Reminder:** water"]
+        assert all(a.conversation.id == "conv-1" for a in delivered)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
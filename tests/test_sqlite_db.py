@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Test module for the shared SQLite connection and transaction helpers
+"""
+
+import os
+import sqlite3
+import threading
+import pytest
+from sqlite_db import ConnectionCache, connect, transaction
+
+
+class TestSqliteDb:
+    """Test cases for connect, ConnectionCache and transaction"""
+
+    def test_connections_use_wal_and_autocommit(self, tmp_path):
+        """Test the pragmas every store relies on"""
+        conn = connect(str(tmp_path / "db.sqlite3"), timeout=1)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.isolation_level is None
+
+    def test_one_connection_per_thread_and_process(self, tmp_path, monkeypatch):
+        """Test that a thread reuses its connection, other threads and forked processes do not"""
+        cache = ConnectionCache(str(tmp_path / "db.sqlite3"))
+        conn = cache.get()
+        assert cache.get() is conn
+        other = []
+        thread = threading.Thread(target=lambda: other.append(cache.get()))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+        pid = os.getpid()
+        monkeypatch.setattr("sqlite_db.os.getpid", lambda: pid + 1)
+        assert cache.get() is not conn
+
+    def test_transaction_commits_or_rolls_back(self, tmp_path):
+        """Test that a block that raises leaves nothing behind"""
+        conn = connect(str(tmp_path / "db.sqlite3"))
+        conn.execute("CREATE TABLE items (name TEXT PRIMARY KEY)")
+        with transaction(conn):
+            conn.execute("INSERT INTO items VALUES ('a')")
+        with pytest.raises(sqlite3.IntegrityError):
+            with transaction(conn, immediate=False):
+                conn.execute("INSERT INTO items VALUES ('b')")
+                conn.execute("INSERT INTO items VALUES ('a')")
+        assert conn.execute("SELECT name FROM items").fetchall() == [("a",)]
+        assert not conn.in_transaction
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
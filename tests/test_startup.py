@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test module for lazy imports, cached import status and pre-fork warm-up
+"""
+
+import gc
+import importlib.util
+import os
+import subprocess
+import sys
+import pytest
+import bot_runtime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestStartup:
+    """Test cases for import_status(), preload() and what the app imports"""
+
+    def test_feature_dependencies_are_not_imported_at_startup(self):
+        """Test that importing the app leaves Pillow, qrcode and multiprocessing unloaded"""
+        code = (
+            "import sys, app; "
+            "print(sorted(m for m in ('qrcode', 'PIL', 'multiprocessing') if m in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == "[]"
+
+    def test_import_status_is_cached(self, monkeypatch):
+        """Test that modules are located once per process and failed imports are reported"""
+        calls = []
+        find_spec = importlib.util.find_spec
+
+        def counting_find_spec(name, *args):
+            calls.append(name)
+            return find_spec(name, *args)
+
+        monkeypatch.setattr(importlib.util, "find_spec", counting_find_spec)
+        monkeypatch.setattr(bot_runtime, "_import_status", None)
+        monkeypatch.setattr(bot_runtime, "_import_errors", {"my_bot": "No module named 'my_bot'"})
+
+        status = bot_runtime.import_status()
+        assert status["botbuilder"] is True
+        assert status["my_bot"] is False
+        assert set(status) == set(bot_runtime.CHECKED_IMPORTS)
+        located = len(calls)
+        assert bot_runtime.detailed_health_payload()["imports"] == status
+        assert len(calls) == located
+
+    def test_preload(self, monkeypatch):
+        """Test that preload imports the listed modules and freezes the heap"""
+        frozen = []
+        monkeypatch.setattr(gc, "freeze", lambda: frozen.append(True))
+        monkeypatch.setattr(bot_runtime, "_import_status", None)
+        monkeypatch.setattr(bot_runtime, "_import_errors", {})
+        monkeypatch.setattr(bot_runtime, "PRELOAD_MODULES", ["colorsys", "no_such_module_for_preload"])
+        sys.modules.pop("colorsys", None)
+
+        bot_runtime.preload()
+        assert "colorsys" in sys.modules
+        assert "no_such_module_for_preload" in bot_runtime._import_errors
+        assert bot_runtime._import_status is not None
+        assert frozen == [True]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
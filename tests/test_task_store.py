@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Test module for the task storage backends
+"""
+
+import multiprocessing
+import pytest
+from task_store import COMPLETED, OPEN, InvalidCursorError, MemoryTaskStore, SqliteTaskStore, create_task_store
+
+
+def add_tasks_worker(path, worker_id, count):
+    """Run in a separate process, like one gunicorn worker"""
+    store = SqliteTaskStore(path, batch_size=8)
+    for i in range(count):
+        store.add_task("shared-user", f"worker {worker_id} task {i}")
+        store.add_task(f"user-{worker_id}", f"own task {i}")
+    store.close()
+
+
+class TestTaskStore:
+    """Test cases for MemoryTaskStore and SqliteTaskStore"""
+
+    @pytest.fixture(params=["memory", "sqlite"])
+    def store(self, request, tmp_path):
+        if request.param == "memory":
+            store = MemoryTaskStore()
+        else:
+            store = SqliteTaskStore(str(tmp_path / "tasks.sqlite3"))
+        yield store
+        store.close()
+
+    def test_add_complete_delete(self, store):
+        """Test the full task lifecycle"""
+        first = store.add_task("user-1", "Buy groceries")
+        second = store.add_task("user-1", "Book flights")
+        store.add_task("user-2", "Not mine")
+
+        assert [t.description for t in store.list_tasks("user-1")] == ["Buy groceries", "Book flights"]
+
+        completed = store.complete_task("user-1", first.id)
+        assert completed.completed and completed.completed_at
+        assert store.get_task("user-1", first.id).completed
+
+        assert store.delete_task("user-1", second.id)
+        assert not store.delete_task("user-1", second.id)
+        assert store.complete_task("user-2", first.id) is None
+        assert [t.id for t in store.list_tasks("user-1")] == [first.id]
+
+    def test_sqlite_survives_restart(self, tmp_path):
+        """Test that tasks outlive the process-local cache"""
+        path = str(tmp_path / "tasks.sqlite3")
+        store = SqliteTaskStore(path)
+        task = store.add_task("user-1", "Write report")
+        store.complete_task("user-1", task.id)
+        store.close()
+
+        reopened = SqliteTaskStore(path)
+        tasks = reopened.list_tasks("user-1")
+        assert [(t.id, t.completed) for t in tasks] == [(task.id, True)]
+
+    def test_workers_see_each_others_writes(self, tmp_path):
+        """Test that a cached task list is refreshed after another worker writes"""
+        path = str(tmp_path / "tasks.sqlite3")
+        worker_a = SqliteTaskStore(path)
+        worker_b = SqliteTaskStore(path)
+
+        worker_a.add_task("user-1", "from a")
+        worker_a.flush()
+        assert len(worker_b.list_tasks("user-1")) == 1
+
+        worker_b.add_task("user-1", "from b")
+        worker_b.flush()
+        assert [t.description for t in worker_a.list_tasks("user-1")] == ["from a", "from b"]
+
+    def test_positions_come_from_the_shared_file(self, tmp_path):
+        """Test that tasks written by two workers page in the order they were written, without gaps"""
+        path = str(tmp_path / "tasks.sqlite3")
+        worker_a = SqliteTaskStore(path)
+        worker_b = SqliteTaskStore(path)
+        written = []
+        for n in range(3):
+            for worker, name in ((worker_a, "a"), (worker_b, "b")):
+                written.append(worker.add_task("user-1", f"{name}{n}").description)
+                worker.flush()
+
+        seen, cursor = [], None
+        while True:
+            page = worker_a.page_tasks("user-1", cursor=cursor, limit=1)
+            seen += [task.description for task in page.tasks]
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+        assert seen == written
+        assert [task.description for task in worker_b.list_tasks("user-1")] == written
+
+    def test_concurrent_worker_processes(self, tmp_path):
+        """Test many processes writing to one store without losing tasks"""
+        path = str(tmp_path / "tasks.sqlite3")
+        SqliteTaskStore(path).close()
+        workers, per_worker = 6, 40
+
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=add_tasks_worker, args=(path, i, per_worker))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            assert process.exitcode == 0
+
+        store = SqliteTaskStore(path)
+        assert len(store.list_tasks("shared-user")) == workers * per_worker
+        for i in range(workers):
+            assert len(store.list_tasks(f"user-{i}")) == per_worker
+
+    def test_pages_and_filters(self, store):
+        """Test cursor pagination over a changing list, status filters and search"""
+        tasks = [store.add_task("user-1", f"{'Report' if i % 5 == 0 else 'Chore'} {i}") for i in range(23)]
+        for task in tasks[::2]:
+            store.complete_task("user-1", task.id)
+
+        seen, cursor = [], None
+        while True:
+            page = store.page_tasks("user-1", cursor=cursor, limit=10)
+            seen += [task.id for task in page.tasks]
+            if page.next_cursor is None:
+                break
+            if cursor is None:
+                # Deleting a task already shown does not shift later pages
+                store.delete_task("user-1", tasks[0].id)
+            cursor = page.next_cursor
+        assert seen == [task.id for task in tasks]
+
+        open_page = store.page_tasks("user-1", status=OPEN, limit=50)
+        assert [task.id for task in open_page.tasks] == [task.id for task in tasks[1::2]]
+        assert open_page.next_cursor is None
+
+        page = store.page_tasks("user-1", status=COMPLETED, search="report", limit=2)
+        assert [task.description for task in page.tasks] == ["Report 10", "Report 20"]
+        # The cursor carries its filters: "Chore 22" is completed but does not match
+        following = store.page_tasks("user-1", cursor=page.next_cursor)
+        assert (following.tasks, following.status, following.search) == ([], COMPLETED, "report")
+
+        with pytest.raises(InvalidCursorError):
+            store.page_tasks("user-1", cursor="not-a-cursor")
+
+    def test_search_work_is_bounded(self, tmp_path):
+        """Test that a rare match returns a short page and a cursor rather than scanning everything"""
+        store = SqliteTaskStore(str(tmp_path / "tasks.sqlite3"), scan_batch=20)
+        for i in range(300):
+            store.add_task("user-1", "needle" if i == 250 else f"hay {i}")
+        page = store.page_tasks("user-1", search="needle", limit=5, max_scan=100)
+        assert page.tasks == [] and page.next_cursor
+        pages = 1
+        while not page.tasks:
+            page = store.page_tasks("user-1", cursor=page.next_cursor, limit=5, max_scan=100)
+            pages += 1
+        assert [task.description for task in page.tasks] == ["needle"] and pages == 3
+        assert page.next_cursor is None
+        store.close()
+
+    def test_create_task_store(self, tmp_path):
+        """Test building stores from URLs"""
+        assert isinstance(create_task_store("memory://"), MemoryTaskStore)
+        assert isinstance(create_task_store(f"sqlite://{tmp_path}/t.sqlite3"), SqliteTaskStore)
+        with pytest.raises(ValueError):
+            create_task_store("redis://localhost")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test module for paged task list rendering
+"""
+
+import pytest
+from task_store import ALL, COMPLETED, OPEN, MemoryTaskStore
+from task_views import NEXT_PAGE_ACTION, parse_list_args, render_text, task_list_activity
+
+
+def card_of(activity):
+    return activity.attachments[0].content
+
+
+class TestTaskViews:
+    """Test cases for parse_list_args and the task list card"""
+
+    def test_parse_list_args(self):
+        """Test status words and search text"""
+        assert parse_list_args("") == (ALL, "")
+        assert parse_list_args("done quarterly report") == (COMPLETED, "quarterly report")
+        assert parse_list_args("Open") == (OPEN, "")
+        assert parse_list_args("budget review") == (ALL, "budget review")
+
+    def test_card_pages_through_next_page_presses(self):
+        """Test that following the card's button visits every task once, a page at a time"""
+        store = MemoryTaskStore()
+        added = [store.add_task("user-1", f"Task {i}") for i in range(7)]
+
+        activity = task_list_activity(store, "user-1", "", page_size=3)
+        shown = []
+        while True:
+            card = card_of(activity)
+            rows = [item for item in card["body"] if item["type"] == "ColumnSet"]
+            assert len(rows) <= 3
+            shown += [row["columns"][2]["items"][0]["text"] for row in rows]
+            if "actions" not in card:
+                break
+            data = card["actions"][0]["data"]
+            assert data["action"] == NEXT_PAGE_ACTION
+            # Teams sends the button back with the data as the value and no text
+            activity = task_list_activity(store, "user-1", "", value=data, page_size=3)
+        assert shown == [task.id for task in added]
+
+        # A forged cursor starts over instead of failing the turn
+        restarted = task_list_activity(store, "user-1", value={"action": NEXT_PAGE_ACTION, "cursor": "x"})
+        assert "actions" not in card_of(restarted)
+
+        # A search that only looks like the text command is still a search
+        searched = task_list_activity(store, "user-1", "next standup")
+        assert card_of(searched)["body"][0]["text"] == '📝 Your tasks matching "next standup"'
+
+    def test_render_text_truncates(self):
+        """Test the plain-text page and long descriptions"""
+        store = MemoryTaskStore()
+        store.add_task("user-1", "x" * 500)
+        text = render_text(store.page_tasks("user-1"))
+        assert text.startswith("📝 **Your tasks**") and "x" * 199 + "…" in text
+        assert "Nothing here." in render_text(store.page_tasks("user-2", status=OPEN))
+        assert "next page" not in text
+
+    def test_render_text_prints_next_page_command(self):
+        """Test that the plain-text page names a command that fetches the next page"""
+        store = MemoryTaskStore()
+        added = [store.add_task("user-1", f"task {i}") for i in range(3)]
+        page = store.page_tasks("user-1", limit=2)
+        command = f"task list next {page.next_cursor}"
+        assert f"`{command}`" in render_text(page)
+        assert "card" not in render_text(page)
+
+        activity = task_list_activity(store, "user-1", command[len("task list "):], page_size=2)
+        rows = [item for item in card_of(activity)["body"] if item["type"] == "ColumnSet"]
+        assert [row["columns"][2]["items"][0]["text"] for row in rows] == [added[2].id]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test module for the acknowledge-then-process turn queue
+"""
+
+import asyncio
+import threading
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from botbuilder.schema import Activity
+from aio_app import create_app
+from dedup import ActivityDeduplicator, MemoryDedupBackend
+from turn_queue import TurnQueue, BackgroundTurnQueue, QueueFullError, QUEUE_REJECTED, QUEUE_WAIT
+from tests.test_aio_app import RecordingBot, make_activity
+
+
+def make_adapter():
+    return BotFrameworkAdapter(BotFrameworkAdapterSettings("", ""))
+
+
+class TestTurnQueue:
+    """Test cases for TurnQueue and BackgroundTurnQueue"""
+
+    @pytest.mark.asyncio
+    async def test_turns_are_processed_by_workers(self):
+        """Test that submitted turns reach the bot and record queue wait"""
+        bot = RecordingBot()
+        queue = TurnQueue(make_adapter(), bot.on_turn, maxsize=10, workers=2)
+        waits_before = QUEUE_WAIT.count()
+
+        await queue.start()
+        for i in range(5):
+            await queue.submit(Activity().deserialize(make_activity(f"msg {i}", str(i))), "")
+        await queue.stop(drain=True)
+
+        assert sorted(bot.texts) == [f"msg {i}" for i in range(5)]
+        assert QUEUE_WAIT.count() - waits_before == 5
+
+    @pytest.mark.asyncio
+    async def test_full_queue_raises(self):
+        """Test backpressure when every slot is taken"""
+        bot = RecordingBot(delay=0.2)
+        queue = TurnQueue(make_adapter(), bot.on_turn, maxsize=1, workers=1)
+        await queue.start()
+
+        await queue.submit(Activity().deserialize(make_activity("first", "1")), "")
+        await asyncio.sleep(0.01)  # worker takes the first turn
+        await queue.submit(Activity().deserialize(make_activity("second", "2")), "")
+        with pytest.raises(QueueFullError):
+            await queue.submit(Activity().deserialize(make_activity("third", "3")), "")
+
+        await queue.stop(drain=True)
+        assert bot.texts == ["first", "second"]
+
+    def test_background_queue_from_threads(self):
+        """Test the WSGI wrapper accepts submits from many request threads"""
+        bot = RecordingBot()
+        queue = BackgroundTurnQueue(make_adapter(), bot.on_turn, maxsize=100, workers=4)
+
+        threads = [
+            threading.Thread(
+                target=queue.submit,
+                args=(Activity().deserialize(make_activity(f"msg {i}", str(i))), "")
+            )
+            for i in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queue.stop(drain=True)
+
+        assert len(bot.texts) == 20
+
+    def test_background_submit_timeout_sheds_the_turn(self):
+        """Test that a submit the loop cannot finish in time is rejected like a full queue"""
+        bot = RecordingBot()
+        adapter = make_adapter()
+        dedup = ActivityDeduplicator(MemoryDedupBackend())
+        queue = BackgroundTurnQueue(adapter, bot.on_turn, maxsize=10, workers=1, submit_timeout=0.05,
+                                    deduplicator=dedup)
+        rejected_before = QUEUE_REJECTED.value()
+
+        async def slow_auth(activity, auth_header):
+            await asyncio.sleep(0.5)
+        adapter._authenticate_request = slow_auth
+
+        activity = Activity().deserialize(make_activity("slow", "1"))
+        with pytest.raises(QueueFullError):
+            queue.submit(activity, "")
+        queue.stop(drain=True)
+
+        assert QUEUE_REJECTED.value() - rejected_before == 1
+        assert bot.texts == []
+        assert not dedup.is_duplicate(activity)
+
+    @pytest.mark.asyncio
+    async def test_endpoint_acknowledges_before_turn_finishes(self):
+        """Test that queue mode answers 202 while the turn is still running"""
+        bot = RecordingBot(delay=0.3)
+        app = create_app(make_adapter(), bot, ack_mode="queue")
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post("/api/messages", json=make_activity("slow"))
+            assert resp.status == 202
+            assert bot.texts == []
+            await asyncio.sleep(0.4)
+            assert bot.texts == ["slow"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test module for the weather provider client
+"""
+
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from weather_client import (
+    WEATHER_LOOKUPS,
+    CircuitBreaker,
+    CityNotFoundError,
+    WeatherClient,
+    WeatherUnavailableError,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubProvider:
+    """Local OpenWeatherMap-style server that counts calls"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.status = 200
+
+    async def handle(self, request):
+        city = request.query["q"]
+        self.calls.append((request.path, city))
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        if city.lower() == "atlantis":
+            return web.json_response({"cod": "404"}, status=404)
+        return web.json_response({"name": city, "main": {"temp": 21.5}, "path": request.path})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/weather", self.handle)
+        app.router.add_get("/forecast", self.handle)
+        return app
+
+
+class StubClient:
+    """Starts the stub provider and a WeatherClient pointed at it"""
+
+    def __init__(self, provider, **kwargs):
+        self.provider = provider
+        self.kwargs = kwargs
+
+    async def __aenter__(self):
+        self.server = TestServer(self.provider.app())
+        await self.server.start_server()
+        self.client = WeatherClient(str(self.server.make_url("")), **self.kwargs)
+        return self.client
+
+    async def __aexit__(self, *exc_info):
+        await self.client.close()
+        await self.server.close()
+
+
+@pytest.fixture
+def provider():
+    return StubProvider()
+
+
+class TestWeatherClient:
+    """Test cases for WeatherClient"""
+
+    @pytest.mark.asyncio
+    async def test_cache_hits_and_separate_ttls(self, provider):
+        """Test that repeated lookups are served from cache until their own TTL expires"""
+        clock = FakeClock()
+        hits = WEATHER_LOOKUPS.value(kind="current", result="hit")
+        async with StubClient(provider, current_ttl=60, forecast_ttl=600, clock=clock) as client:
+            assert (await client.current("Sydney"))["name"] == "Sydney"
+            assert (await client.current("  sydney "))["name"] == "Sydney"
+            await client.forecast("Sydney")
+            assert len(provider.calls) == 2
+            assert WEATHER_LOOKUPS.value(kind="current", result="hit") == hits + 1
+
+            clock.now += 120
+            await client.current("Sydney")
+            await client.forecast("Sydney")
+            assert provider.calls[-1] == ("/weather", "Sydney")
+            assert len(provider.calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_lookups_are_coalesced(self, provider):
+        """Test that simultaneous lookups for one city make a single provider call"""
+        provider.delay = 0.05
+        coalesced = WEATHER_LOOKUPS.value(kind="current", result="coalesced")
+        async with StubClient(provider) as client:
+            results = await asyncio.gather(*[client.current("Melbourne") for _ in range(20)])
+            assert len(provider.calls) == 1
+            assert all(result["name"] == "Melbourne" for result in results)
+            assert WEATHER_LOOKUPS.value(kind="current", result="coalesced") == coalesced + 19
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_shared_request(self, provider):
+        """Test that one caller giving up leaves the others their answer"""
+        provider.delay = 0.05
+        async with StubClient(provider) as client:
+            first = asyncio.ensure_future(client.current("Perth"))
+            second = asyncio.ensure_future(client.current("Perth"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            assert (await second)["name"] == "Perth"
+
+    @pytest.mark.asyncio
+    async def test_turns_on_separate_loops_share_the_pool(self, provider):
+        """Test that turns on fresh loops, as in the Flask sync mode, share one session and coalesce"""
+        provider.delay = 0.05
+        async with StubClient(provider) as client:
+            await client.current("Cairns")
+            session = client._session
+            results = await asyncio.gather(
+                *[asyncio.to_thread(asyncio.run, client.forecast("Cairns")) for _ in range(3)]
+            )
+            assert [result["path"] for result in results] == ["/forecast"] * 3
+            assert len(provider.calls) == 2
+            assert client._session is session and not session.closed
+        assert session.closed
+
+    @pytest.mark.asyncio
+    async def test_unknown_city(self, provider):
+        """Test that a 404 raises CityNotFoundError and does not trip the breaker"""
+        async with StubClient(provider, breaker=CircuitBreaker(failure_threshold=1)) as client:
+            with pytest.raises(CityNotFoundError):
+                await client.current("Atlantis")
+            assert client.breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_timeout(self, provider):
+        """Test that a slow provider raises WeatherUnavailableError"""
+        provider.delay = 0.5
+        async with StubClient(provider, timeout=0.05) as client:
+            with pytest.raises(WeatherUnavailableError):
+                await client.current("Hobart")
+
+    @pytest.mark.asyncio
+    async def test_circuit_breaker(self, provider):
+        """Test that the breaker opens after repeated failures and recovers after its timeout"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+        provider.status = 500
+        async with StubClient(provider, breaker=breaker, clock=clock) as client:
+            for _ in range(3):
+                with pytest.raises(WeatherUnavailableError):
+                    await client.current("Darwin")
+            assert breaker.state == "open"
+            assert len(provider.calls) == 2
+
+            provider.status = 200
+            clock.now += 31
+            assert breaker.state == "half-open"
+            assert (await client.current("Darwin"))["name"] == "Darwin"
+            assert breaker.state == "closed"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
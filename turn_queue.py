@@ -0,0 +1,272 @@
+"""
+Acknowledge-then-process support for /api/messages
+
+The endpoint parses and authenticates the activity, drops a redelivery,
+puts the rest on a bounded in-process queue and returns 202 straight
+away. A pool of worker coroutines drains the queue through the adapter,
+building the full Activity of each turn only then (see fast_ingest). When the queue is full
+the caller gets QueueFullError so the endpoint can answer 429/503.
+
+The queue is fair across conversations: workers take turns round-robin
+from each conversation with work waiting, and one conversation may hold at
+most `max_per_conversation` of the slots, so a flood in one channel cannot
+starve the others.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+from fast_ingest import materialize
+from logging_setup import correlation_id
+from metrics import REGISTRY, LoopLagMonitor
+from rate_limit import notice_logic
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT = REGISTRY.histogram(
+    "bot_queue_wait_seconds", "Time a turn spent in the work queue before a worker picked it up"
+)
+QUEUE_DEPTH = REGISTRY.gauge("bot_queue_depth", "Turns currently waiting in the work queue")
+QUEUE_REJECTED = REGISTRY.counter(
+    "bot_queue_rejected_total", "Turns rejected because the queue was full or did not accept them in time"
+)
+QUEUE_ERRORS = REGISTRY.counter("bot_queue_turn_errors_total", "Queued turns that raised, by error type")
+
+
+class QueueFullError(Exception):
+    """Raised when the work queue has no room for another turn"""
+
+
+class FairQueue:
+    """asyncio queue that serves its keys round-robin, with a cap on items per key"""
+
+    def __init__(self, maxsize=0, max_per_key=0):
+        self.maxsize = maxsize
+        self.max_per_key = max_per_key
+        self._items = {}
+        self._ring = deque()
+        self._size = 0
+        self._available = asyncio.Semaphore(0)
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self):
+        return self._size
+
+    def full(self):
+        return 0 < self.maxsize <= self._size
+
+    def key_full(self, key):
+        return 0 < self.max_per_key <= len(self._items.get(key, ()))
+
+    def put_nowait(self, key, item):
+        if self.full() or self.key_full(key):
+            raise asyncio.QueueFull
+        items = self._items.get(key)
+        if items is None:
+            items = self._items[key] = deque()
+            self._ring.append(key)
+        items.append(item)
+        self._size += 1
+        self._unfinished += 1
+        self._finished.clear()
+        self._available.release()
+
+    async def get(self):
+        await self._available.acquire()
+        key = self._ring.popleft()
+        items = self._items[key]
+        item = items.popleft()
+        if items:
+            # Back of the line until every other waiting key has had a turn
+            self._ring.append(key)
+        else:
+            del self._items[key]
+        self._size -= 1
+        return item
+
+    def task_done(self):
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._finished.set()
+
+    async def join(self):
+        await self._finished.wait()
+
+
+class TurnQueue:
+    """Bounded, conversation-fair work queue drained by a fixed pool of worker tasks"""
+
+    def __init__(self, adapter, logic, maxsize=1000, workers=16, max_per_conversation=0,
+                 rate_limiter=None, deduplicator=None):
+        self.adapter = adapter
+        self.logic = logic
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self.max_per_conversation = max_per_conversation
+        self.rate_limiter = rate_limiter
+        self.deduplicator = deduplicator
+        self._queue = None
+        self._workers = []
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        """Create the queue and worker tasks on the running loop"""
+        if self._queue is not None:
+            return
+        self._queue = FairQueue(maxsize=self.maxsize, max_per_key=self.max_per_conversation)
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.worker_count)
+        ]
+        logger.info("Turn queue started: maxsize=%d workers=%d", self.maxsize, self.worker_count)
+
+    async def stop(self, drain=True):
+        """Stop the workers, optionally waiting for queued turns to finish first"""
+        if self._queue is None:
+            return
+        if drain:
+            await self._queue.join()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(self, activity, auth_header, correlation=None):
+        """Authenticate the activity and enqueue it; raises PermissionError or QueueFullError
+
+        A redelivered activity is dropped once the request is authenticated. An
+        activity over its rate limit is queued with the canned-reply logic
+        instead of the bot's, or dropped.
+        """
+        correlation = correlation or correlation_id.get()
+        if self._queue is None:
+            await self.start()
+        conversation = activity.conversation.id if activity.conversation else None
+        if self._queue.full() or self._queue.key_full(conversation):
+            QUEUE_REJECTED.inc()
+            raise QueueFullError(self._full_message(conversation))
+
+        # _authenticate_request is the adapter's documented override point
+        identity = await self.adapter._authenticate_request(activity, auth_header or "")
+        if self.deduplicator is not None and await self.deduplicator.is_duplicate_async(activity):
+            logger.info("Duplicate activity %s acknowledged without processing", activity.id)
+            return
+        logic = self.logic
+        if self.rate_limiter is not None:
+            decision = await self.rate_limiter.check_async(activity)
+            if not decision.allowed:
+                if not decision.notify:
+                    return
+                logic = notice_logic(decision)
+        try:
+            self._queue.put_nowait(conversation, (time.perf_counter(), activity, identity, correlation, logic))
+        except asyncio.QueueFull:
+            QUEUE_REJECTED.inc()
+            if self.deduplicator is not None:
+                await self.deduplicator.forget_async(activity)
+            raise QueueFullError(self._full_message(conversation))
+        QUEUE_DEPTH.set(self._queue.qsize())
+
+    def _full_message(self, conversation):
+        if self._queue.full():
+            return f"Turn queue is full ({self.maxsize} pending)"
+        return f"Conversation {conversation} already has {self.max_per_conversation} turns pending"
+
+    async def _worker(self, index):
+        while True:
+            enqueued_at, activity, identity, correlation, logic = await self._queue.get()
+            correlation_id.set(correlation)
+            QUEUE_WAIT.observe(time.perf_counter() - enqueued_at)
+            QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                await self.adapter.process_activity_with_identity(materialize(activity), identity, logic)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                QUEUE_ERRORS.inc(error=type(e).__name__)
+                logger.error("Queued turn failed in worker %d: %s", index, e, exc_info=True)
+            finally:
+                self._queue.task_done()
+
+
+class BackgroundTurnQueue:
+    """TurnQueue running on a dedicated event loop thread, for WSGI workers
+
+    The thread is started lazily on the first submit so it is created in the
+    gunicorn worker after fork rather than in the master.
+    """
+
+    def __init__(self, adapter, logic, maxsize=1000, workers=16, submit_timeout=10, max_per_conversation=0,
+                 rate_limiter=None, deduplicator=None):
+        self.queue = TurnQueue(
+            adapter, logic, maxsize=maxsize, workers=workers, max_per_conversation=max_per_conversation,
+            rate_limiter=rate_limiter, deduplicator=deduplicator,
+        )
+        self.submit_timeout = submit_timeout
+        self._lag_monitor = LoopLagMonitor("turn-queue")
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(self.queue.start())
+                self._lag_monitor.start(loop)
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="turn-queue-loop", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    def submit(self, activity, auth_header):
+        """Thread-safe submit; raises PermissionError or QueueFullError
+
+        A submit the loop thread does not finish within `submit_timeout` is
+        shed like a full queue, so the caller can answer 503 and be retried.
+        """
+        loop = self._ensure_started()
+        # The loop thread does not share the request thread's context, so pass
+        # the correlation id along explicitly
+        future = asyncio.run_coroutine_threadsafe(
+            self.queue.submit(activity, auth_header, correlation_id.get()), loop
+        )
+        try:
+            return future.result(timeout=self.submit_timeout)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel():
+                # Finished just as the wait ran out
+                return future.result()
+        QUEUE_REJECTED.inc()
+        # The redelivery the caller asks for must not be taken for a duplicate
+        if self.queue.deduplicator is not None:
+            self.queue.deduplicator.forget(activity)
+        raise QueueFullError(f"Turn queue did not accept the turn within {self.submit_timeout}s")
+
+    def stop(self, drain=True, timeout=30):
+        """Stop the workers and the loop thread"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.queue.stop(drain=drain), loop).result(timeout)
+        asyncio.run_coroutine_threadsafe(self._lag_monitor.stop(), loop).result(timeout)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,262 @@
+"""
+Async weather provider client for the `weather` and `forecast` commands
+
+One WeatherClient per worker keeps a pooled aiohttp.ClientSession, a
+per-city TTL cache (current conditions and forecasts expire separately) and
+a table of in-flight lookups, so concurrent requests for the same city share
+a single provider call. Like outbound.ConnectorSender, the session lives on
+the client's own event loop thread: the Flask sync mode runs every turn on a
+fresh loop, and turns on any loop share one pool and one in-flight table.
+Every provider call has a timeout, and a circuit breaker stops calling a
+provider that keeps failing until it has had time to recover.
+
+The provider speaks the OpenWeatherMap 2.5 API (`/weather` and `/forecast`
+with `q`, `appid` and `units`); point WEATHER_API_URL at any compatible
+service, including a local stub in tests.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import aiohttp
+from metrics import REGISTRY
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+WEATHER_LOOKUPS = REGISTRY.counter(
+    "bot_weather_lookups_total", "Weather lookups by kind and result (hit, miss, coalesced)"
+)
+WEATHER_PROVIDER_LATENCY = REGISTRY.histogram(
+    "bot_weather_provider_seconds", "Latency of calls to the weather provider"
+)
+WEATHER_ERRORS = REGISTRY.counter("bot_weather_errors_total", "Failed weather lookups by reason")
+
+CURRENT = "current"
+FORECAST = "forecast"
+_PATHS = {CURRENT: "/weather", FORECAST: "/forecast"}
+
+
+class WeatherError(Exception):
+    """Raised when a weather lookup cannot be answered"""
+
+
+class CityNotFoundError(WeatherError):
+    """Raised when the provider does not know the city"""
+
+
+class WeatherUnavailableError(WeatherError):
+    """Raised on timeouts, provider errors and while the circuit is open"""
+
+
+class TTLCache:
+    """Bounded LRU of values with per-entry expiry"""
+
+    def __init__(self, max_entries=1024, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets one trial call through after `reset_timeout`"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+class WeatherClient:
+    """Cached, coalescing, circuit-broken client for one worker"""
+
+    def __init__(self, base_url, api_key="", current_ttl=600, forecast_ttl=1800, timeout=5.0,
+                 max_entries=1024, units="metric", breaker=None, clock=time.monotonic,
+                 pool_size=20):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.ttls = {CURRENT: current_ttl, FORECAST: forecast_ttl}
+        self.timeout = timeout
+        self.units = units
+        self.pool_size = pool_size
+        self.cache = TTLCache(max_entries, clock=clock)
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self._session = None
+        self._in_flight = {}
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    async def current(self, city):
+        """Current conditions for `city` as returned by the provider"""
+        return await self._lookup(CURRENT, city)
+
+    async def forecast(self, city):
+        """Forecast for `city` as returned by the provider"""
+        return await self._lookup(FORECAST, city)
+
+    async def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or self._pid != os.getpid():
+            return
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._close_session(), loop))
+        loop.call_soon_threadsafe(loop.stop)
+        await asyncio.to_thread(thread.join, 5)
+        loop.close()
+
+    def _ensure_loop(self):
+        # Started lazily, and again after a fork, since threads do not survive one
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._session = None
+                self._in_flight = {}
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="weather-client", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _close_session(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _lookup(self, kind, city):
+        key = (kind, " ".join(city.lower().split()))
+        if not key[1]:
+            raise CityNotFoundError("No city given")
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            WEATHER_LOOKUPS.inc(kind=kind, result="hit")
+            return cached
+
+        with span(f"weather.{kind}"):
+            future = asyncio.run_coroutine_threadsafe(self._shared(kind, key, city.strip()), self._ensure_loop())
+            return await asyncio.wrap_future(future)
+
+    async def _shared(self, kind, key, city):
+        # Runs on the client's loop, so every caller sees the same in-flight table
+        task = self._in_flight.get(key)
+        if task is not None:
+            WEATHER_LOOKUPS.inc(kind=kind, result="coalesced")
+        else:
+            WEATHER_LOOKUPS.inc(kind=kind, result="miss")
+            task = asyncio.get_running_loop().create_task(self._fetch(kind, key, city))
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._finished, key))
+        # Shield so one caller's cancellation does not cancel the shared request
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter was cancelled
+            task.exception()
+
+    async def _fetch(self, kind, key, city):
+        if not self.breaker.allow():
+            WEATHER_ERRORS.inc(reason="circuit_open")
+            raise WeatherUnavailableError("Weather service is temporarily unavailable")
+
+        params = {"q": city, "units": self.units}
+        if self.api_key:
+            params["appid"] = self.api_key
+        session = self._get_session()
+        try:
+            with WEATHER_PROVIDER_LATENCY.time(kind=kind):
+                async with session.get(self.base_url + _PATHS[kind], params=params) as resp:
+                    if resp.status == 404:
+                        # The provider answered correctly; an unknown city is not a failure
+                        self.breaker.record_success()
+                        WEATHER_ERRORS.inc(reason="not_found")
+                        raise CityNotFoundError(f"City not found: {city}")
+                    resp.raise_for_status()
+                    data = await resp.json(content_type=None)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            WEATHER_ERRORS.inc(reason="timeout")
+            raise WeatherUnavailableError("Weather service timed out") from None
+        except aiohttp.ClientError as e:
+            self.breaker.record_failure()
+            WEATHER_ERRORS.inc(reason="provider")
+            logger.warning("Weather provider error for %s %r: %s", kind, city, e)
+            raise WeatherUnavailableError("Weather service is unavailable") from None
+
+        self.breaker.record_success()
+        self.cache.set(key, data, self.ttls[kind])
+        return data
@@ -4,8 +4,8 @@ Production startup script for the Teams Add Bot
 Uses Gunicorn for production deployment
 """
 
+import logging
 import os
-import multiprocessing
 from gunicorn.app.wsgiapp import WSGIApplication
 
 class StandaloneApplication(WSGIApplication):
@@ -24,22 +24,41 @@ class StandaloneApplication(WSGIApplication):
         return self.application
 
 if __name__ == '__main__':
-    from app import app
-    
-    # Gunicorn configuration
-    options = {
-        'bind': f"0.0.0.0:{os.getenv('PORT', '8000')}",
-        'workers': multiprocessing.cpu_count() * 2 + 1,
-        'worker_class': 'sync',
-        'worker_connections': 1000,
-        'timeout': 120,
-        'keepalive': 5,
-        'max_requests': 1000,
-        'max_requests_jitter': 100,
-        'access_log': '-',
-        'error_log': '-',
-        'log_level': 'info',
-        'capture_output': True,
-    }
-    
+    from gunicorn_config import AIOHTTP_WORKER, resolve
+
+    # Worker class, workers and threads come from the host and BOT_* settings; see gunicorn_config.py
+    resolved, reasons = resolve()
+
+    # BOT_SERVER_MODE=aiohttp serves every turn on one event loop per worker
+    from logging_setup import configure_logging
+    if resolved['worker_class'] == AIOHTTP_WORKER:
+        from aio_app import create_app
+        configure_logging()
+        app = create_app()
+    else:
+        from app import app
+
+    logging.getLogger(__name__).info(
+        "Resolved gunicorn config: %s %s x %s threads",
+        resolved['worker_class'], resolved['workers'], resolved['threads'],
+        extra={'gunicorn': resolved, 'reasons': reasons},
+    )
+
+    # Workers publish metrics to a shared directory; start each run from an empty one
+    from bot_runtime import clear_metrics_directory, preload
+    clear_metrics_directory()
+
+    # The app is built above, in the master; finish warming it so workers fork ready to serve
+    preload()
+
+    # The request metrics and JSON logs cover each request; BOT_ACCESS_LOG=true adds gunicorn's access log
+    options = dict(
+        resolved,
+        preload_app=True,
+        accesslog='-' if os.getenv('BOT_ACCESS_LOG', 'false').lower() == 'true' else None,
+        errorlog='-',
+        loglevel='info',
+        capture_output=True,
+    )
+
     StandaloneApplication(app, options).run()